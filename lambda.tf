@@ -85,8 +85,28 @@ module "lambda_pers_accumulation_controller" {
   }
 }
 
+module "lambda_demo_event_router" {
+  source        = "./modules/lambda/functions/event_router"
+  function_name = "${local.project_name}-demo-event-router-function"
+  function_path = "event_router"
+  handler       = "lambda_function.lambda_handler"
+  runtime       = "python3.12"
+  role_arn      = aws_iam_role.lambda_exec.arn
+  environment_variables = {
+    OANDA_RESTAPI_TOKEN = local.DEMO_OANDA_RESTAPI_TOKEN
+    OANDA_ACCOUNT_ID    = local.DEMO_OANDA_ACCOUNT_ID
+    OANDA_API_URL       = local.DEMO_OANDA_API_URL
+    ACCOUNT_MODE        = local.ACCOUNT_MODE_DEMO  # デモ環境
+  }
+  # 個別の関数から移行する際に設定する（二重に発注しないよう個別の関数のルールは止めること）
+  # schedules = {
+  #   esperanto    = "rate(1 minute)"
+  #   accumulation = "cron(0 3 ? * MON-FRI *)"
+  # }
+}
+
 ###
-# Common IAM 
+# Common IAM
 ###
 resource "aws_iam_role" "lambda_exec" {
   name = "${local.project_name}-lambda-exec-role"
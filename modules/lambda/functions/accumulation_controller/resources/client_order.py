@@ -0,0 +1 @@
+../../oanda_controller/resources/client_order.py
\ No newline at end of file
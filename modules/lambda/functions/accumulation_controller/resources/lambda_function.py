@@ -1,7 +1,11 @@
 import os
+import time
 import oandapyV20
-from oandapyV20.endpoints import orders, positions, accounts, pricing
-from typing import NamedTuple, Dict, List, Tuple
+from oandapyV20.endpoints import positions, pricing
+from typing import NamedTuple, Dict
+
+from account_state import AccountMirror
+from client_order import client_order_id, submit_order, with_client_extensions
 
 
 # OANDAのAPI設定
@@ -14,8 +18,21 @@ try:
 except Exception:
     raise Exception("ACCOUNT_MODE が設定されていません")
 
+# 接続先の上書き. local（ローカルのスタンドインサーバ）等. 未設定なら ACCOUNT_MODE から決める
+OANDA_ENVIRONMENT = os.environ.get("OANDA_ENVIRONMENT")
+
 # OANDAのAPIクライアントを設定
 # client = oandapyV20.API(access_token=OANDA_API_KEY)
+client = None  # 共有の API クライアント. event_router から注入された場合はこちらを使う
+
+# 積立額の設定（ウォークフォワード検証からも参照する）
+MONTHLY_AMOUNT = 5853658  # 円単位
+DEMO_MONTHLY_AMOUNT = 10000000  # 円単位（デモ）
+TRADING_DAYS_PER_MONTH = 22  # 22日計算
+STRATEGY_TAG = os.environ.get("STRATEGY_TAG", "accumulation")  # 注文・トレードの clientExtensions.tag
+
+# 口座の状態. 証拠金のみを使うため AccountSummary から始め、以降は AccountChanges で差分のみを取得する
+account_mirror = AccountMirror(OANDA_ACCOUNT_ID, details=False)
 
 
 class OANDA:
@@ -34,10 +51,12 @@ class OANDA:
         self.account_id = account_id
         self.api_key = api_key
         self.api_url = api_url
-        environment = "practice" if ACCOUNT_MODE == "DEMO" else "live"
+        environment = OANDA_ENVIRONMENT or (
+            "practice" if ACCOUNT_MODE == "DEMO" else "live"
+        )
         print(self.account_id, self.api_key, self.api_url)
         print(f"{environment=}")
-        self.client = oandapyV20.API(
+        self.client = client or oandapyV20.API(
             access_token=api_key, environment=environment
         )
 
@@ -99,9 +118,12 @@ class OANDA:
                     # }
                 }
             }
-            r = orders.OrderCreate(self.oanda.account_id, data=order_data)
-            response = self.oanda.client.request(r)
-            return response
+            # 積立は 1日 1回のため、通貨ペア・売買・日付からクライアント注文 ID を作る（同じ日の再実行では同じ注文を送り直さない）
+            # units は再実行時の価格で変わるため含めない
+            side = "buy" if int(units) > 0 else "sell"
+            client_id = client_order_id(STRATEGY_TAG, instrument, side, time.strftime("%Y-%m-%d", time.gmtime()))
+            order = with_client_extensions(order_data["order"], client_id, STRATEGY_TAG)
+            return submit_order(self.oanda.client, self.oanda.account_id, order)
 
         # ポジション決済を送信する関数
         def position_close(
@@ -275,11 +297,8 @@ class OANDA:
             Returns:
                 margin_available (float): 証拠金残高
             """
-            endpoint = accounts.AccountSummary(self.oanda.account_id)
-            print(self.oanda.account_id, endpoint)
-            response = self.oanda.client.request(endpoint)
-            margin_available = float(response["account"]["marginAvailable"])
-            return margin_available
+            account_mirror.sync(self.oanda.client)
+            return account_mirror.margin_available
 
 
 class Accumulation:
@@ -489,6 +508,19 @@ def calculate_units(
     return units
 
 
+# 1日あたりの積立額を計算する関数
+def calc_daily_amount():
+    """1日あたりの積立額（円単位）を返す関数
+
+    Returns:
+        float: 月間の積立額を営業日数で割った金額
+    """
+    monthly_amount = MONTHLY_AMOUNT
+    if ACCOUNT_MODE == "DEMO":
+        monthly_amount = DEMO_MONTHLY_AMOUNT
+    return monthly_amount / TRADING_DAYS_PER_MONTH
+
+
 # Lambdaハンドラー関数
 def lambda_handler(event, context):
     """毎日同じ通貨量を取引し積立を行う"""
@@ -496,10 +528,7 @@ def lambda_handler(event, context):
     """[戦略] レバレッジ 5倍をキープするとして、2年間複利運用すると 2年目での最終的な unit数は 41units になる見込み
         目標金額が 240Myen だとすると 5853658yen/month=unit となる。
         毎月 80万円入金し、5853658yen=40370$ 分購入を続ける"""
-    MONTHLY_AMOUNT = 5853658  # 円単位
-    if ACCOUNT_MODE == "DEMO":
-        MONTHLY_AMOUNT = 10000000  # 円単位（デモ）
-    DAILY_AMOUNT = MONTHLY_AMOUNT / 22  # 22日計算
+    DAILY_AMOUNT = calc_daily_amount()
     try:
         # インスタンスを作成
         oanda = OANDA(
@@ -1,4 +1,5 @@
 import logging
+import os
 from .oandapyV20 import API
 from .exceptions import V20Error
 
@@ -11,6 +12,12 @@ __copyright__ = "Copyright 2016 - 2018 Feite Brekeveld"
 # Version synonym
 VERSION = __version__
 
+# Generating the endpoint docstrings from the example responses and building
+# all definition classes up front is only useful for documentation and
+# interactive use. By default both are deferred until first access; set
+# OANDAPYV20_DYNDOC=1 to restore the eager behaviour.
+DYNDOC = os.environ.get("OANDAPYV20_DYNDOC", "0") == "1"
+
 # Set default logging handler to avoid "No handler found" warnings.
 try:
     from logging import NullHandler
@@ -32,3 +32,8 @@ definitions = {
                    "short) is used to compute the Position value or margin."
     }
 }
+
+
+# the definition classes are created by the package, see __init__.py
+from . import register_definitions  # noqa: E402
+register_definitions("accounts")
@@ -2,9 +2,11 @@
 """Handle trades endpoints."""
 from .apirequest import APIRequest
 from .decorators import dyndoc_insert, endpoint
-from .responses.trades import responses
 from abc import abstractmethod
 
+# example responses, only imported when the docstrings are generated
+responses = "trades"
+
 
 class Trades(APIRequest):
     """Trades - abstract baseclass to handle the trades endpoints."""
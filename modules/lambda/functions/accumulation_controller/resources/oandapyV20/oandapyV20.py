@@ -2,6 +2,7 @@
 """OANDA API wrapper for OANDA's REST-V20 API."""
 
 import json
+import os
 import requests
 import logging
 from .exceptions import V20Error
@@ -16,6 +17,13 @@ TRADING_ENVIRONMENTS = {
     "live": {
         "stream": 'https://stream-fxtrade.oanda.com',
         "api": 'https://api-fxtrade.oanda.com'
+    },
+    # local stand-in server (modules/lambda/scripts/oanda_local_server.py)
+    "local": {
+        "stream": os.environ.get("OANDA_LOCAL_STREAM_URL",
+                                 'http://127.0.0.1:8080'),
+        "api": os.environ.get("OANDA_LOCAL_API_URL",
+                              'http://127.0.0.1:8080')
     }
 }
 
@@ -178,7 +186,7 @@ class API(object):
 
         environment : string
             Provide the environment for OANDA's REST api. Valid values:
-            'practice' or 'live'. Default: 'practice'.
+            'practice', 'live' or 'local'. Default: 'practice'.
 
         headers : dict (optional)
             Provide request headers to be set for a request.
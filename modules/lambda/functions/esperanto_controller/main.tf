@@ -29,7 +29,8 @@ resource "aws_cloudwatch_event_rule" "lambda_schedule" {
   name                = "${var.function_path}_lambda_scheduled_rule"
   description         = "Triggers Lambda every day at 12:00 PM UTC"
   # schedule_expression = "cron(0,5,10,15,20,25,30,35,40,45,50,55 * * * ? *)"  # １分間隔
-  schedule_expression = "rate(1 minute)"  # １分間隔
+  # １分間隔. 土曜（UTC）は終日閉場のため起動しない. 日曜・金曜の閉場時間帯はハンドラ側の market_calendar で打ち切る
+  schedule_expression = "cron(* * ? * SUN-FRI *)"
 }
 
 # CloudWatch Event Target to attach the Lambda to the rule
@@ -0,0 +1 @@
+../../oanda_controller/resources/account_state.py
\ No newline at end of file
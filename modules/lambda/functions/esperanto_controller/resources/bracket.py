@@ -0,0 +1 @@
+../../oanda_controller/resources/bracket.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../oanda_controller/resources/instrument_table.py
\ No newline at end of file
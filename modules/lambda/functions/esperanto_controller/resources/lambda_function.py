@@ -1,17 +1,58 @@
-import json
 import os
+import sys
+import time
 import oandapyV20
-from oandapyV20.endpoints import orders, positions, accounts, pricing
-from typing import NamedTuple, Dict, List, Tuple
+from oandapyV20.endpoints import positions, pricing
+from typing import NamedTuple, Dict, Tuple
 import collections
 
+from account_state import AccountMirror
+from bracket import bracket_order, compute_brackets
+from client_order import client_order_id, submit_order, with_client_extensions
+from instrument_table import InstrumentTable
+from market_calendar import MarketCalendar
+from position_book import PositionBook
+from signal_store import SignalState, SignalStore
+
 # OANDAのAPI設定
 OANDA_ACCOUNT_ID = os.environ["OANDA_ACCOUNT_ID"]
 OANDA_API_KEY = os.environ["OANDA_RESTAPI_TOKEN"]
 OANDA_API_URL = "https://api-fxpractice.oanda.com"  # デモアカウントの場合。ライブアカウントの場合は'https://api-fxtrade.oanda.com'
 
+# 接続先. practice | live | local（ローカルのスタンドインサーバ）
+OANDA_ENVIRONMENT = os.environ.get("OANDA_ENVIRONMENT", "practice")
+
 # OANDAのAPIクライアントを設定
-client = oandapyV20.API(access_token=OANDA_API_KEY)
+client = oandapyV20.API(
+    access_token=OANDA_API_KEY, environment=OANDA_ENVIRONMENT
+)
+
+# エントリー判定・発注サイズのパラメータ（スイープツールからも参照する）
+ENTRY_BASELINE = 0.00001  # esperanto_ratio の閾値. fiveNine 以下以上で仮に設定
+MARGIN_BASELINE = 1500000  # 最大 2% の 30,000円と仮にしたいので 1,500,000 で固定
+RISK_PERCENTAGE = 0.001  # 証拠金に対するリスクの割合
+STOP_LOSS_PIPS = 30  # ストップロスまでの pips
+TAKE_PROFIT_PIPS = 60  # テイクプロフィットまでの pips
+DAEMON_INTERVAL = 60  # 常駐プロセスとして動かす場合のスキャン間隔（秒）
+STRATEGY_TAG = os.environ.get("STRATEGY_TAG", "esperanto")  # 注文・トレードの clientExtensions.tag
+
+# 取引時間カレンダー. 閉場中はネットワーク I/O の前に実行を打ち切る
+calendar = MarketCalendar()
+
+# 三角形ごとの前回シグナル. 状態が変わった時のみ発注する
+signal_store = SignalStore()
+
+# 口座の状態. ウォームなコンテナでは AccountChanges で差分のみを取得する
+account_mirror = AccountMirror(OANDA_ACCOUNT_ID)
+
+# 通貨ペアの pip の位置. ストップロス・テイクプロフィットの計算では API を呼ばない
+instrument_table = InstrumentTable(
+    OANDA_ACCOUNT_ID,
+    lambda: oandapyV20.API(access_token=OANDA_API_KEY, environment=OANDA_ENVIRONMENT),
+)
+
+# 常駐プロセスで約定を非同期に受け取る発注キュー. run_daemon(stream=True) で設定する
+order_stream = None
 
 
 class Price:
@@ -124,8 +165,11 @@ class Price:
     def generate_price_map(self):
         print(f"{self.main_currency_pairs} の price_map を生成します")
         for currency_pair in self.main_currency_pairs:
-            bid, ask, mid = self.get_price(instruments=currency_pair)
-            self.price_map[currency_pair] = self.Prices(bid, ask, mid)
+            quote = self.get_price(instruments=currency_pair)
+            if quote is None:
+                # 取得できない・取引不可の通貨ペアは price_map に含めない（scan でスキップされる）
+                continue
+            self.price_map[currency_pair] = self.Prices(*quote)
         print(f"{self.price_map=}")
 
     def get_price(self, instruments: str):
@@ -145,6 +189,9 @@ class Price:
         # リクエストを送信して現在価格を取得
         try:
             response = client.request(pricing_info)
+            if not MarketCalendar.tradeable_instruments(response["prices"]):
+                print(f"{instruments} は取引できないためスキップします")
+                return None
             prices = response["prices"][0]
             bid = float(prices["bids"][0]["price"])
             ask = float(prices["asks"][0]["price"])
@@ -225,9 +272,11 @@ class Esperanto:
     # esperanto_ratio: float = None  # 相場の何割安か. 0.5 であれば 50%Off と同じ扱い
     long_positions: list = []  # Long するべき通貨ペア
     short_positions: list = []  # Short するべき通貨ペア
+    signals: Dict[str, EsperantoResult] = {}  # 閾値を超えた組み合わせ名 -> 結果
     price: Price = None  # Price インスタンス
+    baseline: float = ENTRY_BASELINE  # エントリー判定の閾値
 
-    def __init__(self, price: Price) -> None:
+    def __init__(self, price: Price, baseline: float = ENTRY_BASELINE) -> None:
         # 初期化を行う
         self.result = self.EsperantoResult()
         self.highest_result = self.EsperantoResult()
@@ -235,7 +284,33 @@ class Esperanto:
         # self.esperanto_ratio = 0
         self.long_positions = []
         self.short_positions = []
+        self.signals = {}
         self.price = price
+        self.baseline = baseline
+
+    def scan(self):
+        """vehicle_currencies の全ての３通貨の組み合わせで esperanto 比率を計算し評価する関数
+        組み合わせの存在しない通貨ペアはスキップする
+        """
+        # 通貨の組み合わせを決めてループ
+        # esperanto比率を計算する
+        for i in range(len(self.vehicle_currencies)):
+            for j in range(i + 1, len(self.vehicle_currencies)):
+                for k in range(j + 1, len(self.vehicle_currencies)):
+                    try:
+                        A, B, C = (
+                            self.vehicle_currencies[i],
+                            self.vehicle_currencies[j],
+                            self.vehicle_currencies[k],
+                        )
+                        self.calc_esperanto_ratio(
+                            self.price.price_map, A, B, C
+                        )
+                        self.evaluate_esperanto_result()
+                        print(f"{self.result=}")
+                    except Exception:
+                        # print(f"{A}, {B}, {C} の組み合わせはありません")
+                        continue
 
     def calc_esperanto_ratio(
         self,
@@ -488,7 +563,7 @@ class Esperanto:
         閾値の判定や、最も高い/安い組み合わせを更新する
         """
         # 基準値の設定  fiveNine 以下以上で仮に設定
-        baseline = 0.00001
+        baseline = self.baseline
         # 現結果の long/short の判定
         flag = (
             "LONG"
@@ -502,6 +577,7 @@ class Esperanto:
             # sim1: 基準値以下のものは全て格納してみる
             self.long_positions += self.result.long_positions
             self.short_positions += self.result.short_positions
+            self.record_signal()
         elif flag == "SHORT" and self.result.esperanto_ratio - baseline > 1:
             # if self.highest_result is None or \
             #     self.result.esperanto_ratio > self.highest_result.esperanto_ratio:  # 上回ったら更新
@@ -509,6 +585,12 @@ class Esperanto:
             # sim1: 基準値以上のものは全て格納してみる
             self.long_positions += self.result.long_positions
             self.short_positions += self.result.short_positions
+            self.record_signal()
+
+    def record_signal(self):
+        """閾値を超えた組み合わせの結果を self.signals に記録する関数"""
+        if self.result.long_positions or self.result.short_positions:
+            self.signals[self.result.combination_name] = self.result
 
     def set_position(self):
         """最終的な結果を long/short positions へ格納する関数"""
@@ -539,22 +621,31 @@ class Esperanto:
         self.long_positions = ["JPY_USD"] となっていた場合、
         self.short_positions = ["USD_JPY"] へと訂正する
         """
+        self.long_positions, self.short_positions = self.correct_pairs(
+            self.long_positions, self.short_positions
+        )
+
+    @staticmethod
+    def correct_pairs(long_positions: list, short_positions: list) -> Tuple[list, list]:
+        """JPY_USD のように取引できない向きの通貨ペアを正しいペアにし、long<->short を入れ替えて返す関数"""
+        long_positions, short_positions = list(long_positions), list(short_positions)
         # JPY_USD が格納されていた場合 long<->short へ正しいペアを入れ直し元を削除する
-        for position_name in self.long_positions[:]:
+        for position_name in long_positions[:]:
             flag = position_name in Price.main_currency_pairs
             if flag is False:
                 l, r = position_name.split("_")[0], position_name.split("_")[1]
                 correct_position_name = f"{r}_{l}"
-                self.short_positions.append(correct_position_name)
-                self.long_positions.remove(position_name)
+                short_positions.append(correct_position_name)
+                long_positions.remove(position_name)
 
-        for position_name in self.short_positions[:]:
+        for position_name in short_positions[:]:
             flag = position_name in Price.main_currency_pairs
             if flag is False:
                 l, r = position_name.split("_")[0], position_name.split("_")[1]
                 correct_position_name = f"{r}_{l}"
-                self.long_positions.append(correct_position_name)
-                self.short_positions.remove(position_name)
+                long_positions.append(correct_position_name)
+                short_positions.remove(position_name)
+        return long_positions, short_positions
 
 
 class FundManagement:
@@ -633,48 +724,44 @@ class TradingEnvironmentAnalysis:
 
 # 証拠金を取得する関数
 def get_account_margin():
-    endpoint = accounts.AccountSummary(OANDA_ACCOUNT_ID)
-    response = client.request(endpoint)
-    margin_available = float(response["account"]["marginAvailable"])
-    return margin_available
+    account_mirror.sync(client)
+    return account_mirror.margin_available
 
 
 # マーケットオーダーを送信する関数
 def place_order(
-    units, instrument="USD_JPY", stop_loss_pips=10, take_profit_pips=20
+    units,
+    instrument="USD_JPY",
+    stop_loss_pips=10,
+    take_profit_pips=20,
+    position_fill="DEFAULT",
+    bracket=None,
+    client_id=None,
 ):
-    # 現在の価格を取得
-    endpoint = pricing.PricingInfo(
-        accountID=OANDA_ACCOUNT_ID, params={"instruments": instrument}
-    )
-    response = client.request(endpoint)
-    current_price = float(response["prices"][0]["closeoutAsk"])
-
-    # 証拠金の2%をリスクとして計算
-    margin_available = get_account_margin()
-    print(f"{margin_available=}")
-    # risk_amount = margin_available * 0.02
-    # stop_loss_price = current_price - (stop_loss_pips * 0.0001)
-    # take_profit_price = current_price + (take_profit_pips * 0.0001)
-
-    order_data = {
-        "order": {
+    # units・ストップロス・テイクプロフィットは呼び出し元でプライスマップと通貨ペアの表から計算済みのため、
+    # 注文ごとに価格・証拠金は取得しない
+    # client_id はスキャン間隔と遷移から作り、再実行でも同じ ID にする（時刻からは作らない）
+    if not client_id:
+        raise Exception("クライアント注文 ID（client_id）が必要です")
+    order = build_order(units, instrument, position_fill, bracket, client_id)
+    return submit_order(client, OANDA_ACCOUNT_ID, order)
+
+
+# 成行注文の内容を作る関数（place_order と order_stream で共有する）
+# bracket（bracket.compute_brackets）を渡すとストップロス・テイクプロフィットを約定時に設定する
+# client_id を渡すとクライアント注文 ID と STRATEGY_TAG を付ける
+def build_order(units, instrument="USD_JPY", position_fill="DEFAULT", bracket=None, client_id=None):
+    if bracket is not None:
+        order = bracket_order(bracket, position_fill)
+    else:
+        order = {
             "units": str(units),  # 正の値は買い、負の値は売り
             "instrument": instrument,
             "timeInForce": "FOK",
             "type": "MARKET",
-            "positionFill": "DEFAULT",
-            # "stopLossOnFill": {
-            #     "price": f"{stop_loss_price:.5f}"
-            # },
-            # "takeProfitOnFill": {
-            #     "price": f"{take_profit_price:.5f}"
-            # }
+            "positionFill": position_fill,  # 両建て口座の DEFAULT は OPEN_ONLY（逆向きの差分は PositionBook.reduce で決済する）
         }
-    }
-    r = orders.OrderCreate(OANDA_ACCOUNT_ID, data=order_data)
-    response = client.request(r)
-    return response
+    return with_client_extensions(order, client_id, STRATEGY_TAG) if client_id else order
 
 
 # ポジション決済を送信する関数
@@ -759,9 +846,40 @@ def calculate_units(
     return units
 
 
+def build_signal_states(esperanto: Esperanto, price: Price) -> Dict[str, SignalState]:
+    """scan で閾値を超えた組み合わせごとに、発注する通貨ペアと units を決める関数
+    同一 pips で同一の損益額となるよう units 数を調整する（最大 2% の 30,000円と仮にしたいので margin=1,500,000 で固定）
+    """
+    states = {}
+    for combination_name, result in esperanto.signals.items():
+        long_positions, short_positions = Esperanto.correct_pairs(
+            result.long_positions, result.short_positions
+        )
+        units = collections.Counter()
+        for pair, sign in [(p, 1) for p in long_positions] + [(p, -1) for p in short_positions]:
+            units[pair] += sign * calculate_units(
+                entry_price=price.price_map[pair].mid,
+                margin=MARGIN_BASELINE,
+                risk_percentage=RISK_PERCENTAGE,
+                stop_loss_pips=STOP_LOSS_PIPS,
+            )
+        states[combination_name] = SignalState(
+            triangle=combination_name,
+            direction="LONG" if result.esperanto_ratio < 1 else "SHORT",
+            esperanto_ratio=result.esperanto_ratio,
+            units=dict(units),
+        )
+    return states
+
+
 # Lambdaハンドラー関数
 def lambda_handler(event, context):
     """通貨の強弱を判断し定時実行する"""
+    status = calendar.status()
+    if not status.is_open:
+        print(f"閉場中のためスキップします. 次の開場: {status.next_open.isoformat()}")
+        return {"statusCode": 200, "body": "Market closed"}
+
     try:
         # プライスマップを取得
         price = Price()
@@ -771,89 +889,67 @@ def lambda_handler(event, context):
         # main_currencies = ["USD_JPY", "EUR_JPY", "GBP_JPY", "AUD_JPY", "NZD_JPY", "EUR_GBP", "EUR_USD",
         # "EUR_AUD", "EUR_NZD", "GBP_USD", "GBP_AUD", "GBP_NZD", "AUD_USD", "AUD_NZD", "NZD_USD"]
 
-        # 通貨の組み合わせを決めてループ
-        # esperanto比率を計算する
-        for i in range(len(esperanto.vehicle_currencies)):
-            for j in range(i + 1, len(esperanto.vehicle_currencies)):
-                for k in range(j + 1, len(esperanto.vehicle_currencies)):
-                    try:
-                        A, B, C = (
-                            esperanto.vehicle_currencies[i],
-                            esperanto.vehicle_currencies[j],
-                            esperanto.vehicle_currencies[k],
-                        )
-                        # A_B = get_rate(f"{A}_{B}")
-                        # B_C = get_rate(f"{B}_{C}")
-                        # C_A = get_rate(f"{C}_{A}")
-
-                        # if A_B and B_C and C_A:
-                        #     ratio = calculate_esperanto_ratio(A_B, B_C, C_A)
-                        #     key = f"{A}_{B}_{C} EsperantoRatio"
-                        #     ratios[key] = ratio
-                        esperanto.calc_esperanto_ratio(
-                            price.price_map, A, B, C
-                        )
-                        esperanto.evaluate_esperanto_result()
-                        print(f"{esperanto.result=}")
-                    except Exception:
-                        # print(f"{A}, {B}, {C} の組み合わせはありません")
-                        continue
-        print(f"{esperanto.lowest_result=}")
-        print(f"{esperanto.highest_result=}")
-        esperanto.set_position()
+        esperanto.scan()
+        # sim1: scan で閾値を超えた組み合わせを全て格納済みのため set_position は使わずペアの是正のみ行う
+        esperanto.change_pair()
         print(f"{esperanto.long_positions=}")
         print(f"{esperanto.short_positions=}")
 
-        # 一番高い比率のものをそれぞれ選択
-        # 結果に基づき long を発注
-        LEVERAGE = 30  # 30倍固定
-        # TODO: 証拠金の特定パーセントにて運用など. 一旦 30,000円で固定してみる
-        # 証拠金計算) margin_baseline = price_map[long_position_pair] * buy_units / LEVERAGE
-        for long_position_pair in esperanto.long_positions:
-            # ptn1: 証拠金額を同一に設定するパターン
-            # margin_baseline = 30000  # 変数再セット
-            # right = long_position_pair.split("_")[1]  # _で分離した右側を取得
-            # if right != "JPY":  # JPY 以外の場合は証拠金を右側の通貨へ換算する
-            #     margin_baseline /= price.price_map[f"{right}_JPY"]
-            # # TODO: 発注 unit 数の平準化（証拠金ベースで計算）
-            # buy_units = int((margin_baseline * LEVERAGE) / price.price_map[long_position_pair])
-            # # buy_units = 10000
-
-            # ptn2: 同一 pips で同一の損益額となるよう units 数を調整するパターン（最大 2% の 30,000円と仮にしたいので margin=1,500,000 で固定してみる）
-            buy_units = calculate_units(
-                entry_price=price.price_map[long_position_pair],
-                margin=1500000,
-                risk_percentage=0.001,
-                stop_loss_pips=30,
-            )
-            print(f"{buy_units=}")
-            response_buy = place_order(
-                buy_units, instrument=long_position_pair
+        book = None  # STRATEGY_TAG の保有. 記録を復元した場合は発注の差分にも使う
+        if not signal_store.seeded:
+            # コールドスタートでは /tmp の記録が消えているため、STRATEGY_TAG の保有を記録に戻してから比べる
+            # （記録が無いと closed にならず、保有が決済されないまま残る）
+            account_mirror.sync(client)
+            book = PositionBook(client, OANDA_ACCOUNT_ID)
+            book.load_trades(account_mirror.trades.values(), STRATEGY_TAG)
+            if signal_store.seed(book.units):
+                print(f"記録の無い保有を復元しました: {book.units}")
+
+        # 前回のシグナルから状態が変わった組み合わせ（new / flipped / closed）がある時のみ発注する
+        transitions = signal_store.transitions(build_signal_states(esperanto, price))
+        print(f"{len(esperanto.signals)} 件のシグナルのうち {len(transitions)} 件が変化しました")
+        if transitions:
+            for transition in transitions:
+                print(f"{transition.kind} {transition.current or transition.previous}")
+            # 目標 units と保有 units の差分のみを発注する（保有はアカウントミラーのトレードのうち STRATEGY_TAG のもの）
+            # 同じ口座の他のストラテジー（accumulation 等）の建玉は差分に含めず、決済もしない
+            if book is None:
+                account_mirror.sync(client)
+                book = PositionBook(client, OANDA_ACCOUNT_ID)
+                book.load_trades(account_mirror.trades.values(), STRATEGY_TAG)
+            deltas = {}
+            for instrument, units in book.delta(signal_store.targets(transitions)).items():
+                # 逆向きの差分は自分のトレードを決済し、残りのみを新規に発注する
+                units = book.reduce(instrument, units)
+                if units:
+                    deltas[instrument] = units
+            # 発注するすべての通貨ペアのストップロス・テイクプロフィットをプライスマップからまとめて計算する
+            priced = {i: u for i, u in deltas.items() if i in price.price_map}
+            pip_locations = {i: instrument_table.get(client, i).pip_location for i in priced}
+            brackets = {
+                b.instrument: b
+                for b in compute_brackets(priced, price.price_map, pip_locations, STOP_LOSS_PIPS, TAKE_PROFIT_PIPS)
+            }
+            # 保有を取得した時点の口座の最後の取引 ID と遷移から作る. 約定の前の再実行では同じクライアント注文 ID になり、
+            # 既に届いた注文は送り直さない（約定の後の再実行は保有が変わり、残りの差分のみを発注する）
+            key = client_order_id(
+                account_mirror.last_transaction_id,
+                *sorted(f"{t.kind}:{(t.current or t.previous).triangle}:{(t.current or t.previous).direction}" for t in transitions),
             )
-            print("Buy order response:", response_buy)
-
-        for short_position_pair in esperanto.short_positions:
-            # ptn1: 証拠金額を同一に設定するパターン
-            # margin_baseline = 30000  # 変数再セット
-            # right = short_position_pair.split("_")[1]  # _で分離した右側を取得
-            # if right != "JPY":  # JPY 以外の場合は証拠金を右側の通貨へ換算する
-            #     margin_baseline /= price.price_map[f"{right}_JPY"]
-            # # TODO: 発注 unit 数の平準化（証拠金ベースで計算）
-            # short_units = int(-1 * ((margin_baseline * LEVERAGE) / price.price_map[short_position_pair]))
-            # # short_units = -10000
-
-            # ptn2: 同一 pips で同一の損益額となるよう units 数を調整するパターン（最大 2% の 30,000円と仮にしたいので margin=1,500,000 で固定してみる）
-            short_units = calculate_units(
-                entry_price=price.price_map[short_position_pair],
-                margin=1500000,
-                risk_percentage=0.001,
-                stop_loss_pips=30,
-            )
-            print(f"{short_units=}")
-            response_sell = place_order(
-                short_units, instrument=short_position_pair
-            )
-            print("Sell order response:", response_sell)
+            for instrument, units in deltas.items():
+                bracket = brackets.get(instrument)
+                client_id = client_order_id(key, instrument, units)
+                print(f"{instrument} {units=} {bracket=} {client_id=}")
+                if order_stream is not None:
+                    # 約定・拒否はトランザクションストリームで受け取るため、レスポンスを待たずに次の注文へ進む
+                    order_stream.submit(build_order(units, instrument, "DEFAULT", bracket, client_id))
+                    print(f"{instrument} の注文を送信しました {client_id=}")
+                    continue
+                response = place_order(units, instrument=instrument, bracket=bracket, client_id=client_id)
+                print("Order response:", response)
+                book.record_fill(response)
+            for transition in transitions:
+                signal_store.apply(transition)
 
         # # TODO: 決済条件の整理
         # if body["orderAction"] == "buy" and body["orderContracts"] == "200"\
@@ -870,6 +966,52 @@ def lambda_handler(event, context):
         return {"statusCode": 500, "body": "Error placing orders"}
 
 
-# ローカルテスト
+def print_order_event(event):
+    """order_stream で確定した約定・拒否・スワップを表示する関数"""
+    transaction = event.transaction
+    if event.kind == "financing":
+        print(f"financing: {transaction.get('financing')} balance: {transaction.get('accountBalance')}")
+        return
+    print(
+        f"{event.kind}: {event.pending.instrument} {event.pending.units} units"
+        f" ({event.latency * 1000:.0f}ms) {transaction.get('price') or transaction.get('rejectReason') or transaction.get('reason')}"
+    )
+
+
+def run_daemon(interval: float = DAEMON_INTERVAL, stream: bool = False):
+    """Lambda ではなく常駐プロセスとして interval 秒ごとにスキャンする関数
+    閉場中は次の開場時刻まで眠る.
+    stream=True なら注文の約定を TransactionsStream で非同期に受け取り、OrderCreate のレスポンスを待たない
+    """
+    global order_stream
+    if stream:
+        from order_stream import OrderStream  # 常駐プロセスでのみ使うため Lambda では import しない
+
+        order_stream = OrderStream(
+            OANDA_ACCOUNT_ID,
+            lambda: oandapyV20.API(access_token=OANDA_API_KEY, environment=OANDA_ENVIRONMENT),
+            on_event=print_order_event,
+        ).start()
+    while True:
+        wait = calendar.seconds_until_open()
+        if wait > 0:
+            print(f"閉場中のため {calendar.next_open().isoformat()} まで待機します")
+            time.sleep(wait)
+            continue
+        started = time.monotonic()
+        if order_stream is not None:
+            # 前回の注文が確定してから保有 units を取得する（未確定のまま差分を求めると二重に発注するため）
+            unresolved = order_stream.wait(timeout=interval)
+            if unresolved:
+                print(f"{len(unresolved)} 件の注文が確定していないためスキャンを見送ります")
+                continue
+        lambda_handler(None, None)
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+# ローカルテスト. --daemon を付けると常駐プロセスとして動かす（--order-stream で約定を非同期に受け取る）
 if __name__ == "__main__":
-    lambda_handler(None, None)
+    if "--daemon" in sys.argv:
+        run_daemon(stream="--order-stream" in sys.argv)
+    else:
+        lambda_handler(None, None)
@@ -0,0 +1,108 @@
+"""FX の取引時間カレンダー
+
+OANDA の FX は NY 時間の日曜 17:00 に開き、金曜 17:00 に閉じる（日々のロールオーバーも NY 17:00）.
+NY 17:00 から翌日の取引日が始まるとみなし、取引日が土日またはブローカーの休日であれば閉場とする.
+ネットワーク I/O 無しで判定できるため、ハンドラの先頭で呼んで閉場中の実行を打ち切ることができる.
+Lambda のランタイムには tzdata が無い場合があるため、米国の夏時間は規則から計算する
+"""
+import datetime
+import os
+from typing import Iterable, List, NamedTuple
+
+ROLLOVER_HOUR = 17  # NY 時間で取引日が切り替わる時刻
+NY_STANDARD_OFFSET = datetime.timedelta(hours=-5)  # EST
+NY_DAYLIGHT_OFFSET = datetime.timedelta(hours=-4)  # EDT
+
+# ブローカーの休日（取引日の MM-DD）. カンマ区切りで上書きできる ex) 12-25,01-01
+MARKET_HOLIDAYS = tuple(
+    h.strip() for h in os.environ.get("MARKET_HOLIDAYS", "12-25,01-01").split(",") if h.strip()
+)
+# "0" で取引時間の判定を無効にする（過去データでの検証・ベンチマーク用）
+MARKET_HOURS_CHECK = os.environ.get("MARKET_HOURS_CHECK", "1") != "0"
+
+
+class MarketStatus(NamedTuple):
+    is_open: bool
+    next_open: datetime.datetime  # 開場中は現在時刻
+    next_close: datetime.datetime  # 閉場中は次の開場後の閉場時刻
+
+
+def nth_sunday(year: int, month: int, n: int) -> datetime.date:
+    """year 年 month 月の第 n 日曜日を返す関数"""
+    first = datetime.date(year, month, 1)
+    return first + datetime.timedelta(days=(6 - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def ny_offset(day: datetime.date) -> datetime.timedelta:
+    """NY 時間の UTC との差を返す関数. 夏時間は 3月第2日曜から 11月第1日曜まで"""
+    if nth_sunday(day.year, 3, 2) <= day < nth_sunday(day.year, 11, 1):
+        return NY_DAYLIGHT_OFFSET
+    return NY_STANDARD_OFFSET
+
+
+def utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class MarketCalendar:
+    """取引日の判定・次の開場 / 閉場時刻の計算と、価格の tradeable フラグによる銘柄の絞り込みを行うクラス"""
+
+    def __init__(self, holidays: Iterable[str] = MARKET_HOLIDAYS, enabled: bool = MARKET_HOURS_CHECK) -> None:
+        self.holidays = frozenset(holidays)
+        self.enabled = enabled
+
+    def trade_date(self, now: datetime.datetime) -> datetime.date:
+        """now（UTC）が属する取引日を返す関数. NY 17:00 以降は翌日の取引日となる"""
+        # 夏時間の切り替えは NY 2:00 のため、NY の標準時の日付で判定して問題ない
+        offset = ny_offset((now + NY_STANDARD_OFFSET).date())
+        return (now + offset + datetime.timedelta(hours=24 - ROLLOVER_HOUR)).date()
+
+    def is_trading_day(self, day: datetime.date) -> bool:
+        return day.weekday() < 5 and day.strftime("%m-%d") not in self.holidays
+
+    def session_start(self, day: datetime.date) -> datetime.datetime:
+        """取引日 day が始まる時刻（前日の NY 17:00）を UTC で返す関数"""
+        previous = day - datetime.timedelta(days=1)
+        local = datetime.datetime.combine(previous, datetime.time(ROLLOVER_HOUR))
+        return (local - ny_offset(previous)).replace(tzinfo=datetime.timezone.utc)
+
+    def is_open(self, now: datetime.datetime = None) -> bool:
+        if not self.enabled:
+            return True
+        return self.is_trading_day(self.trade_date(now or utcnow()))
+
+    def next_open(self, now: datetime.datetime = None) -> datetime.datetime:
+        """次の開場時刻を返す関数. 開場中は now を返す"""
+        now = now or utcnow()
+        if self.is_open(now):
+            return now
+        day = self.trade_date(now)
+        while not self.is_trading_day(day):
+            day += datetime.timedelta(days=1)
+        return self.session_start(day)
+
+    def next_close(self, now: datetime.datetime = None) -> datetime.datetime:
+        """次の閉場時刻を返す関数. 閉場中は次の開場後の閉場時刻を返す"""
+        day = self.trade_date(self.next_open(now))
+        while self.is_trading_day(day + datetime.timedelta(days=1)):
+            day += datetime.timedelta(days=1)
+        return self.session_start(day + datetime.timedelta(days=1))
+
+    def seconds_until_open(self, now: datetime.datetime = None) -> float:
+        """次の開場までの秒数を返す関数. 常駐プロセスはこの秒数だけ眠ればよい"""
+        now = now or utcnow()
+        return max(0.0, (self.next_open(now) - now).total_seconds())
+
+    def status(self, now: datetime.datetime = None) -> MarketStatus:
+        now = now or utcnow()
+        return MarketStatus(self.is_open(now), self.next_open(now), self.next_close(now))
+
+    @staticmethod
+    def tradeable_instruments(prices: List[dict]) -> List[str]:
+        """PricingInfo の prices のうち tradeable な銘柄を返す関数"""
+        return [p["instrument"] for p in prices if p.get("tradeable", True)]
+
+
+# ローカルテスト
+if __name__ == "__main__":
+    print(MarketCalendar().status())
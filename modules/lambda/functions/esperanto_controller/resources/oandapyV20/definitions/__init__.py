@@ -4,10 +4,15 @@
 Most of the endpoint groups have some definitions that apply. These are
 in the definitions package. It is conveniant to have access by a class
 representing a specific group of definitions instead of a dictionary.
+
+Unless DYNDOC is set, the modules are imported on first access and the
+classes of a module are created on first attribute access of that module
+instead of when this package is imported.
 """
 import sys
 from importlib import import_module
 import six
+from .. import DYNDOC
 
 
 dyndoc = """Definition representation of {cls}
@@ -114,6 +119,39 @@ definitionModules = [
     'transactions'
 ]
 
+
+def defer_definition_classes(mod):
+    """Create the definition classes from module 'mod' on first access."""
+    M = sys.modules["oandapyV20.definitions.{}".format(mod)]
+
+    def __getattr__(name):
+        if name == "__all__" or name in M.definitions:
+            M.__dict__.pop("__getattr__", None)
+            make_definition_classes(mod)
+            return getattr(M, name)
+        raise AttributeError("module {!r} has no attribute {!r}".format(
+                             M.__name__, name))
+
+    M.__getattr__ = __getattr__
+
+
+def register_definitions(mod):
+    """Called by each definitions module once its 'definitions' exist."""
+    if DYNDOC:
+        make_definition_classes(mod)
+    else:
+        defer_definition_classes(mod)
+
+
+def __getattr__(name):
+    # import the definitions modules on first access only
+    if name in definitionModules:
+        return import_module("oandapyV20.definitions.{}".format(name))
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+                         __name__, name))
+
+
 # dynamically create all the definition classes from the modules
-for M in definitionModules:
-    make_definition_classes(M)
+if DYNDOC:
+    for M in definitionModules:
+        import_module("oandapyV20.definitions.{}".format(M))
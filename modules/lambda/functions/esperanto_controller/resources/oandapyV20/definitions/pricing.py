@@ -9,3 +9,8 @@ definitions = {
                    "is no valid Price for the Instrument."
     },
 }
+
+
+# the definition classes are created by the package, see __init__.py
+from . import register_definitions  # noqa: E402
+register_definitions("pricing")
@@ -28,3 +28,8 @@ definitions = {
                 "a P/L amount of zero."
     }
 }
+
+
+# the definition classes are created by the package, see __init__.py
+from . import register_definitions  # noqa: E402
+register_definitions("trades")
@@ -637,3 +637,8 @@ definitions = {
             "Order that is being replaced.",
      }
 }
+
+
+# the definition classes are created by the package, see __init__.py
+from . import register_definitions  # noqa: E402
+register_definitions("transactions")
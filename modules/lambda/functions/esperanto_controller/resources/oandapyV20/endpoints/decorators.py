@@ -1,57 +1,89 @@
 # -*- coding: UTF-8 -*-
 """decorators."""
+from importlib import import_module
+
+from .. import DYNDOC
+
+# (obj, src) pairs whose docstrings have not been generated yet
+_pending_docs = []
 
 
 def dyndoc_insert(src):
-    """docstring_insert - a decorator to insert API-docparts dynamically."""
+    """docstring_insert - a decorator to insert API-docparts dynamically.
+
+    src is either the dict with example responses or the name of the module
+    in endpoints.responses holding it. Unless DYNDOC is set, the docstring is
+    left as is and generated later by render_docstrings().
+    """
+    def dec(obj):
+        if DYNDOC:
+            return _insert_docs(obj, src)
+        _pending_docs.append((obj, src))
+        return obj
+
+    return dec
+
+
+def render_docstrings():
+    """Generate the docstrings deferred by dyndoc_insert.
+
+    Only needed for documentation purposes, for instance before help().
+    Every docstring is generated only once.
+    """
+    while _pending_docs:
+        obj, src = _pending_docs.pop(0)
+        _insert_docs(obj, src)
+
+
+def _insert_docs(obj, src):
     # manipulating docstrings this way is tricky due to indentation
     # the JSON needs leading whitespace to be interpreted correctly
     import json
     import re
 
+    if isinstance(src, str):
+        src = import_module(".responses.{}".format(src), __package__).responses
+
     def mkblock(d, flag=0):
         # response, pretty formatted
         v = json.dumps(d, indent=2)
         if flag == 1:
             # strip the '[' and ']' in case of a list holding items
             # that stand on their own (example: tick records from a stream)
-            nw = re.findall('.*?\[(.*)\]', v, flags=re.S)
+            nw = re.findall('.*?\\[(.*)\\]', v, flags=re.S)
             v = nw[0]
         # add leading whitespace for each line and start with a newline
         return "\n{}".format("".join(["{0:>16}{1}\n".format("", L)
                              for L in v.split('\n')]))
 
-    def dec(obj):
-        allSlots = re.findall("\{(_v3.*?)\}", obj.__doc__)
-        docsub = {}
-        sub = {}
-        for k in allSlots:
-            p = re.findall("^(_v3.*)_(.*)", k)
-            p = list(*p)
-            sub.update({p[1]: p[0]})
-
-        for v in sub.values():
-            for k in sub.keys():
-                docsub["{}_url".format(v)] = "{}".format(src[v]["url"])
-                if "resp" == k:
-                    docsub.update({"{}_resp".format(v):
-                                   mkblock(src[v]["response"])})
-                if "body" == k:
-                    docsub.update({"{}_body".format(v):
-                                   mkblock(src[v]["body"])})
-
-                if "params" == k:
-                    docsub.update({"{}_params".format(v):
-                                   mkblock(src[v]["params"])})
-                if "ciresp" == k:
-                    docsub.update({"{}_ciresp".format(v):
-                                   mkblock(src[v]["response"], 1)})
-
-        obj.__doc__ = obj.__doc__.format(**docsub)
-
-        return obj
-
-    return dec
+    allSlots = re.findall("\\{(_v3.*?)\\}", obj.__doc__)
+    docsub = {}
+    sub = {}
+    for k in allSlots:
+        p = re.findall("^(_v3.*)_(.*)", k)
+        p = list(*p)
+        sub.update({p[1]: p[0]})
+
+    for v in sub.values():
+        for k in sub.keys():
+            docsub["{}_url".format(v)] = "{}".format(src[v]["url"])
+            if "resp" == k:
+                docsub.update({"{}_resp".format(v):
+                               mkblock(src[v]["response"])})
+            if "body" == k:
+                docsub.update({"{}_body".format(v):
+                               mkblock(src[v]["body"])})
+
+            if "params" == k:
+                docsub.update({"{}_params".format(v):
+                               mkblock(src[v]["params"])})
+            if "ciresp" == k:
+                docsub.update({"{}_ciresp".format(v):
+                               mkblock(src[v]["response"], 1)})
+
+    obj.__doc__ = obj.__doc__.format(**docsub)
+
+    return obj
 
 
 def endpoint(url, method="GET", expected_status=200):
@@ -1,9 +1,11 @@
 """Handle forexlabs endpoints."""
 from .apirequest import APIRequest
 from .decorators import dyndoc_insert, endpoint
-from .responses.forexlabs import responses
 from abc import abstractmethod
 
+# example responses, only imported when the docstrings are generated
+responses = "forexlabs"
+
 
 class ForexLabs(APIRequest):
     """ForexLabs - abstractbase class to handle the 'forexlabs' endpoints."""
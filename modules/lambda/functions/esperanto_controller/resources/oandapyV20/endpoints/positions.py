@@ -1,9 +1,11 @@
 """Handle position endpoints."""
 from .apirequest import APIRequest
 from .decorators import dyndoc_insert, endpoint
-from .responses.positions import responses
 from abc import abstractmethod
 
+# example responses, only imported when the docstrings are generated
+responses = "positions"
+
 
 class Positions(APIRequest):
     """Positions - abstractbase class to handle the 'positions' endpoints."""
@@ -3,10 +3,12 @@
 from .apirequest import APIRequest
 from ..exceptions import StreamTerminated
 from .decorators import dyndoc_insert, endpoint
-from .responses.pricing import responses
 from types import GeneratorType
 from abc import abstractmethod
 
+# example responses, only imported when the docstrings are generated
+responses = "pricing"
+
 
 class Pricing(APIRequest):
     """Pricing - class to handle pricing endpoint."""
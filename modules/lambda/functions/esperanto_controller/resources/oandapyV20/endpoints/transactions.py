@@ -3,10 +3,12 @@
 from .apirequest import APIRequest
 from ..exceptions import StreamTerminated
 from .decorators import dyndoc_insert, endpoint
-from .responses.transactions import responses
 from types import GeneratorType
 from abc import abstractmethod
 
+# example responses, only imported when the docstrings are generated
+responses = "transactions"
+
 
 class Transactions(APIRequest):
     """Transactions - abstract baseclass to handle transaction endpoints."""
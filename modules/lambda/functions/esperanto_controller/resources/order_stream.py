@@ -0,0 +1,197 @@
+"""トランザクションストリームで約定・拒否を非同期に受け取る発注キュー（常駐プロセス用）
+
+OrderCreate のレスポンスを待たずに次の注文を送れるよう、注文には clientExtensions.id（クライアント注文 ID）を付けて
+スレッドプールから送信し、TransactionsStream で届く ORDER_FILL / ORDER_CANCEL / *_REJECT を未約定の注文と突き合わせる.
+・OrderCreate のレスポンスにも約定・拒否が含まれるため、先に届いた方で確定し後から届いた方は無視する
+・DAILY_FINANCING 等のクライアント注文 ID を持たない取引は口座単位のイベントとして通知する
+・ストリームが切れた場合は再接続し、最後に受け取った ID 以降を TransactionsSinceID で取り直す
+"""
+import json
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from oandapyV20.endpoints import transactions
+from oandapyV20.exceptions import V20Error
+
+from client_order import submit_order
+from client_pool import ClientPool
+
+ORDER_STREAM_WORKERS = 4  # OrderCreate を並列に送信するスレッド数
+RECONNECT_SECONDS = 5  # ストリームが切れた時に再接続するまでの秒数
+
+
+class PendingOrder(NamedTuple):
+    client_id: str
+    instrument: str
+    units: int
+    sent_at: float  # time.monotonic()
+
+
+class OrderEvent(NamedTuple):
+    kind: str  # fill | cancel | reject | financing
+    client_id: Optional[str]
+    pending: Optional[PendingOrder]  # financing は None
+    transaction: dict
+    latency: float  # 送信から確定までの秒数. financing は 0
+
+
+def classify(transaction: dict):
+    """取引を (種類, クライアント注文 ID) に分類する関数. 通知の対象外なら種類は None"""
+    kind = transaction.get("type", "")
+    if kind == "ORDER_FILL":
+        return "fill", transaction.get("clientOrderID")
+    if kind == "ORDER_CANCEL":
+        return "cancel", transaction.get("clientOrderID")
+    if kind.endswith("_REJECT"):
+        return "reject", transaction.get("clientExtensions", {}).get("id")
+    if kind == "DAILY_FINANCING":
+        return "financing", None
+    return None, None
+
+
+class OrderStream:
+    """注文を送信しっぱなしにし、結果をトランザクションストリームで受け取るクラス
+
+    Args:
+        account_id (str): 口座 ID
+        client_factory (Callable): API クライアントを生成する関数. ストリームと送信スレッドごとに 1つ作る
+        on_event (Callable, optional): OrderEvent を受け取る関数. ストリームまたは送信スレッドから 1件ずつ呼ばれる
+        workers (int, optional): OrderCreate を並列に送信するスレッド数
+    """
+
+    def __init__(self, account_id: str, client_factory: Callable, on_event: Callable = None, workers: int = ORDER_STREAM_WORKERS) -> None:
+        self.account_id = account_id
+        self.client_factory = client_factory
+        self.listeners: List[Callable] = [on_event] if on_event else []
+        self.pending: Dict[str, PendingOrder] = {}
+        self.last_transaction_id: Optional[int] = None  # ストリーム・TransactionsSinceID で受け取った最後の ID
+        self.stats = Counter()
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._resolved = threading.Condition(self._lock)
+        self._listener_lock = threading.Lock()  # on_event を同時に呼ばないよう直列にする
+        self._pool = ClientPool(client_factory, workers, "order")
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """ストリームの受信スレッドを起動する関数"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen, name="transactions-stream", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        # 受信中の iter_lines は中断できないため、次の受信（ハートビート）で終了する
+        self._stopped.set()
+        self._pool.shutdown(wait=False)
+
+    def next_client_id(self) -> str:
+        with self._lock:
+            self._sequence += 1
+            return f"order-{int(time.time() * 1000)}-{self._sequence}"
+
+    def submit(self, order: dict) -> str:
+        """注文（OrderCreate の "order" の中身）をキューに入れ、クライアント注文 ID をすぐに返す関数
+        注文に clientExtensions.id が付いていればその ID を使い、無ければ next_client_id で作る
+        """
+        client_id = order.get("clientExtensions", {}).get("id") or self.next_client_id()
+        order = {**order, "clientExtensions": {**order.get("clientExtensions", {}), "id": client_id}}
+        pending = PendingOrder(client_id, order["instrument"], int(order["units"]), time.monotonic())
+        with self._lock:
+            self.pending[client_id] = pending
+            self.stats["submitted"] += 1
+        self._pool.submit(self._send, pending, order)
+        return client_id
+
+    def wait(self, timeout: float = None) -> List[PendingOrder]:
+        """未確定の注文が無くなるまで待ち、timeout までに確定しなかった注文を返す関数"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._resolved:
+            while self.pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._resolved.wait(remaining)
+            return list(self.pending.values())
+
+    def _send(self, client, pending: PendingOrder, order: dict):
+        try:
+            # タイムアウト・5xx はクライアント注文 ID で届いたかを確かめてから送り直す
+            response = submit_order(client, self.account_id, order)
+        except V20Error as e:
+            # 拒否は orderRejectTransaction を含む 4xx で返る. 含まない場合（認証エラー等）も発注されていないため拒否とする
+            try:
+                body = json.loads(e.msg)
+            except (TypeError, ValueError):
+                body = {}
+            transaction = body.get("orderRejectTransaction") or {"type": "ORDER_REQUEST_REJECT", "rejectReason": str(e)}
+            self._resolve("reject", pending.client_id, transaction)
+            return
+        except Exception as e:
+            # 送り直しても確かめられない場合は、ストリーム（再接続時の取り直しを含む）の結果を待つ
+            print(f"{pending.client_id} の送信結果を受け取れませんでした: {e}")
+            return
+        for key in ("orderFillTransaction", "orderCancelTransaction", "orderRejectTransaction"):
+            if key in response:
+                self._resolve(classify(response[key])[0], pending.client_id, response[key])
+
+    def dispatch(self, transaction: dict):
+        """ストリーム・TransactionsSinceID で受け取った取引を処理する関数. 既に受け取った ID は無視する"""
+        transaction_id = int(transaction["id"])
+        if self.last_transaction_id is not None and transaction_id <= self.last_transaction_id:
+            return
+        self.last_transaction_id = transaction_id
+        kind, client_id = classify(transaction)
+        if kind is not None:
+            self._resolve(kind, client_id, transaction)
+
+    def _resolve(self, kind: str, client_id: Optional[str], transaction: dict):
+        with self._resolved:
+            pending = self.pending.pop(client_id, None) if client_id else None
+            if pending is None and kind != "financing":
+                # 他のプロセスの注文、またはレスポンスとストリームの両方で届いた 2回目の通知
+                return
+            self.stats[kind] += 1
+            self._resolved.notify_all()
+        latency = time.monotonic() - pending.sent_at if pending else 0.0
+        event = OrderEvent(kind, client_id, pending, transaction, latency)
+        with self._listener_lock:
+            for listener in self.listeners:
+                listener(event)
+
+    def catch_up(self, client):
+        """最後に受け取った ID 以降の取引を TransactionsSinceID で取り直す関数（再接続時に呼ぶ）"""
+        while self.last_transaction_id is not None:
+            response = client.request(
+                transactions.TransactionsSinceID(self.account_id, params={"id": self.last_transaction_id})
+            )
+            page = response.get("transactions", [])
+            for transaction in page:
+                self.dispatch(transaction)
+            if not page or self.last_transaction_id >= int(response["lastTransactionID"]):
+                return
+
+    def _listen(self):
+        client = self.client_factory()
+        while not self._stopped.is_set():
+            reconnected = self.last_transaction_id is not None
+            try:
+                for record in client.request(transactions.TransactionsStream(self.account_id)):
+                    if self._stopped.is_set():
+                        return
+                    if reconnected:
+                        # 接続が確立してから取り直すことで、切断中の取引を取りこぼさない
+                        self.catch_up(client)
+                        reconnected = False
+                    if record.get("type") == "HEARTBEAT":
+                        if self.last_transaction_id is None:
+                            self.last_transaction_id = int(record["lastTransactionID"])
+                        continue
+                    self.dispatch(record)
+            except Exception as e:
+                print(f"トランザクションストリームが切断されました: {e}")
+            self.stats["reconnects"] += 1
+            self._stopped.wait(RECONNECT_SECONDS)
@@ -0,0 +1,162 @@
+"""esperanto のシグナル状態を三角形（通貨の組み合わせ）ごとに保持するストア
+
+歪みが続く間は毎分同じシグナルが出るため、前回発注したシグナルを記録しておき
+・new: 前回シグナルの無かった三角形にシグナルが出た
+・flipped: LONG <-> SHORT が反転した
+・closed: 前回シグナルのあった三角形からシグナルが消えた
+の状態遷移があった時のみ発注する. 発注量は遷移後の全シグナルの units の合計（目標）と保有 units の差分となる
+
+バックエンドは load / save / delete を持つクラスで差し替えられる.
+既定の SQLite は /tmp に置くため、Lambda ではウォームなコンテナの間のみ状態が残る.
+コールドスタートで記録が空になった場合は seed でストラテジーの保有を 1つのシグナル（HELD_TRIANGLE）として記録し、
+次の遷移で closed として今回のシグナルの目標に合わせる（記録が無いまま保有が決済されずに残らないようにする）
+"""
+import json
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+# sqlite | memory
+SIGNAL_STORE_BACKEND = os.environ.get("SIGNAL_STORE_BACKEND", "sqlite")
+SIGNAL_STORE_PATH = os.environ.get("SIGNAL_STORE_PATH", "/tmp/esperanto_signals.sqlite3")
+HELD_TRIANGLE = "__held__"  # seed で記録する、どの三角形のものか分からない保有
+
+
+class SignalState(NamedTuple):
+    triangle: str  # 組み合わせ名 ex) USD_JPY_EUR
+    direction: str  # LONG | SHORT
+    esperanto_ratio: float
+    units: Dict[str, int]  # 通貨ペアごとの発注 units. short は負の値
+    updated_at: float = 0.0
+
+
+class Transition(NamedTuple):
+    kind: str  # new | flipped | closed
+    previous: Optional[SignalState]
+    current: Optional[SignalState]
+
+
+class MemoryBackend:
+    """プロセス内の dict に保持するバックエンド（ローカルツール・検証用）"""
+
+    def __init__(self) -> None:
+        self.states: Dict[str, SignalState] = {}
+
+    def load(self) -> Dict[str, SignalState]:
+        return dict(self.states)
+
+    def save(self, state: SignalState):
+        self.states[state.triangle] = state
+
+    def delete(self, triangle: str):
+        self.states.pop(triangle, None)
+
+
+class SQLiteBackend:
+    """SQLite のファイルに保持するバックエンド"""
+
+    def __init__(self, path: str = SIGNAL_STORE_PATH) -> None:
+        import sqlite3  # import に 10ms 程かかるため使う時まで遅らせる
+
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS signals ("
+                " triangle TEXT PRIMARY KEY,"
+                " direction TEXT NOT NULL,"
+                " esperanto_ratio REAL NOT NULL,"
+                " units TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+
+    def load(self) -> Dict[str, SignalState]:
+        rows = self.connection.execute(
+            "SELECT triangle, direction, esperanto_ratio, units, updated_at FROM signals"
+        )
+        return {
+            triangle: SignalState(triangle, direction, ratio, json.loads(units), updated_at)
+            for triangle, direction, ratio, units, updated_at in rows
+        }
+
+    def save(self, state: SignalState):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO signals VALUES (?, ?, ?, ?, ?)",
+                (state.triangle, state.direction, state.esperanto_ratio, json.dumps(state.units), state.updated_at),
+            )
+
+    def delete(self, triangle: str):
+        with self.connection:
+            self.connection.execute("DELETE FROM signals WHERE triangle = ?", (triangle,))
+
+
+BACKENDS = {
+    "sqlite": SQLiteBackend,
+    "memory": MemoryBackend,
+}
+
+
+class SignalStore:
+    """前回のシグナルと比較して状態遷移を求め、発注後に記録するクラス"""
+
+    def __init__(self, backend=None) -> None:
+        self._backend = backend
+        self.seeded = False  # seed を呼んだか（プロセスごとに 1回）
+
+    @property
+    def backend(self):
+        # 閉場中等で使わない実行ではファイルを開かないよう初回アクセス時に作る
+        if self._backend is None:
+            self._backend = BACKENDS[SIGNAL_STORE_BACKEND]()
+        return self._backend
+
+    def seed(self, held: Dict[str, int]) -> bool:
+        """記録が空で保有（通貨ペア -> units）がある場合に、保有を 1つのシグナルとして記録する関数. 記録したら True"""
+        self.seeded = True
+        held = {instrument: units for instrument, units in held.items() if units}
+        if not held or self.backend.load():
+            return False
+        self.backend.save(SignalState(HELD_TRIANGLE, "HELD", 0.0, held, time.time()))
+        return True
+
+    def transitions(self, current: Dict[str, SignalState]) -> List[Transition]:
+        """今回のシグナル（三角形 -> SignalState）から状態遷移のリストを返す関数. 変化の無い三角形は含めない"""
+        previous = self.backend.load()
+        result = []
+        for triangle, state in current.items():
+            before = previous.get(triangle)
+            if before is None:
+                result.append(Transition("new", None, state))
+            elif before.direction != state.direction:
+                result.append(Transition("flipped", before, state))
+        for triangle, before in previous.items():
+            if triangle not in current:
+                result.append(Transition("closed", before, None))
+        return result
+
+    def targets(self, transitions: List[Transition]) -> Dict[str, int]:
+        """遷移を反映した後の全シグナルの units を通貨ペアごとに合計し、遷移に関わる通貨ペアの目標 units を返す関数"""
+        states = self.backend.load()
+        instruments = set()
+        for transition in transitions:
+            for state in (transition.previous, transition.current):
+                if state is not None:
+                    instruments.update(state.units)
+            if transition.current is None:
+                states.pop(transition.previous.triangle, None)
+            else:
+                states[transition.current.triangle] = transition.current
+        targets = dict.fromkeys(sorted(instruments), 0)
+        for state in states.values():
+            for instrument, units in state.units.items():
+                if instrument in targets:
+                    targets[instrument] += units
+        return targets
+
+    def apply(self, transition: Transition):
+        """発注が済んだ遷移を記録する関数"""
+        if transition.current is None:
+            self.backend.delete(transition.previous.triangle)
+        else:
+            self.backend.save(transition.current._replace(updated_at=time.time()))
@@ -0,0 +1,50 @@
+resource "null_resource" "create_lambda_zip" {
+  provisioner "local-exec" {
+    command = "bash ${path.module}/../../scripts/create_zip.sh ${var.function_path}"
+  }
+
+  triggers = {
+    always_run = "${timestamp()}"
+  }
+}
+
+resource "aws_lambda_function" "this" {
+  function_name = var.function_name
+  role          = var.role_arn
+  handler       = var.handler
+  runtime       = var.runtime
+  filename      = "${path.module}/lambda_function.zip"
+  source_code_hash = filebase64sha256("${path.module}/lambda_function.zip")
+  timeout = 30
+
+  depends_on = [null_resource.create_lambda_zip]
+
+  environment {
+    variables = var.environment_variables
+  }
+}
+
+# ストラテジーごとの定期実行. ターゲットの入力 {"strategy": "<キー>"} で振り分ける
+resource "aws_cloudwatch_event_rule" "lambda_schedule" {
+  for_each            = var.schedules
+  name                = "${var.function_name}-${each.key}-rule"
+  description         = "Triggers ${each.key} strategy on ${var.function_name}"
+  schedule_expression = each.value
+}
+
+resource "aws_cloudwatch_event_target" "lambda_target" {
+  for_each  = var.schedules
+  rule      = aws_cloudwatch_event_rule.lambda_schedule[each.key].name
+  target_id = "lambda"
+  arn       = aws_lambda_function.this.arn
+  input     = jsonencode({ strategy = each.key })
+}
+
+resource "aws_lambda_permission" "allow_cloudwatch" {
+  for_each      = var.schedules
+  statement_id  = "AllowExecutionFromCloudWatch-${each.key}"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.this.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.lambda_schedule[each.key].arn
+}
@@ -0,0 +1,3 @@
+output "lambda_function_arn" {
+  value = aws_lambda_function.this.arn
+}
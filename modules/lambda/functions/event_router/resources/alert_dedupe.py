@@ -0,0 +1 @@
+../../oanda_controller/resources/alert_dedupe.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../oanda_controller/resources/alert_parser.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../oanda_controller/resources/bulk_close.py
\ No newline at end of file
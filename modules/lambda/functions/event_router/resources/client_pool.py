@@ -0,0 +1 @@
+../../oanda_controller/resources/client_pool.py
\ No newline at end of file
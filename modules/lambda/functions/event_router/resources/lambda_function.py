@@ -0,0 +1,110 @@
+import importlib
+import os
+import time
+
+import oandapyV20
+
+from account_state import AccountMirror
+from shared_client import SharedClient
+
+# OANDAのAPI設定
+OANDA_ACCOUNT_ID = os.environ["OANDA_ACCOUNT_ID"]
+OANDA_API_KEY = os.environ["OANDA_RESTAPI_TOKEN"]
+
+# 接続先. practice | live | local（ローカルのスタンドインサーバ）
+OANDA_ENVIRONMENT = os.environ.get("OANDA_ENVIRONMENT", "practice")
+
+# イベント種別 -> ストラテジーモジュール. 初回のイベントで import する
+STRATEGIES = {
+    "webhook": "strategies.webhook",
+    "esperanto": "strategies.esperanto",
+    "accumulation": "strategies.accumulation",
+}
+
+# 全ストラテジーで共有する API クライアント（価格キャッシュ・メトリクス・口座の状態を含む）
+client = SharedClient(
+    oandapyV20.API(access_token=OANDA_API_KEY, environment=OANDA_ENVIRONMENT),
+    account_mirror=AccountMirror(OANDA_ACCOUNT_ID),
+)
+
+# 読み込み済みのストラテジー. ウォームなコンテナでは再利用する
+loaded_strategies = {}
+
+
+def load_strategy(event_type: str):
+    """ストラテジーモジュールを読み込み、共有クライアントを注入して返す関数
+
+    Args:
+        event_type (str): STRATEGIES のキー. ex) esperanto
+
+    Returns:
+        module: lambda_handler を持つストラテジーモジュール
+    """
+    strategy = loaded_strategies.get(event_type)
+    if strategy is None:
+        started = time.perf_counter()
+        strategy = importlib.import_module(STRATEGIES[event_type])
+        client.metrics.observe(f"import.{event_type}", (time.perf_counter() - started) * 1000)
+        loaded_strategies[event_type] = strategy
+    # ストラテジー側が自前のクライアント・口座の状態を作っていても共有のものへ差し替える
+    strategy.client = client
+    if hasattr(strategy, "account_mirror"):
+        strategy.account_mirror = client.account_mirror
+    return strategy
+
+
+def classify_event(event) -> str:
+    """イベントの種別を判定する関数
+
+    ・{"strategy": "esperanto"} のように明示されていればそれを使う（EventBridge のターゲット入力）
+    ・EventBridge のスケジュールイベントはルール名に含まれるストラテジー名で判定する
+    ・body を持つイベント（関数 URL / API Gateway）は TradingView の webhook とする
+
+    Returns:
+        str: STRATEGIES のキー. 判定できない場合は "unknown"
+    """
+    if not isinstance(event, dict):
+        return "unknown"
+    if event.get("strategy") in STRATEGIES:
+        return event["strategy"]
+    if event.get("source") == "aws.events" or event.get("detail-type") == "Scheduled Event":
+        for resource in event.get("resources", []):
+            for event_type in ("esperanto", "accumulation"):
+                if event_type in resource:
+                    return event_type
+        return "unknown"
+    if "body" in event:
+        return "webhook"
+    return "unknown"
+
+
+def lambda_handler(event, context):
+    """イベントを種別ごとのストラテジーへ振り分ける
+    1つのウォームなコンテナで全種別のイベントを処理し、API クライアントと価格キャッシュを共有する
+    """
+    event_type = classify_event(event)
+    started = time.perf_counter()
+    if event_type == "unknown":
+        # check_event と同じくイベントを記録しておく
+        print(f"{event=}")
+        result = {"statusCode": 400, "body": "Unknown event"}
+    else:
+        try:
+            strategy = load_strategy(event_type)
+            result = strategy.lambda_handler(event, context)
+        except Exception as e:
+            print("Error:", str(e))
+            result = {"statusCode": 500, "body": f"Error in {event_type}"}
+
+    client.metrics.count(f"event.{event_type}")
+    client.metrics.observe(f"handler.{event_type}", (time.perf_counter() - started) * 1000)
+    client.metrics.flush(
+        event_type=event_type,
+        status_code=result.get("statusCode") if isinstance(result, dict) else None,
+    )
+    return result
+
+
+# ローカルテスト
+if __name__ == "__main__":
+    lambda_handler({"strategy": "esperanto"}, None)
@@ -0,0 +1 @@
+../../esperanto_controller/resources/market_calendar.py
\ No newline at end of file
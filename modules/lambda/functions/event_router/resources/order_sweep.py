@@ -0,0 +1 @@
+../../oanda_controller/resources/order_sweep.py
\ No newline at end of file
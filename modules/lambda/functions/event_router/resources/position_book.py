@@ -0,0 +1 @@
+../../oanda_controller/resources/position_book.py
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""ストラテジー間で共有する API クライアント・価格キャッシュ・メトリクス
+
+各ストラテジーモジュールは module.client.request(endpoint) で API を呼ぶため、
+oandapyV20.API と同じ request(endpoint) を持つ SharedClient を注入するだけで
+・1つの requests.Session（keep-alive）を全ストラテジーで使い回す
+・PricingInfo を TTL 付きでキャッシュし、未取得の銘柄はこれまでに要求された銘柄のうち TTL の切れたものとまとめて 1回で取得する
+  （TTL 内の銘柄は取り直さないため、銘柄を 1つずつ要求するコールドなスキャンでも取得するのは新しい銘柄のみとなる）
+・口座の状態（AccountMirror）を 1つ持ち、全ストラテジーで共有する（AccountDetails はコンテナごとに 1回で済む）
+・エンドポイントごとの呼び出し回数とレイテンシを集計する
+ことができる
+"""
+import json
+import re
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+import oandapyV20
+from oandapyV20.endpoints import pricing
+
+from account_state import AccountMirror
+
+PRICE_CACHE_TTL = 1.0  # 価格を再利用する秒数
+ACCOUNT_IN_PATH = re.compile(r"v3/accounts/([^/]+)/")
+
+
+class Metrics:
+    """呼び出し回数・所要時間を集計するクラス
+    flush() で 1行の JSON として出力し、CloudWatch Logs Insights で集計できるようにする
+    """
+
+    def __init__(self) -> None:
+        self.counters = Counter()
+        self.timings: Dict[str, List[float]] = defaultdict(list)
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def observe(self, name: str, milliseconds: float):
+        self.timings[name].append(milliseconds)
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "timings": {
+                name: {
+                    "count": len(values),
+                    "total_ms": round(sum(values), 3),
+                    "max_ms": round(max(values), 3),
+                }
+                for name, values in self.timings.items()
+            },
+        }
+
+    def flush(self, **dimensions) -> dict:
+        """集計結果を出力してリセットする関数"""
+        record = {"metrics": self.snapshot(), **dimensions}
+        print(json.dumps(record, ensure_ascii=False))
+        self.counters.clear()
+        self.timings.clear()
+        return record
+
+
+class PriceCache:
+    """PricingInfo の価格を銘柄ごとに保持するクラス"""
+
+    def __init__(self, ttl: float = PRICE_CACHE_TTL) -> None:
+        self.ttl = ttl
+        self.prices: Dict[str, tuple] = {}  # instrument -> (取得時刻, price)
+        self.instruments: set = set()  # これまでに要求された銘柄. まとめて取得する対象
+
+    def stale(self, instruments) -> List[str]:
+        """instruments のうち未取得か TTL の切れた銘柄を返す関数"""
+        now = time.monotonic()
+        return [
+            instrument for instrument in instruments
+            if instrument not in self.prices or now - self.prices[instrument][0] > self.ttl
+        ]
+
+    def lookup(self, instruments: List[str]):
+        """全銘柄が TTL 内にあれば price のリストを返し、1つでも無ければ None を返す関数"""
+        now = time.monotonic()
+        prices = []
+        for instrument in instruments:
+            cached = self.prices.get(instrument)
+            if cached is None or now - cached[0] > self.ttl:
+                return None
+            prices.append(cached[1])
+        return prices
+
+    def store(self, response: dict):
+        now = time.monotonic()
+        for price in response.get("prices", []):
+            self.prices[price["instrument"]] = (now, price)
+            self.instruments.add(price["instrument"])
+
+    def clear(self):
+        self.prices.clear()
+
+
+class SharedClient:
+    """oandapyV20.API を包み、キャッシュとメトリクスを加えたクライアント"""
+
+    def __init__(
+        self, api: oandapyV20.API, price_cache: PriceCache = None, metrics: Metrics = None, account_mirror: AccountMirror = None
+    ) -> None:
+        self.api = api
+        self.price_cache = price_cache if price_cache is not None else PriceCache()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.account_mirror = account_mirror  # ストラテジーの account_mirror と差し替える口座の状態
+
+    def request(self, endpoint):
+        """oandapyV20.API.request と同じインタフェースで API を呼ぶ関数"""
+        if isinstance(endpoint, pricing.PricingInfo):
+            return self._pricing_info(endpoint)
+        return self._request(type(endpoint).__name__, endpoint)
+
+    def _request(self, name: str, endpoint):
+        self.metrics.count(f"api.{name}")
+        started = time.perf_counter()
+        try:
+            return self.api.request(endpoint)
+        except Exception:
+            self.metrics.count(f"api.{name}.error")
+            raise
+        finally:
+            self.metrics.observe(f"api.{name}", (time.perf_counter() - started) * 1000)
+
+    def _pricing_info(self, endpoint: pricing.PricingInfo):
+        params = endpoint.params or {}
+        instruments = [i for i in params.get("instruments", "").split(",") if i]
+        # 銘柄以外のパラメータ（since 等）が付いている場合はキャッシュしない
+        if not instruments or set(params) - {"instruments"}:
+            return self._request("PricingInfo", endpoint)
+
+        prices = self.price_cache.lookup(instruments)
+        if prices is None:
+            self.metrics.count("price_cache.miss")
+            # 既知の銘柄のうち TTL の切れたものもまとめて 1回で取り直す（TTL 内の銘柄は取り直さない）
+            wanted = self.price_cache.stale(sorted(self.price_cache.instruments | set(instruments)))
+            account_id = ACCOUNT_IN_PATH.match(str(endpoint)).group(1)
+            batch = pricing.PricingInfo(accountID=account_id, params={"instruments": ",".join(wanted)})
+            try:
+                response = self._request("PricingInfo", batch)
+            except oandapyV20.V20Error:
+                # 既知の銘柄に取り扱い終了等があった場合は要求された銘柄のみで取り直す
+                if set(wanted) <= set(instruments):
+                    raise
+                response = self._request("PricingInfo", endpoint)
+            self.price_cache.store(response)
+            prices = self.price_cache.lookup(instruments) or [
+                p for p in response.get("prices", []) if p["instrument"] in instruments
+            ]
+        else:
+            self.metrics.count("price_cache.hit")
+
+        response = {"prices": prices, "time": prices[0]["time"] if prices else None}
+        endpoint.response = response
+        return response
+
+    def close(self):
+        self.api.close()
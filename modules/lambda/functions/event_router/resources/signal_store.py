@@ -0,0 +1 @@
+../../esperanto_controller/resources/signal_store.py
\ No newline at end of file
@@ -0,0 +1,8 @@
+"""event_router から読み込むストラテジー
+
+各モジュールは既存の関数の lambda_function.py へのシンボリックリンクで、
+lambda_handler(event, context) と module.client を持つ
+・webhook: oanda_controller（TradingView の webhook）
+・esperanto: esperanto_controller（定期実行のスキャン）
+・accumulation: accumulation_controller（定期実行の積立）
+"""
@@ -0,0 +1 @@
+../../../accumulation_controller/resources/lambda_function.py
\ No newline at end of file
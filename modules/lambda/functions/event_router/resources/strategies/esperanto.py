@@ -0,0 +1 @@
+../../../esperanto_controller/resources/lambda_function.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../oanda_controller/resources/trailing_stop.py
\ No newline at end of file
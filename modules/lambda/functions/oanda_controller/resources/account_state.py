@@ -0,0 +1,150 @@
+"""口座の状態をプロセス内に複製するアカウントミラー
+
+初回のみ AccountDetails で口座全体（注文・トレード・ポジションを含む）を取得し、
+以降は AccountChanges に sinceTransactionID を付けて前回からの差分のみを取得・反映する.
+変化の無い時のレスポンスは価格で変動する値のみとなり、口座全体を毎回取得・解析せずに済む.
+ウォームなコンテナではモジュール変数として保持し、実行をまたいで再利用する.
+証拠金・残高のみが必要な場合は details=False とし、建玉の多い口座でも AccountSummary から始める
+"""
+import threading
+from typing import Dict
+
+from oandapyV20.endpoints import accounts
+from oandapyV20.exceptions import V20Error
+
+# AccountChanges の state で更新される口座の値（価格で変動するもの）
+ACCOUNT_STATE_FIELDS = (
+    "unrealizedPL",
+    "NAV",
+    "marginUsed",
+    "marginAvailable",
+    "positionValue",
+    "marginCloseoutUnrealizedPL",
+    "marginCloseoutNAV",
+    "marginCloseoutMarginUsed",
+    "marginCloseoutPercent",
+    "marginCloseoutPositionValue",
+    "withdrawalLimit",
+    "marginCallMarginUsed",
+    "marginCallPercent",
+)
+# 取引（Transaction）に含まれる場合に口座の値を更新する項目 -> 口座の項目
+TRANSACTION_FIELDS = {
+    "accountBalance": "balance",
+}
+
+
+class AccountMirror:
+    """AccountDetails + AccountChanges で口座・注文・トレード・ポジションを保持するクラス"""
+
+    def __init__(self, account_id: str, details: bool = True) -> None:
+        self.account_id = account_id
+        self.details = details  # False なら注文・トレード・ポジションは保持しない
+        self.account: dict = {}  # 口座の値（orders / trades / positions を除く）
+        self.orders: Dict[str, dict] = {}  # 注文 ID -> 注文
+        self.trades: Dict[str, dict] = {}  # トレード ID -> トレード
+        self.positions: Dict[str, dict] = {}  # 通貨ペア -> ポジション
+        self.last_transaction_id: str = None
+        self._lock = threading.Lock()  # 常駐プロセスのワーカーから同時に sync されても差分を二重に反映しない
+
+    def sync(self, client):
+        """口座の状態を最新にする関数. 初回は全体を取得し、以降は差分のみを取得する
+
+        Args:
+            client (oandapyV20.API): API クライアント（event_router から注入されたものを使えるよう呼び出し時に渡す）
+        """
+        with self._lock:
+            self._sync(client)
+
+    def _sync(self, client):
+        if self.last_transaction_id is None:
+            self.load(client)
+            return
+        endpoint = accounts.AccountChanges(
+            accountID=self.account_id, params={"sinceTransactionID": self.last_transaction_id}
+        )
+        try:
+            response = client.request(endpoint)
+        except V20Error as e:
+            # sinceTransactionID が古すぎる等で差分を取得できない場合は全体を取り直す
+            print(f"AccountChanges を取得できないため口座全体を取り直します: {e}")
+            self.load(client)
+            return
+        self.apply_changes(response.get("changes", {}))
+        self.apply_state(response.get("state", {}))
+        self.last_transaction_id = response["lastTransactionID"]
+
+    def load(self, client):
+        """AccountDetails（details=False なら AccountSummary）で口座全体を取得する関数"""
+        endpoint = accounts.AccountDetails if self.details else accounts.AccountSummary
+        response = client.request(endpoint(self.account_id))
+        account = dict(response["account"])
+        self.orders = {o["id"]: o for o in account.pop("orders", [])}
+        self.trades = {t["id"]: t for t in account.pop("trades", [])}
+        self.positions = {p["instrument"]: p for p in account.pop("positions", [])}
+        self.account = account
+        self.last_transaction_id = response["lastTransactionID"]
+
+    def apply_changes(self, changes: dict):
+        """AccountChanges の changes（注文・トレード・ポジション・取引）を反映する関数"""
+        for transaction in changes.get("transactions", []):
+            for field, account_field in TRANSACTION_FIELDS.items():
+                if field in transaction:
+                    self.account[account_field] = transaction[field]
+        if not self.details:
+            return
+        for order in changes.get("ordersCreated", []):
+            self.orders[order["id"]] = order
+        for key in ("ordersCancelled", "ordersFilled", "ordersTriggered"):
+            for order in changes.get(key, []):
+                self.orders.pop(order["id"], None)
+        for key in ("tradesOpened", "tradesReduced"):
+            for trade in changes.get(key, []):
+                self.trades[trade["id"]] = trade
+        for trade in changes.get("tradesClosed", []):
+            self.trades.pop(trade["id"], None)
+        for position in changes.get("positions", []):
+            if float(position["long"]["units"]) or float(position["short"]["units"]):
+                self.positions[position["instrument"]] = position
+            else:
+                self.positions.pop(position["instrument"], None)
+        self.account["openTradeCount"] = len(self.trades)
+        self.account["openPositionCount"] = len(self.positions)
+        self.account["pendingOrderCount"] = len(self.orders)
+
+    def apply_state(self, state: dict):
+        """AccountChanges の state（価格で変動する口座・トレード・ポジションの値）を反映する関数"""
+        for field in ACCOUNT_STATE_FIELDS:
+            if field in state:
+                self.account[field] = state[field]
+        if not self.details:
+            return
+        for order_state in state.get("orders", []):
+            order = self.orders.get(order_state["id"])
+            if order is not None:
+                order.update({k: v for k, v in order_state.items() if k != "id"})
+        for trade_state in state.get("trades", []):
+            trade = self.trades.get(trade_state["id"])
+            if trade is not None:
+                trade.update({k: v for k, v in trade_state.items() if k != "id"})
+        for position_state in state.get("positions", []):
+            position = self.positions.get(position_state["instrument"])
+            if position is None:
+                continue
+            position["unrealizedPL"] = position_state.get("netUnrealizedPL", position.get("unrealizedPL"))
+            position["long"]["unrealizedPL"] = position_state.get("longUnrealizedPL", position["long"].get("unrealizedPL"))
+            position["short"]["unrealizedPL"] = position_state.get("shortUnrealizedPL", position["short"].get("unrealizedPL"))
+            if "marginUsed" in position_state:
+                position["marginUsed"] = position_state["marginUsed"]
+
+    @property
+    def margin_available(self) -> float:
+        return float(self.account["marginAvailable"])
+
+    @property
+    def balance(self) -> float:
+        return float(self.account["balance"])
+
+    @property
+    def nav(self) -> float:
+        return float(self.account["NAV"])
@@ -0,0 +1,120 @@
+"""TradingView の webhook アラートの重複を弾くフィルタ
+
+TradingView / Lambda URL は同じアラートを複数回届けることがあるため、
+ストラテジー名・ティッカー・売買・数量・ポジション・バーの時刻から指紋を作り、TTL の間に同じ指紋が届いたら発注しない.
+・ウォームなコンテナではプロセス内の TTL キャッシュ（件数上限付き）でネットワーク I/O の前に判定する
+・ALERT_DEDUPE_TABLE を設定すると DynamoDB の条件付き書き込みでコンテナをまたいで判定する
+バーの時刻はアラートのメッセージに "time": "{{time}}" を含めた場合のみ使う.
+含めない場合（TradingView の既定のテキストを含む）は、発注前の口座の状態（ストラテジーの保有 units と
+口座の最後の取引 ID）を指紋に加える.
+・同じアラートの再送は、約定の前に届けば同じキーになり弾く
+・約定の後に届いた再送は保有が目標（新しいストラテジーポジション）と同じになっているため発注されない
+・次のバーの同じシグナルは、間の注文で最後の取引 ID が進んでいるため別のキー（別のクライアント注文 ID）になる
+時刻もポジションも無いアラートは再送を区別できないため、受け付けない（lambda_function.parse_alert）
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+ALERT_DEDUPE_TTL = float(os.environ.get("ALERT_DEDUPE_TTL", "300"))  # 同じ指紋を重複とみなす秒数
+ALERT_DEDUPE_MAX_ENTRIES = int(os.environ.get("ALERT_DEDUPE_MAX_ENTRIES", "1024"))
+ALERT_DEDUPE_TABLE = os.environ.get("ALERT_DEDUPE_TABLE", "")  # 空なら DynamoDB は使わない
+
+# 指紋に含める Alert（alert_parser.py）の項目
+FINGERPRINT_FIELDS = ("title", "ticker", "action", "contracts", "position_size", "time")
+
+
+def fingerprint(alert) -> str:
+    values = "\x1f".join(str(getattr(alert, field)) for field in FINGERPRINT_FIELDS)
+    return hashlib.sha1(values.encode()).hexdigest()
+
+
+def alert_key(alert, state: str = "") -> str:
+    """重複判定のキー. バーの時刻が無いアラートは発注前の口座の状態（state）を加える"""
+    return fingerprint(alert) if alert.time else f"{fingerprint(alert)}:{state}"
+
+
+class TTLCache:
+    """指紋 -> 有効期限 を追加順に保持するキャッシュ. TTL は一定のため先頭から期限切れになる"""
+
+    def __init__(self, ttl: float = ALERT_DEDUPE_TTL, max_entries: int = ALERT_DEDUPE_MAX_ENTRIES) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()  # 常駐プロセスでは同時に届いた再送を複数のスレッドで判定する
+
+    def add(self, key: str, now: float = None) -> bool:
+        """key を追加し、有効な同じ key が既にあれば False を返す関数"""
+        now = time.time() if now is None else now
+        with self._lock:
+            while self.entries and next(iter(self.entries.values())) <= now:
+                self.entries.popitem(last=False)
+            if key in self.entries:
+                return False
+            self.entries[key] = now + self.ttl
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return True
+
+    def discard(self, key: str):
+        with self._lock:
+            self.entries.pop(key, None)
+
+
+class DynamoDBStore:
+    """DynamoDB のテーブル（パーティションキー fingerprint, TTL 属性 expires_at）に指紋を保持するストア"""
+
+    def __init__(self, table: str = ALERT_DEDUPE_TABLE, ttl: float = ALERT_DEDUPE_TTL) -> None:
+        import boto3  # Lambda のランタイムに含まれる. テーブルを設定した時のみ import する
+
+        self.table = table
+        self.ttl = ttl
+        self.client = boto3.client("dynamodb")
+
+    def add(self, key: str, now: float = None) -> bool:
+        now = time.time() if now is None else now
+        try:
+            # TTL による削除は遅れるため、期限切れの項目は上書きできるようにする
+            self.client.put_item(
+                TableName=self.table,
+                Item={"fingerprint": {"S": key}, "expires_at": {"N": str(int(now + self.ttl))}},
+                ConditionExpression="attribute_not_exists(fingerprint) OR expires_at < :now",
+                ExpressionAttributeValues={":now": {"N": str(int(now))}},
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def discard(self, key: str):
+        self.client.delete_item(TableName=self.table, Key={"fingerprint": {"S": key}})
+
+
+class AlertDeduplicator:
+    """プロセス内のキャッシュ → 永続ストア（任意）の順に指紋を登録し、重複を判定するクラス"""
+
+    def __init__(self, cache: TTLCache = None, store=None) -> None:
+        self.cache = cache or TTLCache()
+        self._store = store
+
+    @property
+    def store(self) -> Optional[DynamoDBStore]:
+        if self._store is None and ALERT_DEDUPE_TABLE:
+            self._store = DynamoDBStore()
+        return self._store
+
+    def claim(self, key: str) -> bool:
+        """key を登録できれば True、TTL 内に同じ key が届いていれば False を返す関数"""
+        if not self.cache.add(key):
+            return False
+        if self.store is not None and not self.store.add(key):
+            return False
+        return True
+
+    def release(self, key: str):
+        """発注に失敗したアラートを再送で受け付けられるよう登録を取り消す関数"""
+        self.cache.discard(key)
+        if self.store is not None:
+            self.store.discard(key)
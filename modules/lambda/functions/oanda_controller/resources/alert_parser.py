@@ -0,0 +1,136 @@
+"""TradingView の webhook の本文を Alert に変換するパーサ
+
+・JSON（アラートのメッセージに独自のテンプレートを設定した場合）
+・TradingView の既定のテキスト（ストラテジーの注文約定アラート. 日本語 / 英語）
+の両方を受け付ける. テキストは事前にコンパイルした正規表現で、JSON は先頭の文字で判定してから json.loads する.
+ティッカー（USDJPY, OANDA:USDJPY）は事前に作った表で OANDA の通貨ペア（USD_JPY）に変換する.
+テキストの本文には __origin__ を含められないため、webhook の URL のクエリ（?__origin__=...）の値を origin とする
+"""
+import base64
+import itertools
+import json
+import re
+from typing import Dict, Iterable, NamedTuple, Optional
+
+TRADING_VIEW_ORIGIN = "__trading_view__"
+
+# ティッカーの表を作る通貨. OANDA で取引できる通貨ペアはこの組み合わせに含まれる
+CURRENCIES = (
+    "USD", "JPY", "EUR", "GBP", "AUD", "NZD", "CAD", "CHF", "ZAR", "HKD",
+    "SGD", "DKK", "NOK", "SEK", "PLN", "CZK", "HUF", "MXN", "TRY", "CNH",
+)
+# 通貨の組み合わせ以外の銘柄（貴金属・CFD）
+OTHER_INSTRUMENTS = ("XAU_USD", "XAG_USD", "XAU_JPY", "XAG_JPY", "BCO_USD", "WTICO_USD")
+
+# TradingView の既定のアラートメッセージ（ストラテジーの注文約定）. 文中の目印 -> パターン
+# 目印の部分文字列検索で言語を決めてから 1つのパターンだけを試す
+TEXT_PATTERNS = {
+    # {{strategy.order.alert_message}} 未設定時の日本語の既定文
+    "の注文が約定しました": re.compile(
+        r"^(?P<title>.+?): (?P<ticker>\S+) で (?P<action>buy|sell) @ (?P<contracts>[\d.]+) の注文が約定しました。"
+        r"新しいストラテジーポジションは (?P<position>-?[\d.]+) です"
+    ),
+    # 英語の既定文
+    " filled on ": re.compile(
+        r"^(?P<title>.+?): order (?P<action>buy|sell) @ (?P<contracts>[\d.]+) filled on (?P<ticker>\S+)\. "
+        r"New strategy position is (?P<position>-?[\d.]+)"
+    ),
+}
+
+
+class Alert(NamedTuple):
+    title: str
+    ticker: str  # TradingView のティッカー ex) USDJPY
+    instrument: Optional[str]  # OANDA の通貨ペア ex) USD_JPY. 表に無いティッカーは None
+    action: str  # buy | sell
+    contracts: str  # 約定した契約数. 数値の表記を揃えた文字列 ex) "100", "200"
+    position_size: Optional[float]  # 約定後のストラテジーのポジション. 無ければ None
+    comment: str = ""
+    time: str = ""  # バーの時刻（重複判定に使う）
+    origin: str = TRADING_VIEW_ORIGIN
+
+
+def build_ticker_table(instruments: Iterable[str]) -> Dict[str, str]:
+    """通貨ペアから ティッカーの表記 -> 通貨ペア の表を作る関数（USDJPY / USD_JPY / USD/JPY）"""
+    table = {}
+    for instrument in instruments:
+        base, _, quote = instrument.partition("_")
+        for ticker in (base + quote, instrument, f"{base}/{quote}"):
+            table[ticker] = instrument
+    return table
+
+
+TICKER_INSTRUMENTS = build_ticker_table(
+    [f"{base}_{quote}" for base, quote in itertools.permutations(CURRENCIES, 2)] + list(OTHER_INSTRUMENTS)
+)
+
+
+def to_instrument(ticker: str) -> Optional[str]:
+    """ティッカーを通貨ペアに変換する関数. 取引所の接頭辞（OANDA:, FX:）は除く"""
+    return TICKER_INSTRUMENTS.get(ticker.rpartition(":")[2].upper())
+
+
+def normalize_contracts(value) -> str:
+    """契約数を "100" のような表記に揃える関数（JSON では 100 / 100.0 / "100" のいずれでも届くため）"""
+    if type(value) is str and value.isdigit():
+        return value  # ほとんどは整数の文字列で届くため変換しない
+    try:
+        return f"{float(value):g}"
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def from_dict(body: dict) -> Alert:
+    get = body.get
+    ticker = str(get("ticker", ""))
+    position_size = get("positionSize")
+    # キーワード引数より速いため Alert の項目順に位置引数で渡す
+    return Alert(
+        str(get("title", "")),
+        ticker,
+        to_instrument(ticker),
+        str(get("orderAction", "")).lower(),
+        normalize_contracts(get("orderContracts", "")),
+        float(position_size) if position_size not in (None, "") else None,
+        str(get("comment") or ""),
+        str(get("time", "")),
+        str(get("__origin__", "")),
+    )
+
+
+def from_text(text: str, origin: str = "") -> Optional[Alert]:
+    for marker, pattern in TEXT_PATTERNS.items():
+        if marker not in text:
+            continue
+        match = pattern.match(text)
+        if match is None:
+            return None
+        # 既定文には __origin__ を含められないため、webhook の URL のクエリ（?__origin__=...）で渡された値を使う
+        ticker = match["ticker"]
+        return Alert(
+            match["title"],
+            ticker,
+            to_instrument(ticker),
+            match["action"],
+            normalize_contracts(match["contracts"]),
+            float(match["position"]),
+            origin=origin,
+        )
+    return None
+
+
+def parse(body, is_base64_encoded: bool = False, origin: str = "") -> Alert:
+    """webhook の本文（文字列または Lambda が解析済みの dict）を Alert に変換する関数
+    origin はテキストの本文の場合のみ使う（JSON は本文の __origin__ を使う）
+    """
+    if isinstance(body, dict):
+        return from_dict(body)
+    if is_base64_encoded:
+        body = base64.b64decode(body).decode("utf-8")
+    text = body.strip()
+    if text[:1] == "{":
+        return from_dict(json.loads(text))
+    alert = from_text(text, origin)
+    if alert is None:
+        raise Exception(f"アラートの本文を解析できません: {text[:80]}")
+    return alert
@@ -0,0 +1,172 @@
+"""webhook のアラートをキューに入れて非同期に発注するワーカープール（常駐プロセス用）
+
+TradingView の webhook は数秒でタイムアウトするため、受け付けたアラートはキューに入れてすぐに応答し、
+ワーカースレッドが順に発注する.
+・同じティッカーのアラートは同じワーカーに振り分け、届いた順に処理する（保有 units との差分が前後しないように）
+・batch_window 秒の間に同じワーカーへ届いたアラートはまとめて process に渡し、通貨ペアごとに相殺して発注できるようにする
+・キューの深さ・キューでの待ち時間・処理時間を metrics() / GET /metrics で返す
+"""
+import json
+import queue
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, NamedTuple
+from urllib.parse import parse_qsl, urlsplit
+
+METRICS_SAMPLES = 1024  # 待ち時間・処理時間のパーセンタイルに使う直近の件数
+
+
+class QueuedAlert(NamedTuple):
+    alert: NamedTuple  # alert_parser.Alert
+    key: str  # 重複判定のキー（alert_key）
+    enqueued_at: float  # time.monotonic()
+
+
+def summarize(samples) -> Dict[str, float]:
+    """直近の所要時間（秒）の件数・平均・p50・p95・最大をミリ秒で返す関数"""
+    values = sorted(samples)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "avg_ms": round(sum(values) / len(values) * 1000, 3),
+        "p50_ms": round(values[len(values) // 2] * 1000, 3),
+        "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+class AlertQueue:
+    """ティッカーごとにワーカーへ振り分けるキュー
+
+    Args:
+        process (Callable): QueuedAlert のリスト（届いた順）を受け取って発注する関数. 例外はログに出して次へ進む
+        workers (int, optional): ワーカースレッド数
+        shard_key (Callable, optional): アラートから振り分けのキーを返す関数. 既定はティッカー
+        batch_window (float, optional): 最初のアラートを取り出してから後続をまとめて待つ秒数. 0 なら 1件ずつ処理する
+    """
+
+    def __init__(self, process: Callable, workers: int = 2, shard_key: Callable = None, batch_window: float = 0.0) -> None:
+        self.process = process
+        self.batch_window = batch_window
+        self.shard_key = shard_key or (lambda alert: alert.ticker)
+        self.queues: List[queue.Queue] = [queue.Queue() for _ in range(max(1, workers))]
+        self.counts = Counter()
+        self.waits = deque(maxlen=METRICS_SAMPLES)  # キューに入ってから取り出されるまでの秒数
+        self.durations = deque(maxlen=METRICS_SAMPLES)  # 発注にかかった秒数
+        self.batch_sizes = deque(maxlen=METRICS_SAMPLES)  # 1回の process に渡したアラートの件数
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        for index, alert_queue in enumerate(self.queues):
+            thread = threading.Thread(target=self._work, args=(alert_queue,), name=f"alert-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def put(self, alert, key: str) -> int:
+        """アラートをキューに入れ、入れた後のキューの深さを返す関数"""
+        alert_queue = self.queues[hash(self.shard_key(alert)) % len(self.queues)]
+        alert_queue.put(QueuedAlert(alert, key, time.monotonic()))
+        with self._lock:
+            self.counts["enqueued"] += 1
+        return self.depth
+
+    @property
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    def join(self):
+        """キューが空になり、取り出したアラートの処理が終わるまで待つ関数"""
+        for alert_queue in self.queues:
+            alert_queue.join()
+
+    def _collect(self, alert_queue: queue.Queue) -> List[QueuedAlert]:
+        """最初のアラートを待ち、batch_window 秒の間に届いた後続のアラートを加えて返す関数"""
+        alerts = [alert_queue.get()]
+        if self.batch_window <= 0:
+            return alerts
+        deadline = time.monotonic() + self.batch_window
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                alerts.append(alert_queue.get(timeout=remaining) if remaining > 0 else alert_queue.get_nowait())
+            except queue.Empty:
+                return alerts
+
+    def _work(self, alert_queue: queue.Queue):
+        while True:
+            alerts = self._collect(alert_queue)
+            started = time.monotonic()
+            try:
+                self.process(alerts)
+                result = "processed"
+            except Exception as e:
+                print("Error:", str(e))
+                result = "failed"
+            finally:
+                with self._lock:
+                    self.counts[result] += len(alerts)
+                    self.counts["batches"] += 1
+                    self.waits.extend(started - alert.enqueued_at for alert in alerts)
+                    self.durations.append(time.monotonic() - started)
+                    self.batch_sizes.append(len(alerts))
+                for _ in alerts:
+                    alert_queue.task_done()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "depth": self.depth,
+                "depth_by_worker": [q.qsize() for q in self.queues],
+                "enqueued": self.counts["enqueued"],
+                "processed": self.counts["processed"],
+                "failed": self.counts["failed"],
+                "batches": self.counts["batches"],
+                "max_batch_size": max(self.batch_sizes, default=0),
+                "time_in_queue": summarize(self.waits),
+                "process_time": summarize(self.durations),
+            }
+
+
+def serve(host: str, port: int, accept: Callable[[dict], dict], alert_queue: AlertQueue) -> ThreadingHTTPServer:
+    """webhook を受けるサーバを作る関数
+
+    POST は Lambda URL と同じ形の event（{"body": 本文, "headers", "queryStringParameters", "requestContext"}）にして accept に渡し、
+    その {"statusCode", "body"} をそのまま返す. GET /metrics はキューのメトリクスを JSON で返す
+    """
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def _respond(self, status: int, body: str, content_type: str = "text/plain; charset=utf-8"):
+            payload = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            query = dict(parse_qsl(urlsplit(self.path).query))
+            event = {
+                "body": self.rfile.read(length).decode("utf-8"),
+                "headers": {k.lower(): v for k, v in self.headers.items()},
+                "queryStringParameters": query or None,  # Lambda URL と同じくクエリが無ければ None
+                "isBase64Encoded": False,
+            }
+            response = accept(event)
+            self._respond(response["statusCode"], response["body"])
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/metrics":
+                self._respond(200, json.dumps(alert_queue.metrics()), "application/json")
+            else:
+                self._respond(404, "Not Found")
+
+        def log_message(self, format, *args):
+            pass  # アクセスログは出さない（発注のログは accept / ワーカーが出す）
+
+    return ThreadingHTTPServer((host, port), WebhookHandler)
@@ -0,0 +1,76 @@
+"""成行注文にストップロス・テイクプロフィットを付けるブラケット注文のビルダー
+
+発注する注文のストップロス・テイクプロフィットの価格を、プライスマップと pip の位置から列ごとにまとめて 1回で計算し、
+oandapyV20.contrib.requests の MarketOrderRequest / onfill で stopLossOnFill・takeProfitOnFill を付けた注文を組み立てる.
+注文ごとに OrderCreate 1回で決済注文まで設定されるため、約定後に決済注文を別に送る必要はない
+"""
+from typing import List, Mapping, NamedTuple, Optional
+
+
+class Quote(NamedTuple):
+    bid: float
+    ask: float
+
+
+class Bracket(NamedTuple):
+    instrument: str
+    units: int  # 正の値は買い、負の値は売り
+    entry: float  # 約定を見込む価格（買いは ask, 売りは bid）
+    stop_loss: float
+    take_profit: Optional[float]  # take_profit_pips を指定しない場合は None
+
+
+def compute_brackets(
+    units: Mapping[str, int],
+    price_map: Mapping[str, NamedTuple],
+    pip_locations: Mapping[str, int],
+    stop_loss_pips: float,
+    take_profit_pips: float = None,
+) -> List[Bracket]:
+    """通貨ペア -> units の注文すべてのストップロス・テイクプロフィットを計算する関数
+
+    Args:
+        units (Mapping[str, int]): 通貨ペア -> 発注する units
+        price_map (Mapping[str, NamedTuple]): 通貨ペア -> bid / ask を持つ価格（Price.price_map / Quote）
+        pip_locations (Mapping[str, int]): 通貨ペア -> pip の位置 ex) USD_JPY は -2
+        stop_loss_pips (float): 約定を見込む価格からストップロスまでの pips
+        take_profit_pips (float, optional): 約定を見込む価格からテイクプロフィットまでの pips
+    """
+    # 注文ごとにループで組み立てず、列（通貨ペア・向き・価格・pip）ごとに 1回の走査で計算する
+    instruments = list(units)
+    signs = [1 if units[i] > 0 else -1 for i in instruments]
+    entries = [price_map[i].ask if sign > 0 else price_map[i].bid for i, sign in zip(instruments, signs)]
+    pips = [10.0 ** pip_locations[i] for i in instruments]
+    # 価格の桁数は pip の 1桁下まで（表示桁数を超える価格は PRICE_PRECISION_EXCEEDED で拒否される）
+    digits = [1 - pip_locations[i] for i in instruments]
+    stops = [
+        round(entry - sign * stop_loss_pips * pip, digit)
+        for entry, sign, pip, digit in zip(entries, signs, pips, digits)
+    ]
+    if take_profit_pips is None:
+        profits = [None] * len(instruments)
+    else:
+        profits = [
+            round(entry + sign * take_profit_pips * pip, digit)
+            for entry, sign, pip, digit in zip(entries, signs, pips, digits)
+        ]
+    return [
+        Bracket(instrument, units[instrument], entry, stop, profit)
+        for instrument, entry, stop, profit in zip(instruments, entries, stops, profits)
+    ]
+
+
+def bracket_order(bracket: Bracket, position_fill: str = "DEFAULT", client_extensions: dict = None) -> dict:
+    """Bracket から OrderCreate の "order" の中身を作る関数"""
+    # contrib.requests は全種類の注文を import するため、発注しない実行のコールドスタートに含めない
+    from oandapyV20.contrib.requests import MarketOrderRequest, StopLossDetails, TakeProfitDetails
+
+    request = MarketOrderRequest(
+        instrument=bracket.instrument,
+        units=bracket.units,
+        positionFill=position_fill,
+        clientExtensions=client_extensions,
+        stopLossOnFill=StopLossDetails(price=bracket.stop_loss).data,
+        takeProfitOnFill=TakeProfitDetails(price=bracket.take_profit).data if bracket.take_profit is not None else None,
+    )
+    return request.data["order"]
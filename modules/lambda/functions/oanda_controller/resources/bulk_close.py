@@ -0,0 +1,125 @@
+"""建玉をまとめて決済する一括決済（すべての買い / すべての売り / 全決済 / ストラテジーのタグ）
+
+OpenPositions を 1回だけ呼んで必要な PositionClose を決め、スレッドプールから並列に送信して
+実現損益を 1つの集計（CloseSummary）にまとめて返す.
+・全決済は 1つの通貨ペアにつき PositionClose 1回で long / short の両方を決済する
+・タグの指定はポジションに含まれないため、OpenTrades を 1回だけ呼んで該当するトレードを TradeClose する
+・決済に失敗した通貨ペア・トレードは errors に残し、他の決済は続ける
+"""
+import os
+import time
+from typing import Callable, Iterable, List, NamedTuple, Sequence
+
+from oandapyV20.endpoints import positions, trades
+from oandapyV20.exceptions import V20Error
+
+from client_order import v20_error_message
+from client_pool import ClientPool
+
+BULK_CLOSE_WORKERS = int(os.environ.get("BULK_CLOSE_WORKERS", "8"))  # 決済を並列に送信するスレッド数
+
+# 決済の種類 -> 決済するポジションの向き
+CLOSE_SIDES = {
+    "long": ("long",),
+    "short": ("short",),
+    "all": ("long", "short"),
+}
+# 決済のレスポンスに含まれる約定の取引
+FILL_KEYS = ("orderFillTransaction", "longOrderFillTransaction", "shortOrderFillTransaction")
+
+
+class CloseSummary(NamedTuple):
+    requests: int  # 送信した PositionClose / TradeClose の数
+    units: int  # 決済した units（絶対値の合計）
+    realized_pl: float  # 実現損益（口座通貨）
+    financing: float
+    fills: List[dict]  # 約定の取引
+    errors: List[str]  # 決済に失敗した通貨ペア・トレードとエラー
+    seconds: float
+
+
+def plan_position_closes(account_id: str, open_positions: Iterable[dict], sides: Sequence[str]) -> list:
+    """OpenPositions の positions から、保有している向きのみを決済する PositionClose を作る関数"""
+    endpoints = []
+    for position in open_positions:
+        data = {f"{side}Units": "ALL" for side in sides if int(float(position[side]["units"]))}
+        if data:
+            endpoints.append(positions.PositionClose(accountID=account_id, instrument=position["instrument"], data=data))
+    return endpoints
+
+
+def plan_trade_closes(account_id: str, open_trades: Iterable[dict], tag: str) -> list:
+    """OpenTrades の trades から、clientExtensions.tag が一致するトレードを決済する TradeClose を作る関数"""
+    return [
+        trades.TradeClose(accountID=account_id, tradeID=trade["id"])
+        for trade in open_trades
+        if trade.get("clientExtensions", {}).get("tag") == tag
+    ]
+
+
+def summarize(results: list, seconds: float) -> CloseSummary:
+    """(endpoint, レスポンス, エラー) のリストを集計する関数"""
+    fills, errors = [], []
+    for endpoint, response, error in results:
+        if error is not None:
+            errors.append(f"{endpoint}: {error}")
+            continue
+        fills += [response[key] for key in FILL_KEYS if key in response]
+    return CloseSummary(
+        len(results),
+        sum(abs(int(float(fill["units"]))) for fill in fills),
+        sum(float(fill.get("pl", 0)) for fill in fills),
+        sum(float(fill.get("financing", 0)) for fill in fills),
+        fills,
+        errors,
+        seconds,
+    )
+
+
+class BulkCloser:
+    """決済を ClientPool から並列に送信するクラス
+
+    Args:
+        account_id (str): 口座 ID
+        client_factory (Callable): API クライアントを生成する関数. 送信スレッドごとに 1つ作る
+        workers (int, optional): 決済を並列に送信するスレッド数
+    """
+
+    def __init__(self, account_id: str, client_factory: Callable, workers: int = BULK_CLOSE_WORKERS) -> None:
+        self.account_id = account_id
+        self._pool = ClientPool(client_factory, workers, "close")
+
+    def close_longs(self, client) -> CloseSummary:
+        return self.close_positions(client, CLOSE_SIDES["long"])
+
+    def close_shorts(self, client) -> CloseSummary:
+        return self.close_positions(client, CLOSE_SIDES["short"])
+
+    def flatten(self, client) -> CloseSummary:
+        return self.close_positions(client, CLOSE_SIDES["all"])
+
+    def close_positions(self, client, sides: Sequence[str]) -> CloseSummary:
+        """OpenPositions を 1回呼び、sides の向きのポジションをすべて決済する関数"""
+        started = time.monotonic()
+        response = client.request(positions.OpenPositions(accountID=self.account_id))
+        return self.execute(plan_position_closes(self.account_id, response.get("positions", []), sides), started)
+
+    def close_tag(self, client, tag: str) -> CloseSummary:
+        """OpenTrades を 1回呼び、clientExtensions.tag が tag のトレードをすべて決済する関数"""
+        started = time.monotonic()
+        response = client.request(trades.OpenTrades(accountID=self.account_id))
+        return self.execute(plan_trade_closes(self.account_id, response.get("trades", []), tag), started)
+
+    def execute(self, endpoints: list, started: float = None) -> CloseSummary:
+        """決済のエンドポイントを並列に送信し、結果を集計する関数"""
+        started = time.monotonic() if started is None else started
+        results = self._pool.map(self._send, endpoints)
+        return summarize(results, time.monotonic() - started)
+
+    def _send(self, client, endpoint):
+        try:
+            return endpoint, client.request(endpoint), None
+        except V20Error as e:
+            return endpoint, None, v20_error_message(e)
+        except Exception as e:
+            return endpoint, None, str(e)
@@ -0,0 +1,133 @@
+"""注文にクライアント注文 ID・ストラテジーのタグを付け、タイムアウトしても二重に発注しない送信
+
+・クライアント注文 ID は注文の元（アラートの指紋・通貨ペア・units 等）から決まり、送り直しても変わらない
+・タグは注文・約定したトレード・ストップロス等の紐づく注文のすべてに付け、タグ単位の決済・取消に使う
+・OrderCreate がタイムアウト・接続エラー・5xx で結果が分からない場合は、OrderDetails（@クライアント注文 ID）で
+  注文が届いたかを確かめ、届いていればその結果を返し、届いていなければ同じクライアント注文 ID で送り直す
+・OANDA は同じクライアント注文 ID の注文を CLIENT_ORDER_ID_ALREADY_EXISTS で拒否するため、
+  確認の後に元の注文が届いても二重には約定しない. タイムアウトを短くしても安全に送り直せる
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+
+from oandapyV20.endpoints import orders, transactions
+from oandapyV20.exceptions import V20Error
+from requests.exceptions import RequestException
+
+ORDER_RETRIES = int(os.environ.get("ORDER_RETRIES", "2"))  # 結果が分からない注文を送り直す回数
+ORDER_RETRY_BACKOFF = float(os.environ.get("ORDER_RETRY_BACKOFF", "0.2"))  # 確認までの待ち秒数（送り直すごとに倍）
+CLIENT_ID_PREFIX = "oc"
+MAX_EXTENSION_LENGTH = 128  # clientExtensions の id / tag の最大文字数
+
+# 約定時に作られる紐づく注文の項目
+ON_FILL_KEYS = ("stopLossOnFill", "takeProfitOnFill", "trailingStopLossOnFill")
+# 注文の状態 -> 結果の取引の ID を持つ項目・OrderCreate のレスポンスの項目
+RESULT_FIELDS = (
+    ("fillingTransactionID", "orderFillTransaction"),
+    ("cancellingTransactionID", "orderCancelTransaction"),
+)
+
+
+def client_order_id(*parts) -> str:
+    """注文の元になる値からクライアント注文 ID を作る関数. 同じ値からは同じ ID になる"""
+    digest = hashlib.sha1("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+    return f"{CLIENT_ID_PREFIX}-{digest[:24]}"
+
+
+def strategy_tag(*titles: str) -> str:
+    """ストラテジー名からタグを作る関数. 複数のストラテジーをまとめた注文は名前を + でつなぐ"""
+    return "+".join(sorted({title.strip() for title in titles if title.strip()}))[:MAX_EXTENSION_LENGTH]
+
+
+def with_client_extensions(order: dict, client_id: str, tag: str) -> dict:
+    """注文（OrderCreate の "order" の中身）にクライアント注文 ID とタグを付ける関数"""
+    order = {
+        **order,
+        "clientExtensions": {**order.get("clientExtensions", {}), "id": client_id, "tag": tag},
+        "tradeClientExtensions": {**order.get("tradeClientExtensions", {}), "tag": tag},
+    }
+    for key in ON_FILL_KEYS:
+        if key in order:
+            order[key] = {**order[key], "clientExtensions": {"tag": tag}}
+    return order
+
+
+def error_code(error: V20Error) -> Optional[str]:
+    try:
+        return json.loads(error.msg).get("errorCode")
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def v20_error_message(error: V20Error) -> str:
+    """V20Error のレスポンスから errorMessage を取り出す関数. JSON でなければエラーをそのまま文字列にする"""
+    try:
+        return json.loads(error.msg).get("errorMessage", error.msg)
+    except (TypeError, ValueError, AttributeError):
+        return str(error)
+
+
+def find_order(client, account_id: str, client_id: str) -> Optional[dict]:
+    """クライアント注文 ID の注文を探し、OrderCreate と同じ項目のレスポンスにして返す関数. 届いていなければ None"""
+    try:
+        response = client.request(orders.OrderDetails(account_id, f"@{client_id}"))
+    except V20Error as e:
+        if e.code == 404 or e.code >= 500:
+            return None
+        raise
+    except RequestException:
+        # 確認もできない場合は送り直す. 届いていれば CLIENT_ORDER_ID_ALREADY_EXISTS で拒否される
+        return None
+    order = response["order"]
+    found = {"order": order, "lastTransactionID": response.get("lastTransactionID")}
+    for field, key in RESULT_FIELDS:
+        if field in order:
+            found[key] = client.request(transactions.TransactionDetails(account_id, order[field]))["transaction"]
+    return found
+
+
+def submit_order(
+    client,
+    account_id: str,
+    order: dict,
+    retries: int = ORDER_RETRIES,
+    backoff: float = ORDER_RETRY_BACKOFF,
+    lookup_client=None,
+) -> dict:
+    """クライアント注文 ID の付いた注文を送信し、結果が分からなければ確かめてから送り直す関数
+
+    Args:
+        client (oandapyV20.API): 送信するクライアント. request_params の timeout で送信を打ち切る
+        account_id (str): 口座 ID
+        order (dict): with_client_extensions でクライアント注文 ID を付けた注文
+        retries (int, optional): 送り直す回数
+        backoff (float, optional): 確認までの待ち秒数. 送り直すごとに倍にする
+        lookup_client (oandapyV20.API, optional): 確認に使うクライアント. client の timeout を短くした場合は打ち切らないクライアントを渡す
+    """
+    client_id = order["clientExtensions"]["id"]
+    lookup_client = lookup_client or client
+    for attempt in range(retries + 1):
+        try:
+            return client.request(orders.OrderCreate(account_id, data={"order": order}))
+        except V20Error as e:
+            if error_code(e) == "CLIENT_ORDER_ID_ALREADY_EXISTS":
+                # 前回（再実行前を含む）の送信が届いていたため、その結果を返す
+                found = find_order(lookup_client, account_id, client_id)
+                if found is not None:
+                    print(f"{client_id} は送信済みでした（{found['order']['state']}）")
+                    return found
+            elif e.code < 500:
+                raise  # 拒否（4xx）は結果が確定しているため送り直さない
+            error = e
+        except RequestException as e:
+            error = e
+        print(f"{client_id} の送信結果が分かりません（{attempt + 1}回目）: {error}")
+        time.sleep(backoff * 2 ** attempt)
+        found = find_order(lookup_client, account_id, client_id)
+        if found is not None:
+            print(f"{client_id} は {found['order']['state']} でした")
+            return found
+    raise Exception(f"{client_id} を送信できませんでした: {error}")
@@ -0,0 +1,46 @@
+"""API のリクエストをスレッドプールから並列に送信するクライアントプール
+
+requests.Session はスレッド間で共有しないため、送信スレッドごとに client_factory でクライアントを 1つ作って使い回す.
+プールをモジュールの変数等に置けば、ウォームなコンテナではスレッドとクライアントを再利用する.
+"""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, List
+
+
+class ClientPool:
+    """送信スレッドごとに API クライアントを持つスレッドプール
+
+    Args:
+        client_factory (Callable): API クライアントを生成する関数. 送信スレッドごとに 1つ作る
+        workers (int): 並列に送信するスレッド数
+        name (str, optional): スレッド名の接頭辞
+    """
+
+    def __init__(self, client_factory: Callable, workers: int, name: str = "client") -> None:
+        self.client_factory = client_factory
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    def client(self):
+        """呼び出したスレッドのクライアントを返す関数. 初めて呼ばれたスレッドでは client_factory で作る"""
+        if not hasattr(self._local, "client"):
+            self._local.client = self.client_factory()
+        return self._local.client
+
+    def map(self, send: Callable, items: Iterable) -> List:
+        """send(クライアント, item) を並列に呼び、結果を items の順に返す関数"""
+        return list(self._executor.map(lambda item: send(self.client(), item), items))
+
+    def submit(self, send: Callable, *args) -> Future:
+        """send(クライアント, *args) をキューに入れ、結果を待たずに Future を返す関数"""
+        return self._executor.submit(lambda: send(self.client(), *args))
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,129 @@
+"""発注数量の計算に使う通貨ペアの表（pip の位置・最小取引数量・口座通貨への換算レート）
+
+AccountInstruments と PricingInfo（includeHomeConversions）を 1回ずつ呼んで全通貨ペアの表を作り、
+発注のたびには API を呼ばずに表から units を求める.
+・初回の参照時のみ同期で取得し、以降は refresh_seconds を過ぎたら古い表を返しつつ別スレッドで取り直す
+・常駐プロセスでは start() で一定間隔で取り直すスレッドを起動できる
+"""
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Optional
+
+from oandapyV20.endpoints import accounts, pricing
+
+INSTRUMENT_REFRESH_SECONDS = float(os.environ.get("INSTRUMENT_REFRESH_SECONDS", "300"))
+
+
+class InstrumentSpec(NamedTuple):
+    instrument: str
+    pip_location: int  # 1 pip = 10 ** pip_location ex) USD_JPY は -2
+    minimum_trade_size: float
+    trade_units_precision: int  # units の小数点以下の桁数
+    quote_currency: str
+    conversion: Optional[float]  # 決済通貨 1単位の口座通貨換算レート. 取得できなければ None
+
+    def pip_value(self) -> float:
+        """1 units の 1 pip あたりの損益（口座通貨）"""
+        if self.conversion is None:
+            raise Exception(f"{self.quote_currency} の口座通貨への換算レートがありません")
+        return 10 ** self.pip_location * self.conversion
+
+    def units_for(self, pip_value: float) -> float:
+        """1 pip あたりの損益が pip_value（口座通貨）になる units を返す関数. 最小取引数量に満たなければ 0"""
+        scale = 10 ** self.trade_units_precision
+        units = math.floor(pip_value / self.pip_value() * scale) / scale
+        if units < self.minimum_trade_size:
+            return 0
+        return int(units) if self.trade_units_precision == 0 else units
+
+
+class InstrumentTable:
+    """通貨ペア -> InstrumentSpec の表をプロセス内に保持するクラス
+
+    Args:
+        account_id (str): 口座 ID
+        client_factory (Callable, optional): 別スレッドで取り直す時の API クライアントを生成する関数.
+            未指定なら参照時に渡されたクライアントを使う
+        refresh_seconds (float, optional): 表を取り直すまでの秒数
+    """
+
+    def __init__(self, account_id: str, client_factory: Callable = None, refresh_seconds: float = INSTRUMENT_REFRESH_SECONDS) -> None:
+        self.account_id = account_id
+        self.client_factory = client_factory
+        self.refresh_seconds = refresh_seconds
+        self.specs: Dict[str, InstrumentSpec] = {}
+        self.refreshed_at: Optional[float] = None  # time.monotonic()
+        self._lock = threading.Lock()  # 取り直しを同時に 1つだけ実行する
+        self._refreshing = False
+
+    def refresh(self, client):
+        """AccountInstruments と PricingInfo を 1回ずつ呼び、表を作り直す関数"""
+        response = client.request(accounts.AccountInstruments(accountID=self.account_id))
+        instruments = response.get("instruments", [])
+        names = ",".join(instrument["name"] for instrument in instruments)
+        response = client.request(
+            pricing.PricingInfo(accountID=self.account_id, params={"instruments": names, "includeHomeConversions": True})
+        )
+        # 口座通貨で損益が出る時のレート. 利益と損失のレートの差は無視して accountGain を使う
+        conversions = {c["currency"]: float(c["accountGain"]) for c in response.get("homeConversions", [])}
+        specs = {}
+        for instrument in instruments:
+            quote_currency = instrument["name"].rpartition("_")[2]
+            specs[instrument["name"]] = InstrumentSpec(
+                instrument["name"],
+                int(instrument["pipLocation"]),
+                float(instrument["minimumTradeSize"]),
+                int(instrument["tradeUnitsPrecision"]),
+                quote_currency,
+                conversions.get(quote_currency),
+            )
+        # 参照中のスレッドは古い表をそのまま使えるよう、辞書ごと差し替える
+        self.specs = specs
+        self.refreshed_at = time.monotonic()
+
+    def get(self, client, instrument: str) -> InstrumentSpec:
+        """通貨ペアの InstrumentSpec を返す関数. 表が古ければ別スレッドで取り直し、今回は古い表を返す"""
+        if self.refreshed_at is None:
+            with self._lock:
+                if self.refreshed_at is None:
+                    self.refresh(client)
+        elif time.monotonic() - self.refreshed_at > self.refresh_seconds:
+            self._refresh_in_background(client)
+        spec = self.specs.get(instrument)
+        if spec is None:
+            raise Exception(f"{instrument} は取引できる通貨ペアではありません")
+        return spec
+
+    def units_for(self, client, instrument: str, pip_value: float) -> float:
+        return self.get(client, instrument).units_for(pip_value)
+
+    def _refresh_in_background(self, client):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, args=(client,), name="instrument-table", daemon=True).start()
+
+    def _background_refresh(self, client):
+        try:
+            self.refresh(self.client_factory() if self.client_factory else client)
+        except Exception as e:
+            print(f"通貨ペアの表を取り直せませんでした: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def start(self, client):
+        """refresh_seconds ごとに表を取り直すスレッドを起動する関数（常駐プロセス用）"""
+
+        def loop():
+            while True:
+                time.sleep(self.refresh_seconds)
+                self._background_refresh(client)
+
+        if self.refreshed_at is None:
+            self.refresh(client)
+        threading.Thread(target=loop, name="instrument-table-loop", daemon=True).start()
+        return self
@@ -1,8 +1,18 @@
-import json
 import os
+import sys
 import oandapyV20
-import oandapyV20.endpoints
-from oandapyV20.endpoints import orders, positions, accounts, pricing
+from oandapyV20.endpoints import positions, pricing
+
+from account_state import AccountMirror
+from alert_dedupe import AlertDeduplicator, alert_key
+from alert_parser import TRADING_VIEW_ORIGIN, parse
+from bracket import Quote, bracket_order, compute_brackets
+from bulk_close import CLOSE_SIDES, BulkCloser
+from client_order import client_order_id, strategy_tag, submit_order, with_client_extensions
+from instrument_table import InstrumentTable
+from order_sweep import OrderSweeper, older_than, on_instruments, tagged
+from position_book import PositionBook
+from trailing_stop import TrailingStopEngine, report
 
 
 # OANDAのAPI設定
@@ -10,8 +20,68 @@ OANDA_ACCOUNT_ID = os.environ["OANDA_ACCOUNT_ID"]
 OANDA_API_KEY = os.environ["OANDA_RESTAPI_TOKEN"]
 OANDA_API_URL = 'https://api-fxpractice.oanda.com'  # デモアカウントの場合。ライブアカウントの場合は'https://api-fxtrade.oanda.com'
 
+# 接続先. practice | live | local（ローカルのスタンドインサーバ）
+OANDA_ENVIRONMENT = os.environ.get("OANDA_ENVIRONMENT", "practice")
+
 # OANDAのAPIクライアントを設定
-client = oandapyV20.API(access_token=OANDA_API_KEY)
+client = oandapyV20.API(access_token=OANDA_API_KEY, environment=OANDA_ENVIRONMENT)
+
+# 別スレッドで API を呼ぶ場合のクライアントを生成する関数（requests.Session はスレッド間で共有しない）
+def create_client():
+    return oandapyV20.API(access_token=OANDA_API_KEY, environment=OANDA_ENVIRONMENT)
+
+# OrderCreate を打ち切る秒数. 0 なら打ち切らない. 打ち切った注文はクライアント注文 ID で確かめてから送り直す
+ORDER_TIMEOUT = float(os.environ.get("ORDER_TIMEOUT", "0"))
+timeout_client = (None, None)  # (元の client, timeout 付きのクライアント)
+
+# OrderCreate を送るクライアントを返す関数. client は event_router の SharedClient やシミュレータに差し替えられるため、
+# import 時に固定せず発注のたびに現在の client から決める. timeout は素の oandapyV20.API の場合のみ付ける
+# （SharedClient は全ストラテジーで 1つの Session を共有するため、発注だけを打ち切れない）
+def order_client():
+    global timeout_client
+    if ORDER_TIMEOUT <= 0 or not isinstance(client, oandapyV20.oandapyV20.API):
+        return client
+    if timeout_client[0] is not client:
+        timeout_client = (client, oandapyV20.API(access_token=OANDA_API_KEY, environment=OANDA_ENVIRONMENT, request_params={"timeout": ORDER_TIMEOUT}))
+    return timeout_client[1]
+# アラート以外（ローカルテスト等）から発注する注文のタグ
+STRATEGY_TAG = os.environ.get("STRATEGY_TAG", "manual")
+
+ORDER_UNITS = 10000  # USD_JPY の 1回の発注 units. TODO: unit を計算（複利対応）
+# 約定時に設定するストップロス・テイクプロフィットまでの pips
+STOP_LOSS_PIPS = 10
+TAKE_PROFIT_PIPS = 20
+# 1回の発注で 1 pip あたりに動く損益（口座通貨）. 通貨ペアごとの units はこの値から求める（USD_JPY は ORDER_UNITS）
+PIP_VALUE = float(os.environ.get("PIP_VALUE", str(ORDER_UNITS * 0.01)))
+
+# 常駐プロセス（--daemon）で webhook を受ける場合の待ち受けアドレスとワーカー数
+WEBHOOK_DAEMON_HOST = os.environ.get("WEBHOOK_DAEMON_HOST", "0.0.0.0")
+WEBHOOK_DAEMON_PORT = int(os.environ.get("WEBHOOK_DAEMON_PORT", "8000"))
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "2"))
+# 同じバーに複数のストラテジーから届くアラートをまとめる秒数. 0 なら 1件ずつ発注する
+ALERT_BATCH_WINDOW = float(os.environ.get("ALERT_BATCH_WINDOW", "0.3"))
+# 常駐プロセスで保有中のトレードのストップを更新する秒数. 0 なら更新しない
+TRAILING_STOP_INTERVAL = float(os.environ.get("TRAILING_STOP_INTERVAL", "0"))
+# "stop"（Chandelier Exit の価格を stopLoss に設定）| "trailing"（ATR の倍数を trailingStopLoss の距離に設定）
+TRAILING_STOP_MODE = os.environ.get("TRAILING_STOP_MODE", "stop")
+
+# 口座の状態. ウォームなコンテナでは AccountChanges で差分のみを取得する
+account_mirror = AccountMirror(OANDA_ACCOUNT_ID)
+
+# 重複したアラートの判定. ウォームなコンテナではプロセス内のキャッシュで判定する
+alert_dedupe = AlertDeduplicator()
+
+# 通貨ペアの pip の位置・最小取引数量・換算レート. 発注数量の計算では API を呼ばない
+instrument_table = InstrumentTable(OANDA_ACCOUNT_ID, create_client)
+
+# 一括決済. 決済は送信スレッドから並列に送る
+bulk_closer = BulkCloser(OANDA_ACCOUNT_ID, create_client)
+
+# 未約定の注文の一括取消. 取消は送信スレッドから並列に送る
+order_sweeper = OrderSweeper(OANDA_ACCOUNT_ID, create_client)
+
+# トレーリングストップ. 動くストップのみ TradeCRCDO を並列に送る
+stop_engine = TrailingStopEngine(OANDA_ACCOUNT_ID, create_client, mode=TRAILING_STOP_MODE)
 
 class FundManagement():
     """ 資金管理用クラス
@@ -56,43 +126,69 @@ class TradingEnvironmentAnalysis():
 
 # 証拠金を取得する関数
 def get_account_margin():
-    endpoint = accounts.AccountSummary(OANDA_ACCOUNT_ID)
-    response = client.request(endpoint)
-    margin_available = float(response['account']['marginAvailable'])
-    return margin_available
+    account_mirror.sync(client)
+    return account_mirror.margin_available
 
-# マーケットオーダーを送信する関数
-def place_order(units, instrument='USD_JPY', stop_loss_pips=10, take_profit_pips=20):
+# ストラテジー（タグ）のトレードのみから保有 units を読み込んだポジションブックを返す関数
+# 同じ口座の他のストラテジー（accumulation 等）の建玉を目標との差分に含めない
+def strategy_book(tag):
+    account_mirror.sync(client)
+    book = PositionBook(client, OANDA_ACCOUNT_ID)
+    book.load_trades(account_mirror.trades.values(), tag)
+    return book
+
+# マーケットオーダーを送信する関数. stop_loss_pips を指定するとストップロス・テイクプロフィットを約定時に設定する
+# client_id はアラートの重複判定のキー等から作り、Lambda の再実行でも同じ ID にする（時刻からは作らない）
+def place_order(units, instrument='USD_JPY', stop_loss_pips=STOP_LOSS_PIPS, take_profit_pips=TAKE_PROFIT_PIPS, position_fill="DEFAULT", client_id=None, tag=STRATEGY_TAG):
+    if not client_id:
+        raise Exception("クライアント注文 ID（client_id）が必要です")
     # 現在の価格を取得
     endpoint = pricing.PricingInfo(accountID=OANDA_ACCOUNT_ID, params={"instruments": instrument})
     response = client.request(endpoint)
-    current_price = float(response['prices'][0]['closeoutAsk'])
+    prices = response['prices'][0]
+    quote = Quote(float(prices['bids'][0]['price']), float(prices['asks'][0]['price']))
 
     # 証拠金の2%をリスクとして計算
     margin_available = get_account_margin()
     print(f"{margin_available=}")
     # risk_amount = margin_available * 0.02
-    # stop_loss_price = current_price - (stop_loss_pips * 0.0001)
-    # take_profit_price = current_price + (take_profit_pips * 0.0001)
 
-    order_data = {
-        "order": {
+    if stop_loss_pips is not None:
+        pip_location = instrument_table.get(client, instrument).pip_location
+        bracket, = compute_brackets({instrument: units}, {instrument: quote}, {instrument: pip_location}, stop_loss_pips, take_profit_pips)
+        print(f"{bracket=}")
+        order = bracket_order(bracket, position_fill)
+    else:
+        order = {
             "units": str(units),  # 正の値は買い、負の値は売り
             "instrument": instrument,
             "timeInForce": "FOK",
             "type": "MARKET",
-            "positionFill": "DEFAULT",
-            # "stopLossOnFill": {
-            #     "price": f"{stop_loss_price:.5f}"
-            # },
-            # "takeProfitOnFill": {
-            #     "price": f"{take_profit_price:.5f}"
-            # }
+            "positionFill": position_fill,  # 両建て口座の DEFAULT は OPEN_ONLY（逆向きの差分は PositionBook.reduce で決済する）
         }
+    return submit_order(order_client(), OANDA_ACCOUNT_ID, with_client_extensions(order, client_id, tag), lookup_client=client)
+
+# 複数の注文のストップロス・テイクプロフィットを価格の取得 1回でまとめて計算し、注文ごとに OrderCreate 1回で送る関数
+# key（アラートの重複判定のキー等）と通貨ペア・units からクライアント注文 ID を作る
+def place_bracket_orders(deltas, stop_loss_pips=STOP_LOSS_PIPS, take_profit_pips=TAKE_PROFIT_PIPS, position_fill="DEFAULT", key=None, tag=STRATEGY_TAG):
+    if not key:
+        raise Exception("クライアント注文 ID の元になる key が必要です")
+    if not deltas:
+        return []
+    endpoint = pricing.PricingInfo(accountID=OANDA_ACCOUNT_ID, params={"instruments": ",".join(deltas)})
+    price_map = {
+        prices['instrument']: Quote(float(prices['bids'][0]['price']), float(prices['asks'][0]['price']))
+        for prices in client.request(endpoint)['prices']
     }
-    r = orders.OrderCreate(OANDA_ACCOUNT_ID, data=order_data)
-    response = client.request(r)
-    return response
+    pip_locations = {instrument: instrument_table.get(client, instrument).pip_location for instrument in deltas}
+    responses = []
+    for bracket in compute_brackets(deltas, price_map, pip_locations, stop_loss_pips, take_profit_pips):
+        print(f"{bracket=}")
+        order = with_client_extensions(
+            bracket_order(bracket, position_fill), client_order_id(key, bracket.instrument, bracket.units), tag
+        )
+        responses.append(submit_order(order_client(), OANDA_ACCOUNT_ID, order, lookup_client=client))
+    return responses
 
 # ポジション決済を送信する関数
 def position_close(close_action, units, instrument='USD_JPY', stop_loss_pips=10, take_profit_pips=20):
@@ -135,6 +231,64 @@ def position_close(close_action, units, instrument='USD_JPY', stop_loss_pips=10,
             'body': 'Error Position Closing'
         }
 
+# 建玉をまとめて決済する関数. mode: long | short | all | tag:<ストラテジーのタグ>
+def bulk_close(mode):
+    if mode.startswith("tag:"):
+        summary = bulk_closer.close_tag(client, mode[len("tag:"):])
+    elif mode in CLOSE_SIDES:
+        summary = bulk_closer.close_positions(client, CLOSE_SIDES[mode])
+    else:
+        raise Exception(f"決済の種類が不正です: {mode}")
+    print(
+        f"bulk close {mode}: {summary.requests} requests, {summary.units} units, "
+        f"pl: {summary.realized_pl:.4f}, financing: {summary.financing:.4f} ({summary.seconds * 1000:.0f}ms)"
+    )
+    for error in summary.errors:
+        print("Error:", error)
+    return {
+        'statusCode': 500 if summary.errors else 200,
+        'body': f'{summary.requests - len(summary.errors)} of {summary.requests} closes succeeded. pl: {summary.realized_pl:.4f}'
+    }
+
+# 未約定の注文をまとめて取り消す関数
+# spec: all | age=<秒>,instrument=<通貨ペア>[+<通貨ペア>...],tag=<タグ> のうち指定したすべてを満たす注文
+def sweep_orders(spec):
+    predicates = []
+    for condition in ([] if spec == "all" else spec.split(",")):
+        key, _, value = condition.partition("=")
+        if key == "age":
+            predicates.append(older_than(float(value)))
+        elif key == "instrument":
+            # ストップロス・テイクプロフィットは instrument を持たないため、紐づくトレードの通貨ペアで判定する
+            account_mirror.sync(client)
+            trade_instruments = {trade_id: trade["instrument"] for trade_id, trade in account_mirror.trades.items()}
+            predicates.append(on_instruments(value.split("+"), trade_instruments))
+        elif key == "tag":
+            predicates.append(tagged(value))
+        else:
+            raise Exception(f"取消の条件が不正です: {condition}")
+    summary = order_sweeper.sweep(client, predicates)
+    print(
+        f"order sweep {spec}: {len(summary.cancelled)} of {summary.matched} matched cancelled "
+        f"({summary.pending} pending, fetch {summary.fetch_seconds * 1000:.0f}ms, "
+        f"cancel {summary.cancel_seconds * 1000:.0f}ms, {summary.throughput:.1f} orders/s)"
+    )
+    for error in summary.errors:
+        print("Error:", error)
+    return {
+        'statusCode': 500 if summary.errors else 200,
+        'body': f'{len(summary.cancelled)} of {summary.matched} orders cancelled.'
+    }
+
+# 保有中のトレードのストップを ATR に合わせて更新する関数
+def trail_stops():
+    summary = stop_engine.run(client, lambda instrument: instrument_table.get(client, instrument).pip_location)
+    report(summary)
+    return {
+        'statusCode': 500 if summary.errors else 200,
+        'body': f'{len(summary.updates) - len(summary.errors)} of {summary.trades} stops updated.'
+    }
+
 # Lambdaハンドラー関数
 def lambda_handler(event, context):
     """
@@ -176,66 +330,275 @@ def lambda_handler(event, context):
     """
     print(f"{event=}")
     # print(f"{context=}")
+    claimed_key = None
     try:
-        body = json.loads(event["body"]) if type(event["body"]) is str else event["body"]
-        """
-        body: {
-            "title": "Chandelier Exit Strategy",
-            "ticker": {{ticker}},
-            "orderAction": {{strategy.order.action}} : sell | buy,
-            "orderContracts": {{strategy.order.contracts}},
-            "positionSize": {{strategy.position_size}},
-            "comment": {{strategy.order.comment}},
-            "__origin__": "__trading_view__"
+        alert = parse_alert(event)
+
+        # 同じアラートの再送は API を呼ぶ前に弾く
+        key = dedupe_key(alert)
+        if not alert_dedupe.claim(key):
+            print(f"重複したアラートのため発注しません: {key}")
+            return {
+                'statusCode': 200,
+                'body': 'Duplicate alert ignored'
+            }
+        claimed_key = key
+
+        return process_alert(alert, key)
+
+    except Exception as e:
+        print("Error:", str(e))
+        if claimed_key is not None:
+            alert_dedupe.release(claimed_key)  # 再送されたアラートで発注し直せるようにする
+        return {
+            'statusCode': 500,
+            'body': 'Error placing orders'
         }
-        """
-        print(f"{body=}")
-
-        # TODO: AuthCheck
-        if body["__origin__"] != "__trading_view__":
-            raise Exception("*** 不正なアクセスの可能性があります ***")
-
-        stop_loss_pips = 10  # 未使用
-        take_profit_pips = 20  # 未使用
-        if body["orderAction"] == "buy":
-            # 例: 1000ユニットを買い
-            # buy_units = 1000
-            # TODO: unit を計算（複利対応）
-            buy_units = 10000
-            response_buy = place_order(buy_units, stop_loss_pips=stop_loss_pips, take_profit_pips=take_profit_pips)
-            print("Buy order response:", response_buy)
-
-        elif body["orderAction"] == "sell":
-            # 例: 1000ユニットを売り
-            # sell_units = -1000
-            # TODO: unit を計算（複利対応）
-            sell_units = -10000
-            response_sell = place_order(sell_units, stop_loss_pips=stop_loss_pips, take_profit_pips=take_profit_pips)
-            print("Sell order response:", response_sell)
 
-        else:
-            raise Exception("orderAction が指定されていません")
-        
-        # TODO: 決済条件の整理
-        if body["orderAction"] == "buy" and body["orderContracts"] == "200"\
-              or "決済" in body["comment"]:
-            position_close("short", 100)
-        elif body["orderAction"] == "sell" and body["orderContracts"] == "200"\
-              or "決済" in body["comment"]:
-            position_close("long", 100)
+# webhook の本文を Alert に変換して検証する関数
+def parse_alert(event):
+    """
+    本文は JSON または TradingView の既定のテキストを受け付ける（alert_parser.py）
+    body: {
+        "title": "Chandelier Exit Strategy",
+        "ticker": {{ticker}},
+        "orderAction": {{strategy.order.action}} : sell | buy,
+        "orderContracts": {{strategy.order.contracts}},
+        "positionSize": {{strategy.position_size}},
+        "comment": {{strategy.order.comment}},
+        "time": {{time}},
+        "__origin__": "__trading_view__"
+    }
+    """
+    # テキストの本文は __origin__ を含められないため、webhook の URL のクエリで渡す ex) https://.../?__origin__=__trading_view__
+    origin = (event.get("queryStringParameters") or {}).get("__origin__", "")
+    alert = parse(event["body"], event.get("isBase64Encoded", False), origin)
+    print(f"{alert=}")
+
+    # TODO: AuthCheck
+    if alert.origin != TRADING_VIEW_ORIGIN:
+        raise Exception("*** 不正なアクセスの可能性があります ***")
+    # 時刻もポジションも無いと、同じアラートの再送と次のシグナルを区別できない（alert_dedupe.py）
+    if not alert.time and alert.position_size is None:
+        raise Exception("time（{{time}}）または positionSize（{{strategy.position_size}}）が必要です")
+    return alert
+
+# アラートの通貨ペアと 1回の発注 units を返す関数
+def order_size(alert):
+    if alert.instrument is None:
+        raise Exception(f"{alert.ticker} に対応する通貨ペアがありません")
+    units = instrument_table.units_for(client, alert.instrument, PIP_VALUE)
+    if not units:
+        raise Exception(f"{alert.instrument} の発注数量が最小取引数量に満たないため発注できません")
+    return alert.instrument, units
 
+# アラートのストラテジーのタグを返す関数. タイトルが無ければ STRATEGY_TAG
+def alert_tag(alert):
+    return strategy_tag(alert.title) or STRATEGY_TAG
+
+# 重複判定のキー（クライアント注文 ID の元にもなる）を返す関数
+# バーの時刻が無いアラートは、ストラテジーの保有 units と口座の最後の取引 ID を加える（alert_dedupe.py）
+def dedupe_key(alert):
+    if alert.time:
+        return alert_key(alert)
+    held = strategy_book(alert_tag(alert)).held(alert.instrument)
+    return alert_key(alert, f"{held}@{account_mirror.last_transaction_id}")
+
+# アラートに従って発注する関数. key（alert_key）からクライアント注文 ID を作る
+def process_alert(alert, key=None):
+    stop_loss_pips = STOP_LOSS_PIPS
+    take_profit_pips = TAKE_PROFIT_PIPS
+    instrument, order_units = order_size(alert)
+    key, tag = key or dedupe_key(alert), alert_tag(alert)
+    if alert.position_size is not None:
+        # ストラテジーの新しいポジションを目標とし、このストラテジーのトレードの units との差分のみを発注する
+        # （ドテンの 200 契約や決済もこの差分で済むため position_close は呼ばない）
+        position_size = alert.position_size
+        target_units = order_units if position_size > 0 else -order_units if position_size < 0 else 0
+        book = strategy_book(tag)
+        deltas = book.delta({instrument: target_units})
+        if not deltas:
+            print(f"{instrument} は既に {target_units} units 保有しているため発注しません")
+        for instrument, units in deltas.items():
+            # 逆向きの差分は自分のトレードを決済し、残りのみを新規に発注する
+            units = book.reduce(instrument, units)
+            if not units:
+                continue
+            response = place_order(units, instrument=instrument, stop_loss_pips=stop_loss_pips, take_profit_pips=take_profit_pips, client_id=client_order_id(key, instrument, units), tag=tag)
+            print(f"{alert.action} order response:", response)
         return {
             'statusCode': 200,
-            'body': f'{body["orderAction"]} Orders placed successfully'
+            'body': f'{alert.action} Orders placed successfully'
         }
 
+    if alert.action == "buy":
+        # 例: 1000ユニットを買い
+        # buy_units = 1000
+        # TODO: unit を計算（複利対応）
+        buy_units = order_units
+        response_buy = place_order(buy_units, instrument=instrument, stop_loss_pips=stop_loss_pips, take_profit_pips=take_profit_pips, client_id=client_order_id(key, instrument, buy_units), tag=tag)
+        print("Buy order response:", response_buy)
+
+    elif alert.action == "sell":
+        # 例: 1000ユニットを売り
+        # sell_units = -1000
+        # TODO: unit を計算（複利対応）
+        sell_units = -order_units
+        response_sell = place_order(sell_units, instrument=instrument, stop_loss_pips=stop_loss_pips, take_profit_pips=take_profit_pips, client_id=client_order_id(key, instrument, sell_units), tag=tag)
+        print("Sell order response:", response_sell)
+
+    else:
+        raise Exception("orderAction が指定されていません")
+    
+    # TODO: 決済条件の整理
+    # 同じ口座の他のストラテジーの建玉は決済しないよう、このストラテジーのトレードのみを決済する
+    if alert.action == "buy" and alert.contracts == "200"\
+          or "決済" in alert.comment:
+        book = strategy_book(tag)
+        book.reduce(instrument, book.sides(instrument)[1])
+    elif alert.action == "sell" and alert.contracts == "200"\
+          or "決済" in alert.comment:
+        book = strategy_book(tag)
+        book.reduce(instrument, -book.sides(instrument)[0])
+
+    return {
+        'statusCode': 200,
+        'body': f'{alert.action} Orders placed successfully'
+    }
+
+# 検証してキューに入れ、すぐに応答する関数（run_daemon の webhook サーバから呼ぶ）
+def enqueue_alert(event, alert_queue):
+    try:
+        alert = parse_alert(event)
+    except Exception as e:
+        print("Error:", str(e))
+        return {
+            'statusCode': 400,
+            'body': 'Invalid alert'
+        }
+    try:
+        key = dedupe_key(alert)  # バーの時刻が無いアラートは保有 units を取得する
     except Exception as e:
         print("Error:", str(e))
         return {
             'statusCode': 500,
-            'body': 'Error placing orders'
+            'body': 'Error checking alert'
+        }
+    if not alert_dedupe.claim(key):
+        print(f"重複したアラートのため発注しません: {key}")
+        return {
+            'statusCode': 200,
+            'body': 'Duplicate alert ignored'
         }
+    alert_queue.put(alert, key)
+    return {
+        'statusCode': 202,
+        'body': 'Alert queued'
+    }
+
+# アラート 1件の意図を通貨ペアごとの [long, short] units に反映し、通貨ペアを返す関数
+def apply_intent(sides, alert):
+    """process_alert を順に実行した場合と同じ建玉になるよう、long / short の units を更新する"""
+    instrument, order_units = order_size(alert)
+    long_units, short_units = sides.setdefault(instrument, [0, 0])
+    if alert.position_size is not None:
+        position_size = alert.position_size
+        target_units = order_units if position_size > 0 else -order_units if position_size < 0 else 0
+        sides[instrument] = [max(target_units, 0), max(-target_units, 0)]
+        return instrument
+
+    if alert.action == "buy":
+        long_units += order_units
+    elif alert.action == "sell":
+        short_units += order_units
+    else:
+        raise Exception("orderAction が指定されていません")
+    # process_alert の決済条件と同じ
+    if alert.action == "buy" and alert.contracts == "200"\
+          or "決済" in alert.comment:
+        short_units = 0
+    elif alert.action == "sell" and alert.contracts == "200"\
+          or "決済" in alert.comment:
+        long_units = 0
+    sides[instrument] = [long_units, short_units]
+    return instrument
+
+# 複数のアラートを通貨ペアごとに相殺し、通貨ペアごとに 1回だけ発注する関数
+def process_alerts(alerts, keys=None):
+    """ストラテジー（タグ）ごとに、届いた順に意図を積み上げた後の net units を目標とし、
+    そのストラテジーのトレードの units との差分のみを発注する
+    （両建ての long / short は net で相殺されるため、決済もトレードの決済と差分の注文に含まれる）
+    keys（アラートごとの alert_key）からクライアント注文 ID を作る
+    """
+    keys = keys or [dedupe_key(alert) for alert in alerts]
+    groups = {}
+    for alert, key in zip(alerts, keys):
+        groups.setdefault(alert_tag(alert), []).append((alert, key))
+    placed = 0
+    for tag, group in groups.items():
+        book = strategy_book(tag)
+        sides = {instrument: list(book.sides(instrument)) for instrument in book.trades}
+        instruments = {apply_intent(sides, alert) for alert, _ in group}
+        targets = {instrument: sides[instrument][0] - sides[instrument][1] for instrument in sorted(instruments)}
+        deltas = book.delta(targets)
+        opens = {}
+        for instrument, units in deltas.items():
+            # 逆向きの差分は自分のトレードを決済し、残りのみを新規に発注する
+            units = book.reduce(instrument, units)
+            if units:
+                opens[instrument] = units
+        print(f"{tag}: {len(group)} 件のアラートを {len(opens)} 件の注文にまとめました {targets=}")
+        key = client_order_id(*sorted(key for _, key in group))
+        for response in place_bracket_orders(opens, key=key, tag=tag):
+            print("Order response:", response)
+            book.record_fill(response)
+        placed += len(opens)
+    return {
+        'statusCode': 200,
+        'body': f'{placed} Orders placed successfully'
+    }
+
+# キューから取り出したアラートを発注する関数（ワーカースレッドで実行する）
+def drain_alerts(queued):
+    try:
+        if len(queued) == 1:
+            response = process_alert(queued[0].alert, queued[0].key)
+        else:
+            response = process_alerts([item.alert for item in queued], [item.key for item in queued])
+    except Exception:
+        for item in queued:
+            alert_dedupe.release(item.key)  # 再送されたアラートで発注し直せるようにする
+        raise
+    print(f"{len(queued)} alerts: {response['body']}")
+
+def run_daemon(host=WEBHOOK_DAEMON_HOST, port=WEBHOOK_DAEMON_PORT, workers=WEBHOOK_WORKERS, batch_window=ALERT_BATCH_WINDOW):
+    """Lambda ではなく常駐プロセスとして webhook を受ける関数
+    TradingView の webhook は数秒でタイムアウトするため、検証してキューに入れた時点で 202 を返し、発注はワーカーが行う.
+    batch_window 秒の間に届いた同じティッカーのアラートはまとめて相殺する.
+    GET /metrics でキューの深さ・キューでの待ち時間を返す
+    """
+    from alert_queue import AlertQueue, serve  # 常駐プロセスでのみ使うため Lambda では import しない
+
+    instrument_table.start(client)  # 発注のワーカーが表の取り直しを待たないよう、一定間隔で取り直す
+    if TRAILING_STOP_INTERVAL > 0:
+        # 発注のワーカーとは別のスレッド・クライアントで更新する. 表は instrument_table のスレッドが取り直す
+        stop_engine.start(lambda instrument: instrument_table.get(client, instrument).pip_location, TRAILING_STOP_INTERVAL)
+    alert_queue = AlertQueue(drain_alerts, workers=workers, batch_window=batch_window).start()
+    server = serve(host, port, lambda event: enqueue_alert(event, alert_queue), alert_queue)
+    print(f"webhook を http://{host}:{port}/ で待ち受けます（ワーカー {workers}, まとめる秒数 {batch_window}）")
+    server.serve_forever()
 
-# ローカルテスト
+# ローカルテスト. --daemon を付けると常駐プロセスとして webhook を受ける
+# --close long|short|all|tag:<タグ> で建玉をまとめて決済する. --trail-stops で保有中のトレードのストップを更新する
+# --sweep-orders all|age=<秒>,instrument=<通貨ペア>,tag=<タグ> で未約定の注文をまとめて取り消す
 if __name__ == "__main__":
-    lambda_handler(None, None)
\ No newline at end of file
+    if "--daemon" in sys.argv:
+        run_daemon()
+    elif "--close" in sys.argv:
+        bulk_close(sys.argv[sys.argv.index("--close") + 1])
+    elif "--sweep-orders" in sys.argv:
+        sweep_orders(sys.argv[sys.argv.index("--sweep-orders") + 1])
+    elif "--trail-stops" in sys.argv:
+        trail_stops()
+    else:
+        lambda_handler(None, None)
\ No newline at end of file
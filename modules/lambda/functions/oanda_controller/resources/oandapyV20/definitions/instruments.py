@@ -40,3 +40,8 @@ definitions = {
         "Sunday": "Sunday",
     },
 }
+
+
+# the definition classes are created by the package, see __init__.py
+from . import register_definitions  # noqa: E402
+register_definitions("instruments")
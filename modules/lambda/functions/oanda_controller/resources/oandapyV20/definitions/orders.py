@@ -68,3 +68,8 @@ definitions = {
                "regardless of whether it is long or short."
     }
 }
+
+
+# the definition classes are created by the package, see __init__.py
+from . import register_definitions  # noqa: E402
+register_definitions("orders")
@@ -20,3 +20,8 @@ definitions = {
                 "Trade is short when it has sold units of an Instrument"
     }
 }
+
+
+# the definition classes are created by the package, see __init__.py
+from . import register_definitions  # noqa: E402
+register_definitions("primitives")
@@ -2,9 +2,11 @@
 """Handle orders and pendingOrders endpoints."""
 from .apirequest import APIRequest
 from .decorators import dyndoc_insert, endpoint
-from .responses.orders import responses
 from abc import abstractmethod
 
+# example responses, only imported when the docstrings are generated
+responses = "orders"
+
 
 class Orders(APIRequest):
     """Orders - abstract base class to handle the orders endpoints."""
@@ -0,0 +1,103 @@
+"""残っている未約定の注文をまとめて取り消す注文スイープ
+
+OrdersPending を 1回だけ呼び、経過時間・通貨ペア・タグの条件（プロセス内の述語）で絞り込んだ注文を
+スレッドプールから並列に OrderCancel して、取消の件数とスループットを 1つの集計（SweepSummary）にまとめて返す.
+・条件はすべて満たす注文のみを取り消す（条件を指定しなければすべての未約定の注文）
+・ストップロス・テイクプロフィットなどトレードに紐づく注文は instrument を持たないため、トレードの通貨ペアで判定する
+・取消に失敗した注文は errors に残し、他の取消は続ける
+"""
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Iterable, List, Mapping, NamedTuple, Optional, Sequence
+
+from oandapyV20.endpoints import orders
+from oandapyV20.exceptions import V20Error
+
+from client_order import v20_error_message
+from client_pool import ClientPool
+
+ORDER_SWEEP_WORKERS = int(os.environ.get("ORDER_SWEEP_WORKERS", "8"))  # 取消を並列に送信するスレッド数
+
+Predicate = Callable[[dict], bool]
+
+
+class SweepSummary(NamedTuple):
+    pending: int  # 未約定の注文の数
+    matched: int  # 条件に一致した注文の数
+    cancelled: List[str]  # 取り消した注文 ID
+    errors: List[str]  # 取消に失敗した注文とエラー
+    fetch_seconds: float  # OrdersPending の所要時間
+    cancel_seconds: float  # OrderCancel の所要時間（並列に送信した全体）
+
+    @property
+    def throughput(self) -> float:
+        """1秒あたりに処理した取消の数"""
+        return self.matched / self.cancel_seconds if self.cancel_seconds > 0 else 0.0
+
+
+def order_time(order: dict) -> datetime:
+    """注文の createTime（RFC3339, ナノ秒）を UTC の datetime にする関数"""
+    return datetime.fromisoformat(order["createTime"][:19]).replace(tzinfo=timezone.utc)
+
+
+def older_than(seconds: float, now: datetime = None) -> Predicate:
+    """作成から seconds 秒以上経った注文"""
+    now = now or datetime.now(timezone.utc)
+    return lambda order: (now - order_time(order)).total_seconds() >= seconds
+
+
+def on_instruments(names: Iterable[str], trade_instruments: Mapping[str, str] = None) -> Predicate:
+    """通貨ペアが names のいずれかの注文. トレードに紐づく注文は trade_instruments（トレード ID -> 通貨ペア）で判定する"""
+    names = set(names)
+    trade_instruments = trade_instruments or {}
+    return lambda order: (order.get("instrument") or trade_instruments.get(order.get("tradeID"))) in names
+
+
+def tagged(tag: str) -> Predicate:
+    """clientExtensions.tag が tag の注文"""
+    return lambda order: order.get("clientExtensions", {}).get("tag") == tag
+
+
+def select(pending: Iterable[dict], predicates: Sequence[Predicate]) -> List[dict]:
+    """すべての条件を満たす注文を返す関数"""
+    return [order for order in pending if all(predicate(order) for predicate in predicates)]
+
+
+class OrderSweeper:
+    """未約定の注文の取消を ClientPool から並列に送信するクラス
+
+    Args:
+        account_id (str): 口座 ID
+        client_factory (Callable): API クライアントを生成する関数. 送信スレッドごとに 1つ作る
+        workers (int, optional): 取消を並列に送信するスレッド数
+    """
+
+    def __init__(self, account_id: str, client_factory: Callable, workers: int = ORDER_SWEEP_WORKERS) -> None:
+        self.account_id = account_id
+        self._pool = ClientPool(client_factory, workers, "sweep")
+
+    def sweep(self, client, predicates: Sequence[Predicate] = ()) -> SweepSummary:
+        """OrdersPending を 1回呼び、条件に一致する注文をすべて取り消す関数"""
+        started = time.monotonic()
+        pending = client.request(orders.OrdersPending(accountID=self.account_id)).get("orders", [])
+        matched = select(pending, predicates)
+        fetched = time.monotonic()
+        results = self._pool.map(self._send, matched)
+        return SweepSummary(
+            len(pending),
+            len(matched),
+            [order["id"] for order, error in zip(matched, results) if error is None],
+            [error for error in results if error is not None],
+            fetched - started,
+            time.monotonic() - fetched,
+        )
+
+    def _send(self, client, order: dict) -> Optional[str]:
+        try:
+            client.request(orders.OrderCancel(accountID=self.account_id, orderID=order["id"]))
+        except V20Error as e:
+            return f"{order['type']} {order['id']}: {v20_error_message(e)}"
+        except Exception as e:
+            return f"{order['type']} {order['id']}: {e}"
+        return None
@@ -0,0 +1,94 @@
+"""口座の建玉を通貨ペアごとの net units で保持するポジションブック
+
+発注の前に目標 units と保有 units の差分を求め、差分のみを発注するために使う.
+保有 units は 1回の実行につき 1度だけ OpenPositions で取得し、以降は約定の結果で更新する.
+同じ口座を複数のストラテジーで使う場合は load_trades で clientExtensions.tag が一致するトレードのみを保有とし、
+逆向きの差分は reduce で自分のトレードのみを TradeClose する（両建て口座の REDUCE_FIRST は他のストラテジーのトレードも減らす）
+"""
+from typing import Dict, Iterable, List, Tuple
+
+from oandapyV20.endpoints import positions, trades
+
+
+class PositionBook:
+    """OpenPositions から作る通貨ペア -> net units（long は正、short は負）の表"""
+
+    def __init__(self, client, account_id: str) -> None:
+        self.client = client
+        self.account_id = account_id
+        self.units: Dict[str, int] = {}
+        self.trades: Dict[str, List[dict]] = {}  # 通貨ペア -> load_trades で読み込んだトレード（古い順）
+        self.loaded = False
+
+    def refresh(self):
+        """OpenPositions を 1回呼び、保有 units を取り直す関数"""
+        response = self.client.request(positions.OpenPositions(accountID=self.account_id))
+        self.load(response.get("positions", []))
+
+    def load(self, open_positions: Iterable[dict]):
+        """OpenPositions / AccountDetails の positions から保有 units を設定する関数"""
+        self.units = {}
+        for position in open_positions:
+            # short.units は負の値の文字列で返る
+            units = int(float(position["long"]["units"])) + int(float(position["short"]["units"]))
+            if units:
+                self.units[position["instrument"]] = units
+        self.loaded = True
+
+    def load_trades(self, open_trades: Iterable[dict], tag: str):
+        """OpenTrades / AccountDetails の trades のうち clientExtensions.tag が tag のトレードから保有 units を設定する関数"""
+        self.units, self.trades = {}, {}
+        for trade in sorted(open_trades, key=lambda t: int(t["id"])):
+            units = int(float(trade["currentUnits"]))
+            if trade.get("clientExtensions", {}).get("tag") != tag or not units:
+                continue
+            self.trades.setdefault(trade["instrument"], []).append(dict(trade))
+            self.units[trade["instrument"]] = self.units.get(trade["instrument"], 0) + units
+        self.units = {instrument: units for instrument, units in self.units.items() if units}
+        self.loaded = True
+
+    def sides(self, instrument: str) -> Tuple[int, int]:
+        """load_trades で読み込んだトレードの long / short の units（short も正の値）を返す関数"""
+        units = [int(float(trade["currentUnits"])) for trade in self.trades.get(instrument, [])]
+        return sum(u for u in units if u > 0), -sum(u for u in units if u < 0)
+
+    def reduce(self, instrument: str, difference: int) -> int:
+        """差分のうち逆向きのトレード（load_trades で読み込んだもの）で相殺できる分を古い順に TradeClose し、
+        新規に発注する残りの units を返す関数"""
+        remaining = difference
+        for trade in self.trades.get(instrument, []):
+            current = int(float(trade["currentUnits"]))
+            if not remaining or not current or (current > 0) == (remaining > 0):
+                continue
+            units = min(abs(current), abs(remaining))
+            endpoint = trades.TradeClose(accountID=self.account_id, tradeID=trade["id"], data={"units": str(units)})
+            self.record_fill(self.client.request(endpoint))
+            trade["currentUnits"] = str(current + units if current < 0 else current - units)
+            remaining += units if remaining < 0 else -units
+        return remaining
+
+    def held(self, instrument: str) -> int:
+        if not self.loaded:
+            self.refresh()
+        return self.units.get(instrument, 0)
+
+    def delta(self, targets: Dict[str, int]) -> Dict[str, int]:
+        """目標 units（通貨ペア -> net units）との差分のうち 0 でないものを返す関数"""
+        deltas = {}
+        for instrument, target in targets.items():
+            difference = int(target) - self.held(instrument)
+            if difference:
+                deltas[instrument] = difference
+        return deltas
+
+    def record_fill(self, response: dict):
+        """OrderCreate のレスポンスの約定を保有 units に反映する関数（FOK で取り消された場合は何もしない）"""
+        fill = response.get("orderFillTransaction") if isinstance(response, dict) else None
+        if not fill:
+            return
+        instrument = fill["instrument"]
+        units = self.units.get(instrument, 0) + int(float(fill["units"]))
+        if units:
+            self.units[instrument] = units
+        else:
+            self.units.pop(instrument, None)
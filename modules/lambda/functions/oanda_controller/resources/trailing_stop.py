@@ -0,0 +1,208 @@
+"""保有中のトレードのストップロスを Chandelier Exit（ATR）で追従させるトレーリングストップ
+
+OpenTrades を 1回だけ呼び、保有する通貨ペアのローソク足（InstrumentsCandles）を並列に取得して
+全トレードの新しいストップ（またはトレーリングストップの距離）を列ごとにまとめて 1回で計算する.
+・Chandelier Exit: long は直近 period 本の高値 - multiplier * ATR、short は安値 + multiplier * ATR
+・ストップは有利な方向にのみ動かし、動かないトレードには API を呼ばない
+・変更のあるトレードのみ TradeCRCDO をスレッドプールから並列に送信する
+mode="trailing" では価格の代わりに multiplier * ATR を trailingStopLoss の距離として設定する（OANDA 側で追従する）
+"""
+import os
+import threading
+import time
+from typing import Callable, Iterable, List, Mapping, NamedTuple, Optional
+
+from oandapyV20.endpoints import instruments, trades
+from oandapyV20.exceptions import V20Error
+
+from client_order import v20_error_message
+from client_pool import ClientPool
+
+TRAILING_STOP_GRANULARITY = os.environ.get("TRAILING_STOP_GRANULARITY", "H1")
+TRAILING_STOP_PERIOD = int(os.environ.get("TRAILING_STOP_PERIOD", "22"))  # ATR・高値・安値の本数
+TRAILING_STOP_MULTIPLIER = float(os.environ.get("TRAILING_STOP_MULTIPLIER", "3.0"))  # ATR の倍率
+TRAILING_STOP_WORKERS = int(os.environ.get("TRAILING_STOP_WORKERS", "8"))  # 取得・更新を並列に送信するスレッド数
+
+
+class Volatility(NamedTuple):
+    instrument: str
+    atr: float
+    highest: float  # 直近 period 本の高値
+    lowest: float  # 直近 period 本の安値
+    close: float  # 最新の終値
+
+
+class StopUpdate(NamedTuple):
+    trade_id: str
+    instrument: str
+    units: int
+    current: Optional[float]  # 現在のストップ（mode="trailing" では距離）. 未設定なら None
+    new: float
+
+
+class StopSummary(NamedTuple):
+    trades: int  # 保有中のトレード数
+    updates: List[StopUpdate]  # 送信した更新
+    skipped: int  # ストップが動かない・ローソク足の無いトレード数
+    errors: List[str]
+    seconds: float
+
+
+def volatility(instrument: str, candles: List[dict], period: int) -> Optional[Volatility]:
+    """mid のローソク足から ATR（単純平均）と直近 period 本の高値・安値を求める関数. 本数が足りなければ None"""
+    candles = [c["mid"] for c in candles if c.get("complete", True)]
+    if len(candles) < period + 1:
+        return None
+    highs = [float(c["h"]) for c in candles[-period - 1:]]
+    lows = [float(c["l"]) for c in candles[-period - 1:]]
+    closes = [float(c["c"]) for c in candles[-period - 1:]]
+    true_ranges = [
+        max(high - low, abs(high - previous), abs(low - previous))
+        for high, low, previous in zip(highs[1:], lows[1:], closes[:-1])
+    ]
+    return Volatility(instrument, sum(true_ranges) / period, max(highs[1:]), min(lows[1:]), closes[-1])
+
+
+def current_level(trade: dict, mode: str) -> Optional[float]:
+    """トレードに設定済みのストップの価格（mode="trailing" では距離）を返す関数"""
+    if mode == "trailing":
+        order = trade.get("trailingStopLossOrder")
+        return float(order["distance"]) if order else None
+    order = trade.get("stopLossOrder")
+    return float(order["price"]) if order else None
+
+
+def chandelier_stops(
+    open_trades: Iterable[dict],
+    volatilities: Mapping[str, Volatility],
+    pip_locations: Mapping[str, int],
+    multiplier: float = TRAILING_STOP_MULTIPLIER,
+    mode: str = "stop",
+) -> List[StopUpdate]:
+    """全トレードの新しいストップを計算し、動くトレードの StopUpdate のみを返す関数"""
+    # トレードごとに分岐せず、列（向き・ATR・高値/安値・桁数）ごとに 1回の走査で計算する
+    rows = [t for t in open_trades if t["instrument"] in volatilities]
+    units = [int(float(t["currentUnits"])) for t in rows]
+    signs = [1 if u > 0 else -1 for u in units]
+    vols = [volatilities[t["instrument"]] for t in rows]
+    digits = [1 - pip_locations[t["instrument"]] for t in rows]
+    currents = [current_level(t, mode) for t in rows]
+    if mode == "trailing":
+        news = [round(multiplier * v.atr, d) for v, d in zip(vols, digits)]
+        # 距離は広げても狭めてもよく、同じ距離なら送らない
+        moves = [c is None or n != round(c, d) for c, n, d in zip(currents, news, digits)]
+    else:
+        news = [
+            round((v.highest if s > 0 else v.lowest) - s * multiplier * v.atr, d)
+            for v, s, d in zip(vols, signs, digits)
+        ]
+        # 有利な方向（long は上、short は下）にのみ動かし、現在値を越えるストップ（即時に約定する）は送らない
+        moves = [
+            (c is None or s * (n - c) > 0) and s * (v.close - n) > 0
+            for c, n, s, v in zip(currents, news, signs, vols)
+        ]
+    return [
+        StopUpdate(t["id"], t["instrument"], u, c, n)
+        for t, u, c, n, move in zip(rows, units, currents, news, moves)
+        if move
+    ]
+
+
+def report(summary: StopSummary) -> None:
+    """StopSummary を出力する関数"""
+    print(
+        f"trailing stop: {len(summary.updates)} of {summary.trades} trades updated, "
+        f"{summary.skipped} unchanged ({summary.seconds * 1000:.0f}ms)"
+    )
+    for update in summary.updates:
+        print(f"  {update.instrument} {update.trade_id} ({update.units}): {update.current} -> {update.new}")
+    for error in summary.errors:
+        print("Error:", error)
+
+
+class TrailingStopEngine:
+    """保有中のトレードのストップをまとめて更新するクラス. 取得・更新は ClientPool から並列に送信する
+
+    Args:
+        account_id (str): 口座 ID
+        client_factory (Callable): API クライアントを生成する関数. 送信スレッドごとに 1つ作る
+        granularity (str, optional): ATR を求めるローソク足の足の長さ
+        period (int, optional): ATR・高値・安値の本数
+        multiplier (float, optional): ATR の倍率
+        mode (str, optional): "stop"（Chandelier Exit の価格を stopLoss に設定）| "trailing"（ATR の倍数を trailingStopLoss の距離に設定）
+        workers (int, optional): ローソク足の取得・TradeCRCDO を並列に送信するスレッド数
+    """
+
+    def __init__(
+        self,
+        account_id: str,
+        client_factory: Callable,
+        granularity: str = TRAILING_STOP_GRANULARITY,
+        period: int = TRAILING_STOP_PERIOD,
+        multiplier: float = TRAILING_STOP_MULTIPLIER,
+        mode: str = "stop",
+        workers: int = TRAILING_STOP_WORKERS,
+    ) -> None:
+        if mode not in ("stop", "trailing"):
+            raise Exception(f"mode が不正です: {mode}")
+        self.account_id = account_id
+        self.client_factory = client_factory
+        self.granularity = granularity
+        self.period = period
+        self.multiplier = multiplier
+        self.mode = mode
+        self._pool = ClientPool(client_factory, workers, "stop")
+
+    def run(self, client, pip_location: Callable[[str], int]) -> StopSummary:
+        """OpenTrades を 1回呼び、ストップが動くトレードのみ TradeCRCDO を送る関数
+
+        Args:
+            client (oandapyV20.API): OpenTrades を取得するクライアント
+            pip_location (Callable): 通貨ペアから pip の位置を返す関数（instrument_table から引く）
+        """
+        started = time.monotonic()
+        open_trades = client.request(trades.OpenTrades(accountID=self.account_id)).get("trades", [])
+        names = sorted({t["instrument"] for t in open_trades})
+        volatilities = {v.instrument: v for v in self._pool.map(self._volatility, names) if v is not None}
+        pip_locations = {name: pip_location(name) for name in volatilities}
+        updates = chandelier_stops(open_trades, volatilities, pip_locations, self.multiplier, self.mode)
+        errors = [error for error in self._pool.map(self._send, updates) if error is not None]
+        return StopSummary(len(open_trades), updates, len(open_trades) - len(updates), errors, time.monotonic() - started)
+
+    def start(self, pip_location: Callable[[str], int], interval: float):
+        """interval 秒ごとにストップを更新するスレッドを起動する関数（常駐プロセス用）"""
+
+        def loop():
+            client = self.client_factory()  # 発注のワーカーとクライアントを共有しない
+            while True:
+                time.sleep(interval)
+                try:
+                    report(self.run(client, pip_location))
+                except Exception as e:
+                    print(f"ストップを更新できませんでした: {e}")
+
+        threading.Thread(target=loop, name="trailing-stop-loop", daemon=True).start()
+        return self
+
+    def _volatility(self, client, instrument: str) -> Optional[Volatility]:
+        params = {"granularity": self.granularity, "count": self.period + 2, "price": "M"}
+        try:
+            response = client.request(instruments.InstrumentsCandles(instrument, params=params))
+        except Exception as e:
+            print(f"{instrument} のローソク足を取得できませんでした: {e}")
+            return None
+        return volatility(instrument, response.get("candles", []), self.period)
+
+    def _send(self, client, update: StopUpdate) -> Optional[str]:
+        level = f"{update.new:.5f}"  # 桁数は chandelier_stops で丸め済み（contrib の PriceValue と同じ表記）
+        if self.mode == "trailing":
+            data = {"trailingStopLoss": {"distance": level, "timeInForce": "GTC"}}
+        else:
+            data = {"stopLoss": {"price": level, "timeInForce": "GTC"}}
+        try:
+            client.request(trades.TradeCRCDO(self.account_id, update.trade_id, data=data))
+        except V20Error as e:
+            return f"{update.instrument} {update.trade_id}: {v20_error_message(e)}"
+        except Exception as e:
+            return f"{update.instrument} {update.trade_id}: {e}"
+        return None
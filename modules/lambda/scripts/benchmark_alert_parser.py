@@ -0,0 +1,84 @@
+"""webhook のアラート解析（alert_parser.parse）のマイクロベンチマーク
+
+JSON / TradingView の既定文（日本語・英語）/ Lambda が解析済みの dict のそれぞれについて
+1件あたりの解析時間と 1秒あたりの件数を計測する.
+比較のため、従来の json.loads + dict の添字アクセス（既定文は解析できない）の時間も表示する
+
+    python benchmark_alert_parser.py
+    python benchmark_alert_parser.py --number 200000 --repeat 5
+"""
+import argparse
+import json
+import sys
+import timeit
+from typing import Callable, NamedTuple
+
+from lambda_loader import use_vendored_packages
+
+use_vendored_packages("oanda_controller")
+
+from alert_parser import parse  # noqa: E402
+
+JSON_BODY = json.dumps(
+    {
+        "title": "Chandelier Exit Strategy",
+        "ticker": "USDJPY",
+        "orderAction": "buy",
+        "orderContracts": "100",
+        "positionSize": "100",
+        "comment": "",
+        "time": "2024-08-05T04:55:00Z",
+        "__origin__": "__trading_view__",
+    }
+)
+TEXT_JA = "Squeeze Momentum Strategy [vls] (,100,20,2,20, 1.5): USDJPY で buy @ 100 の注文が約定しました。新しいストラテジーポジションは 0 です"
+TEXT_EN = "Squeeze Momentum Strategy [vls] (,100,20,2,20, 1.5): order buy @ 100 filled on OANDA:USDJPY. New strategy position is 0"
+
+CASES = {
+    "json": lambda: parse(JSON_BODY),
+    "text_ja": lambda: parse(TEXT_JA),
+    "text_en": lambda: parse(TEXT_EN),
+    "dict": lambda body=json.loads(JSON_BODY): parse(body),
+}
+
+
+def legacy_parse(body: str = JSON_BODY):
+    """従来のハンドラと同じ解析（json.loads して必要な項目を添字で取り出す）"""
+    data = json.loads(body)
+    return data["__origin__"], data["orderAction"], data["orderContracts"], data["comment"], data.get("positionSize")
+
+
+class BenchmarkRow(NamedTuple):
+    case: str
+    us_per_op: float
+    ops_per_sec: float
+
+
+def measure(case: str, func: Callable, number: int, repeat: int) -> BenchmarkRow:
+    """repeat 回計測した最短時間から 1件あたりの時間を求める関数"""
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    return BenchmarkRow(case, best * 1e6, 1 / best)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=50000, help="1回の計測で解析する件数")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（最短時間を採用）")
+    args = parser.parse_args()
+
+    # 解析結果が期待どおりであることを確認してから計測する
+    for case, func in CASES.items():
+        alert = func()
+        if alert.instrument != "USD_JPY" or alert.action != "buy" or alert.contracts != "100":
+            print(f"MISMATCH {case}: {alert}")
+            sys.exit(1)
+
+    rows = [measure("legacy_json", legacy_parse, args.number, args.repeat)]
+    rows += [measure(case, func, args.number, args.repeat) for case, func in CASES.items()]
+    print(f"{'case':<12} {'us/op':>8} {'ops/s':>12}")
+    for row in rows:
+        print(f"{row.case:<12} {row.us_per_op:>8.2f} {row.ops_per_sec:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
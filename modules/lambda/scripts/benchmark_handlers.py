@@ -0,0 +1,234 @@
+"""各 lambda_handler のエンドツーエンドベンチマーク
+
+ローカルスタンドインサーバ（oanda_local_server.py）を起動し、関数ごとに別プロセスで
+・コールド import 時間（lambda_function.py と同梱ライブラリの読み込み）
+・ウォーム実行のレイテンシ（p50 / p99）
+・1回の実行あたりの API 呼び出し回数・送受信バイト数
+・ピーク RSS
+を計測する. 結果は保存済みのベースライン（benchmark_baseline.json）と比較し、悪化していれば終了コード 1 を返す
+
+    python benchmark_handlers.py --iterations 20
+    python benchmark_handlers.py --latency-ms 30 --jitter-ms 10
+    python benchmark_handlers.py --update-baseline
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+BASELINE_PATH = Path(__file__).resolve().parent / "benchmark_baseline.json"
+
+WEBHOOK_BODY = {"__origin__": "__trading_view__", "ticker": "USDJPY", "orderContracts": "100", "comment": ""}
+CHECK_EVENT_BODY = "Squeeze Momentum Strategy [vls] (,100,20,2,20, 1.5): USDJPY で buy @ 100 の注文が約定しました。新しいストラテジーポジションは 0 です"
+
+FUNCTIONS = ("esperanto_controller", "accumulation_controller", "oanda_controller", "check_event", "event_router")
+ROUTER_EVENTS = ("webhook", "esperanto", "webhook", "accumulation")  # event_router に順に送るイベント
+
+# 指標ごとの許容範囲（ベースラインからの増加率）. None なら --tolerance を使う
+TOLERANCES = {
+    "import_ms": None,
+    "p50_ms": None,
+    "p99_ms": None,
+    "api_calls": 0.0,
+    "bytes": 0.05,
+    "peak_rss_kb": 0.1,
+}
+MIN_DELTA_MS = 5.0  # これ未満の時間差は計測誤差として扱う
+
+
+class BenchmarkResult(NamedTuple):
+    import_ms: float  # コールド import 時間
+    p50_ms: float  # ウォーム実行のレイテンシ中央値
+    p99_ms: float  # ウォーム実行のレイテンシ 99 パーセンタイル
+    api_calls: float  # 1回の実行あたりの API 呼び出し回数
+    bytes: float  # 1回の実行あたりの送受信バイト数
+    peak_rss_kb: int  # ピーク RSS
+
+
+def make_event(function_path: str, n: int):
+    """n 回目の実行に渡すイベントを返す関数（webhook は buy / sell を交互に送る）"""
+    if function_path == "event_router":
+        event_type = ROUTER_EVENTS[n % len(ROUTER_EVENTS)]
+        if event_type == "webhook":
+            return make_event("oanda_controller", n // 2)
+        return {"strategy": event_type}
+    if function_path == "oanda_controller":
+        # time を変えて重複したアラートとして弾かれないようにする
+        return {"body": json.dumps({**WEBHOOK_BODY, "orderAction": ("buy", "sell")[n % 2], "time": str(n)})}
+    if function_path == "check_event":
+        return {"body": CHECK_EVENT_BODY, "isBase64Encoded": False}
+    return None
+
+
+def percentile(values: List[float], q: float) -> float:
+    """線形補間でパーセンタイルを求める関数"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def peak_rss_kb() -> int:
+    """プロセスのピーク RSS（KB）を返す関数
+    ru_maxrss は exec 前の親プロセスの値を引き継ぐため、Linux では /proc の VmHWM を優先する
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def worker(function_path: str, iterations: int, output: Path):
+    """子プロセス側: import と実行時間を計測して JSON に書き出す"""
+    started = time.perf_counter()
+    from lambda_loader import load_handler
+
+    module = load_handler(function_path)
+    import_ms = (time.perf_counter() - started) * 1000
+
+    latencies = []
+    sink = io.StringIO()
+    # 1回目は接続確立を含むためウォームアップとして計測から除く
+    for n in range(iterations + 1):
+        event = make_event(function_path, n)
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(sink):
+            module.lambda_handler(event, None)
+        if n:
+            latencies.append((time.perf_counter() - started) * 1000)
+        sink.seek(0)
+        sink.truncate()
+
+    output.write_text(json.dumps({
+        "import_ms": import_ms,
+        "latencies": latencies,
+        "peak_rss_kb": peak_rss_kb(),
+    }))
+
+
+def run_function(function_path: str, iterations: int, server) -> BenchmarkResult:
+    """1関数分の子プロセスを起動し、サーバの統計と合わせて結果を返す関数"""
+    host, port = server.server_address
+    env = {
+        **os.environ,
+        "OANDA_ENVIRONMENT": "local",
+        "OANDA_LOCAL_API_URL": f"http://{host}:{port}",
+        "OANDA_LOCAL_STREAM_URL": f"http://{host}:{port}",
+    }
+    before = dict(server.stats)
+    with tempfile.NamedTemporaryFile(suffix=".json") as output:
+        subprocess.run(
+            [sys.executable, __file__, "--worker", function_path, "--iterations", str(iterations), "--output", output.name],
+            env=env,
+            check=True,
+        )
+        measured = json.loads(Path(output.name).read_text())
+    after = server.stats
+    invocations = iterations + 1
+    latencies = measured["latencies"]
+    return BenchmarkResult(
+        import_ms=measured["import_ms"],
+        p50_ms=percentile(latencies, 0.5),
+        p99_ms=percentile(latencies, 0.99),
+        api_calls=(after["requests"] - before["requests"]) / invocations,
+        bytes=(after["bytes_sent"] + after["bytes_received"] - before["bytes_sent"] - before["bytes_received"]) / invocations,
+        peak_rss_kb=measured["peak_rss_kb"],
+    )
+
+
+def compare(results: Dict[str, BenchmarkResult], baseline: dict, tolerance: float) -> List[str]:
+    """ベースラインより悪化した指標の一覧を返す関数"""
+    regressions = []
+    for function_path, result in results.items():
+        if function_path not in baseline:
+            continue
+        for metric, value in result._asdict().items():
+            value = round(value, 2)  # ベースラインと同じ桁数で比べる（api_calls の許容範囲は 0）
+            base = baseline[function_path].get(metric)
+            allowed = TOLERANCES[metric] if TOLERANCES[metric] is not None else tolerance
+            if base is None or (metric.endswith("_ms") and value - base < MIN_DELTA_MS):
+                continue
+            if value > base * (1 + allowed):
+                regressions.append(f"{function_path}.{metric}: {base:.2f} -> {value:.2f} (+{(value / base - 1) * 100 if base else 0:.1f}%)")
+    return regressions
+
+
+def print_results(results: Dict[str, BenchmarkResult], baseline: dict):
+    print(f"{'function':<26}{'import_ms':>11}{'p50_ms':>9}{'p99_ms':>9}{'api_calls':>11}{'bytes':>11}{'rss_kb':>9}")
+    for function_path, r in results.items():
+        print(
+            f"{function_path:<26}{r.import_ms:>11.1f}{r.p50_ms:>9.2f}{r.p99_ms:>9.2f}"
+            f"{r.api_calls:>11.1f}{r.bytes:>11.0f}{r.peak_rss_kb:>9}"
+        )
+        if function_path in baseline:
+            b = baseline[function_path]
+            print(
+                f"{'  baseline':<26}{b['import_ms']:>11.1f}{b['p50_ms']:>9.2f}{b['p99_ms']:>9.2f}"
+                f"{b['api_calls']:>11.1f}{b['bytes']:>11.0f}{b['peak_rss_kb']:>9}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--functions", default=",".join(FUNCTIONS), help="カンマ区切りの関数名")
+    parser.add_argument("--iterations", type=int, default=20, help="ウォーム実行の回数")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--throughput-kbps", type=float, default=0.0)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="時間指標の許容増加率")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="今回の結果でベースラインを上書きする")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--output", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.iterations, args.output)
+        return
+
+    from lambda_loader import load_handler
+    from oanda_local_server import NetworkProfile, serve
+    from oanda_simulator import PaperTradingAPI, ReplayPriceFeed
+
+    instruments = load_handler("esperanto_controller").Price.main_currency_pairs
+    simulator = PaperTradingAPI(ReplayPriceFeed.synthetic(instruments, n_times=1000, seed=0), balance=1e12)
+    profile = NetworkProfile(args.latency_ms, args.jitter_ms, 0.0, args.throughput_kbps)
+    server = serve("127.0.0.1", 0, simulator, profile)
+
+    results = {}
+    for function_path in args.functions.split(","):
+        results[function_path] = run_function(function_path, args.iterations, server)
+        simulator.advance()
+    server.shutdown()
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    print_results(results, baseline)
+
+    if args.update_baseline:
+        baseline.update({name: {k: round(v, 2) for k, v in result._asdict().items()} for name, result in results.items()})
+        args.baseline.write_text(json.dumps(baseline, indent=2) + "\n")
+        print(f"ベースラインを更新しました: {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Esperanto スキャンのスケーリングベンチマーク
+
+通貨数（10 / 20 / 40 / 80）とクロス通貨ペアの網羅率を変えた合成の price_map を生成し、
+スキャンエンジンごとに
+・全組み合わせのスキャン時間
+・1組み合わせあたりの評価時間
+・スキャン中のピークメモリ（tracemalloc）
+を計測する. 併せて各エンジンの結果（組み合わせごとの esperanto_ratio と long/short）が
+calc_esperanto_ratio を使う参照実装と完全に一致することを検証する
+
+    python benchmark_scan.py
+    python benchmark_scan.py --currencies 10,20,40,80 --coverage 0.2,0.5,1.0 --repeat 3
+"""
+import argparse
+import contextlib
+import io
+import math
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+from candles import EXOTIC_CURRENCIES, EXOTIC_SPREAD, MAJOR_SPREAD, USD_RATES
+from lambda_loader import load_handler
+
+# 通貨ペアの基軸通貨にする優先順（OANDA の慣習に近い順）
+CURRENCY_PRIORITY = ("EUR", "GBP", "AUD", "NZD", "USD", "CAD", "CHF")
+MISPRICING = 0.00005  # 三角裁定の歪みを作るための各ペアのずれ（標準偏差）
+
+
+class ScanOutput(NamedTuple):
+    results: Dict[str, Tuple[float, tuple, tuple]]  # 組み合わせ名 -> (esperanto_ratio, long, short)
+    long_positions: List[str]
+    short_positions: List[str]
+
+
+class BenchmarkRow(NamedTuple):
+    engine: str
+    currencies: int
+    coverage: float
+    pairs: int
+    triangles: int  # 評価した組み合わせ数（ペアが揃っているもの）
+    scan_ms: float
+    per_triangle_us: float
+    peak_kb: float
+    identical: bool
+
+
+def synthetic_currencies(n: int, seed: int = 0) -> Dict[str, float]:
+    """n 通貨分の USD 建てレートを返す関数. USD_RATES に無い分は架空の通貨で補う"""
+    rng = random.Random(seed)
+    rates = dict(list(USD_RATES.items())[:n])
+    for i in range(n - len(rates)):
+        rates[f"X{i:02d}"] = math.exp(rng.uniform(math.log(0.0005), math.log(2.0)))
+    return rates
+
+
+def synthetic_price_map(handler, n: int, coverage: float, seed: int = 0):
+    """n 通貨・網羅率 coverage の price_map を生成する関数
+    各通貨の USD ペアは必ず含め、それ以外のクロスは coverage の割合で含める
+
+    Args:
+        handler (module): esperanto_controller の lambda_function
+        n (int): 通貨数
+        coverage (float): USD 以外のクロスペアを含める割合 (0〜1)
+        seed (int, optional): 乱数のシード
+
+    Returns:
+        Tuple[List[str], Dict[str, Prices]]: 通貨リストと price_map
+    """
+    rng = random.Random(seed)
+    rates = synthetic_currencies(n, seed)
+    currencies = list(rates)
+
+    def rank(currency):
+        return CURRENCY_PRIORITY.index(currency) if currency in CURRENCY_PRIORITY else len(CURRENCY_PRIORITY)
+
+    price_map = {}
+    for i, a in enumerate(currencies):
+        for b in currencies[i + 1:]:
+            if "USD" not in (a, b) and rng.random() >= coverage:
+                continue
+            base, quote = sorted((a, b), key=lambda c: (rank(c), -rates[c]))
+            mid = rates[base] / rates[quote] * (1 + rng.gauss(0, MISPRICING))
+            exotic = base in EXOTIC_CURRENCIES or quote in EXOTIC_CURRENCIES or base[0] == "X" or quote[0] == "X"
+            half = mid * (EXOTIC_SPREAD if exotic else MAJOR_SPREAD) / 2
+            price_map[f"{base}_{quote}"] = handler.Price.Prices(mid - half, mid + half, mid)
+    return currencies, price_map
+
+
+def reference_engine(handler, currencies: Sequence[str], price_map: dict, baseline: float) -> ScanOutput:
+    """calc_esperanto_ratio を組み合わせごとに呼ぶ参照実装（Esperanto.scan と同じ順序・例外処理）"""
+    price = handler.Price()
+    price.price_map = price_map
+    esperanto = handler.Esperanto(price, baseline=baseline)
+    results = {}
+    for i in range(len(currencies)):
+        for j in range(i + 1, len(currencies)):
+            for k in range(j + 1, len(currencies)):
+                try:
+                    esperanto.calc_esperanto_ratio(price_map, currencies[i], currencies[j], currencies[k])
+                    esperanto.evaluate_esperanto_result()
+                except Exception:
+                    continue
+                r = esperanto.result
+                results[r.combination_name] = (r.esperanto_ratio, tuple(r.long_positions), tuple(r.short_positions))
+    return ScanOutput(results, esperanto.long_positions, esperanto.short_positions)
+
+
+def scan_engine(handler, currencies: Sequence[str], price_map: dict, baseline: float) -> ScanOutput:
+    """ハンドラが実際に使う Esperanto.scan. 組み合わせごとの結果は返さないため long/short のみ比較する"""
+    price = handler.Price()
+    price.price_map = price_map
+    esperanto = handler.Esperanto(price, baseline=baseline)
+    esperanto.vehicle_currencies = list(currencies)
+    esperanto.scan()
+    return ScanOutput(None, esperanto.long_positions, esperanto.short_positions)
+
+
+def quote_table_engine(handler, currencies: Sequence[str], price_map: dict, baseline: float) -> ScanOutput:
+    """逆数を含む全方向の (bid, ask, mid) を先に表にしてから評価するエンジン
+    get_price_from_pricemap の文字列生成・分岐と print を省き、計算式と順序は参照実装と揃える
+    """
+    table = {}
+    for name, p in price_map.items():
+        base, quote = name.split("_")
+        table[base, quote] = (p.bid, p.ask, p.mid)
+        table[quote, base] = (1 / p.ask, 1 / p.bid, 1 / p.mid)
+
+    results = {}
+    long_positions, short_positions = [], []
+    n = len(currencies)
+    for i in range(n):
+        a = currencies[i]
+        for j in range(i + 1, n):
+            b = currencies[j]
+            target = table.get((b, a))
+            if target is None:
+                continue
+            for k in range(j + 1, n):
+                v = currencies[k]
+                v_first = table.get((b, v))
+                v_second = table.get((a, v))
+                if v_first is None or v_second is None:
+                    continue
+                mid_ratio = target[2] / (v_first[2] / v_second[2])
+                if mid_ratio < 1:
+                    ratio = target[1] / (v_first[0] / v_second[1])
+                    longs, shorts = ((f"{b}_{a}", f"{a}_{v}"), (f"{b}_{v}",)) if ratio < 1 else ((), ())
+                elif mid_ratio > 1:
+                    ratio = target[0] / (v_first[1] / v_second[0])
+                    longs, shorts = ((f"{b}_{v}",), (f"{b}_{a}", f"{a}_{v}")) if ratio > 1 else ((), ())
+                else:
+                    continue  # 参照実装では例外となりスキップされる
+                results[f"{a}_{b}_{v}"] = (ratio, longs, shorts)
+                if (ratio < 1 and ratio + baseline < 1) or (ratio > 1 and ratio - baseline > 1):
+                    long_positions += longs
+                    short_positions += shorts
+    return ScanOutput(results, long_positions, short_positions)
+
+
+ENGINES: Dict[str, Callable] = {
+    "reference": reference_engine,
+    "scan": scan_engine,
+    "quote_table": quote_table_engine,
+}
+
+
+def identical(output: ScanOutput, reference: ScanOutput) -> bool:
+    """エンジンの結果が参照実装と完全に一致するか"""
+    if output.long_positions != reference.long_positions or output.short_positions != reference.short_positions:
+        return False
+    return output.results is None or output.results == reference.results
+
+
+def measure(engine: Callable, handler, currencies, price_map, baseline: float, repeat: int):
+    """エンジンを repeat 回実行し、最短時間・ピークメモリ・結果を返す関数
+    ハンドラと同じく print は行うが出力は捨てる
+    """
+    sink = io.StringIO()
+    best = math.inf
+    for _ in range(repeat):
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(sink):
+            output = engine(handler, currencies, price_map, baseline)
+        best = min(best, time.perf_counter() - started)
+        sink.seek(0)
+        sink.truncate()
+
+    tracemalloc.start()
+    with contextlib.redirect_stdout(sink):
+        engine(handler, currencies, price_map, baseline)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, output
+
+
+def run_benchmark(engines: Sequence[str], sizes: Sequence[int], coverages: Sequence[float], repeat: int = 1, baseline: float = None, seed: int = 0) -> List[BenchmarkRow]:
+    handler = load_handler("esperanto_controller")
+    baseline = handler.ENTRY_BASELINE if baseline is None else baseline
+    rows = []
+    for n in sizes:
+        for coverage in coverages:
+            currencies, price_map = synthetic_price_map(handler, n, coverage, seed)
+            _, _, reference = measure(reference_engine, handler, currencies, price_map, baseline, 1)
+            for name in engines:
+                seconds, peak, output = measure(ENGINES[name], handler, currencies, price_map, baseline, repeat)
+                triangles = max(len(reference.results), 1)
+                rows.append(BenchmarkRow(
+                    engine=name,
+                    currencies=n,
+                    coverage=coverage,
+                    pairs=len(price_map),
+                    triangles=len(reference.results),
+                    scan_ms=seconds * 1000,
+                    per_triangle_us=seconds / triangles * 1e6,
+                    peak_kb=peak / 1024,
+                    identical=identical(output, reference),
+                ))
+    return rows
+
+
+def print_rows(rows: List[BenchmarkRow]):
+    print(f"{'engine':<12}{'ccy':>5}{'cover':>7}{'pairs':>7}{'triangles':>11}{'scan_ms':>11}{'us/tri':>9}{'peak_kb':>10}  identical")
+    for r in rows:
+        print(
+            f"{r.engine:<12}{r.currencies:>5}{r.coverage:>7.2f}{r.pairs:>7}{r.triangles:>11}"
+            f"{r.scan_ms:>11.1f}{r.per_triangle_us:>9.2f}{r.peak_kb:>10.1f}  {r.identical}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", default=",".join(ENGINES))
+    parser.add_argument("--currencies", default="10,20,40,80", help="カンマ区切りの通貨数")
+    parser.add_argument("--coverage", default="0.25,0.5,1.0", help="カンマ区切りのクロスペア網羅率")
+    parser.add_argument("--repeat", type=int, default=1, help="各エンジンの試行回数（最短時間を採用）")
+    parser.add_argument("--baseline", type=float, default=None, help="エントリー判定の閾値. 省略時は ENTRY_BASELINE")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = run_benchmark(
+        args.engines.split(","),
+        [int(n) for n in args.currencies.split(",")],
+        [float(c) for c in args.coverage.split(",")],
+        repeat=args.repeat,
+        baseline=args.baseline,
+        seed=args.seed,
+    )
+    print_rows(rows)
+    mismatched = [r for r in rows if not r.identical]
+    for r in mismatched:
+        print(f"MISMATCH {r.engine} currencies={r.currencies} coverage={r.coverage}")
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
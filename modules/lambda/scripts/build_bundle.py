@@ -0,0 +1,278 @@
+"""Lambda 関数ごとのデプロイ用 zip を生成するビルドスクリプト
+
+create_zip.sh は resources/ 全体（bin/, *.dist-info, charset_normalizer の CLI,
+urllib3/contrib/emscripten, docstring 用のレスポンス例, ローカルの __pycache__ 等）をそのまま zip にする.
+このスクリプトは
+・lambda_function.py から辿れる import グラフ（modulefinder）に含まれるモジュールだけを残し
+・ランタイムと同じバージョンの Python で .pyc（unchecked-hash）を事前にコンパイルし
+・タイムスタンプを固定した再現性のある zip を作る
+--layer を指定すると同梱ライブラリを関数間で共有するレイヤー（python/ 配下）に分け、関数の zip には lambda_function.py のみを入れる.
+最後に create_zip.sh 相当の zip とサイズ・import 時間を比較して表示する
+
+    python build_bundle.py --python ~/.pyenv/versions/3.12.1/bin/python3.12
+    python build_bundle.py --layer --sourceless
+    python build_bundle.py --functions oanda_controller --output ../functions/oanda_controller/lambda_function.zip
+"""
+import argparse
+import fnmatch
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import zipfile
+from modulefinder import ModuleFinder
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Set
+
+from lambda_loader import FUNCTIONS_DIR, OFFLINE_ENVIRONMENT, resources_dir
+
+BUILD_DIR = FUNCTIONS_DIR.parent / "build"
+RUNTIME = "python3.12"  # lambda.tf の runtime と揃える
+FUNCTIONS = ("check_event", "oanda_controller", "esperanto_controller", "accumulation_controller", "event_router")
+
+# import_module 等の動的 import で modulefinder が辿れないため常に含めるファイル
+ALWAYS_INCLUDE = (
+    "oandapyV20/definitions/*.py",
+)
+# importlib.import_module で読み込むため modulefinder が辿れない関数ごとのモジュール. import グラフの起点に加える
+DYNAMIC_IMPORTS = {
+    "event_router": ("strategies/*.py",),  # STRATEGIES のストラテジー（初回のイベントで import する）
+}
+# 実行時に読み込まれるデータファイル
+DATA_FILES = (
+    "certifi/cacert.pem",
+)
+# import はされるが Lambda（Linux）では使われないため除くファイル
+EXCLUDE = (
+    "urllib3/contrib/emscripten/*",  # sys.platform == "emscripten" の時のみ
+)
+ZIP_DATE_TIME = (2024, 1, 1, 0, 0, 0)  # zip 内のタイムスタンプ. 固定して同じ入力なら同じ zip にする
+
+
+class BundleReport(NamedTuple):
+    function: str
+    files: int  # zip 内のファイル数
+    zip_bytes: int  # 関数の zip サイズ
+    layer_bytes: int  # 共有レイヤーの zip サイズ（レイヤーなしは 0）
+    legacy_files: int  # create_zip.sh 相当の zip のファイル数
+    legacy_bytes: int  # create_zip.sh 相当の zip サイズ
+    import_ms: float  # ビルドした zip からの lambda_function の import 時間（中央値）
+    legacy_import_ms: float  # create_zip.sh 相当の zip からの import 時間（中央値）
+
+
+def walk_files(directory: Path) -> List[Path]:
+    """シンボリックリンク先（event_router の同梱ライブラリ等）も辿ってファイルを列挙する関数"""
+    return sorted(
+        Path(root) / name
+        for root, _, names in os.walk(directory, followlinks=True)
+        for name in names
+    )
+
+
+def dynamic_modules(function_path: str) -> List[str]:
+    """DYNAMIC_IMPORTS に一致する resources 配下のファイルをモジュール名で返す関数. ex) strategies.webhook"""
+    resources = resources_dir(function_path)
+    candidates = [p.relative_to(resources).as_posix() for p in walk_files(resources)]
+    return [
+        name[: -len(".py")].replace("/", ".")
+        for pattern in DYNAMIC_IMPORTS.get(function_path, ())
+        for name in fnmatch.filter(candidates, pattern)
+        if not name.endswith("__init__.py")
+    ]
+
+
+def find_dependencies(function_path: str) -> Set[str]:
+    """lambda_function.py から辿れる resources 配下のファイルを resources からの相対パスで返す関数
+
+    Args:
+        function_path (str): functions 配下のディレクトリ名. ex) oanda_controller
+
+    Returns:
+        Set[str]: 含めるファイルの相対パス（lambda_function.py を含む）
+    """
+    resources = resources_dir(function_path)
+    finder = ModuleFinder(path=[str(resources)] + sys.path[1:])
+    finder.run_script(str(resources / "lambda_function.py"))
+    for name in dynamic_modules(function_path):
+        finder.import_hook(name)
+
+    files = {"lambda_function.py"}
+    for module in finder.modules.values():
+        if not module.__file__:
+            continue
+        # event_router のシンボリックリンク先も resources 配下として扱うため resolve はしない
+        path = Path(os.path.abspath(module.__file__))
+        if path.suffix == ".py" and resources in path.parents:
+            files.add(path.relative_to(resources).as_posix())
+
+    # 同梱パッケージを使う関数のみ、動的 import 先とデータファイルを加える
+    candidates = [p.relative_to(resources).as_posix() for p in walk_files(resources)]
+    for pattern in ALWAYS_INCLUDE + DATA_FILES:
+        package = pattern.split("/")[0]
+        if any(f.startswith(package + "/") for f in files):
+            files.update(fnmatch.filter(candidates, pattern))
+    for pattern in EXCLUDE:
+        files.difference_update(fnmatch.filter(list(files), pattern))
+    return files
+
+
+def stage(function_path: str, files: Set[str], destination: Path):
+    """選んだファイルを staging ディレクトリへコピーする関数"""
+    resources = resources_dir(function_path)
+    for name in sorted(files):
+        target = destination / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(resources / name, target)
+
+
+def compile_tree(python: str, directory: Path, ddir: str, sourceless: bool):
+    """ランタイムと同じ Python で .pyc を事前にコンパイルする関数
+    Lambda の /var/task は読み取り専用で __pycache__ を書き込めないため、毎回のコールドスタートでのコンパイルを避ける
+    mtime の検証が不要な unchecked-hash で生成する
+
+    Args:
+        python (str): コンパイルに使う Python
+        directory (Path): 対象ディレクトリ
+        ddir (str): トレースバックに表示するデプロイ先のパス. ex) /var/task
+        sourceless (bool): True なら .py を削除し .pyc のみを残す
+    """
+    command = [python, "-m", "compileall", "-q", "-j", "0", "--invalidation-mode", "unchecked-hash", "-d", ddir]
+    if sourceless:
+        command.append("-b")  # .py と同じ場所に .pyc を置く
+    subprocess.run(command + [str(directory)], check=True)
+    if sourceless:
+        for source in directory.rglob("*.py"):
+            if source.with_suffix(".pyc").exists():
+                source.unlink()
+
+
+def write_zip(directory: Path, output: Path, prefix: str = "") -> int:
+    """ディレクトリを再現性のある zip にしてサイズを返す関数"""
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
+        for path in sorted(p for p in directory.rglob("*") if p.is_file()):
+            info = zipfile.ZipInfo(prefix + path.relative_to(directory).as_posix(), ZIP_DATE_TIME)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            archive.writestr(info, path.read_bytes())
+    return output.stat().st_size
+
+
+def legacy_zip(function_path: str, output: Path) -> int:
+    """create_zip.sh と同じく resources/ 全体を zip にしてサイズを返す関数"""
+    resources = resources_dir(function_path)
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+        for path in walk_files(resources):
+            archive.write(path, path.relative_to(resources).as_posix())
+    return output.stat().st_size
+
+
+def measure_import(python: str, paths: List[Path], repeat: int, modules: List[str] = ()) -> float:
+    """新しいプロセスで lambda_function を import する時間（ms, 中央値）を返す関数
+    Lambda と同じく __pycache__ を書き込まない状態で計測する.
+    modules（動的 import 先）も続けて import し、zip に足りないモジュールがあれば失敗させる（時間には含めない）
+    """
+    code = (
+        "import importlib, sys, time\n"
+        f"sys.path[:0] = {[str(p) for p in paths]!r}\n"
+        "started = time.perf_counter()\n"
+        "import lambda_function\n"
+        "elapsed = (time.perf_counter() - started) * 1000\n"
+        f"for name in {list(modules)!r}:\n"
+        "    importlib.import_module(name)\n"
+        "print(elapsed)\n"
+    )
+    env = {**os.environ, **OFFLINE_ENVIRONMENT, "PYTHONDONTWRITEBYTECODE": "1"}
+    env.pop("PYTHONPATH", None)
+    samples = []
+    for _ in range(repeat):
+        result = subprocess.run([python, "-c", code], env=env, capture_output=True, text=True, cwd=tempfile.gettempdir())
+        if result.returncode:
+            raise Exception(f"lambda_function の import に失敗しました: {paths}\n{result.stderr}")
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def extract(archive: Path, destination: Path) -> Path:
+    with zipfile.ZipFile(archive) as z:
+        z.extractall(destination)
+    return destination
+
+
+def build(functions: List[str], python: str, use_layer: bool, sourceless: bool, build_dir: Path, repeat: int, output: Path = None) -> List[BundleReport]:
+    """関数ごとの zip（と共有レイヤー）を生成し、比較結果を返す関数"""
+    dependencies: Dict[str, Set[str]] = {f: find_dependencies(f) for f in functions}
+    reports = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        layer_path, layer_bytes = None, 0
+        if use_layer:
+            # 関数間で共有するライブラリ（lambda_function.py 以外）の和集合をレイヤーにする
+            layer_dir = tmp / "layer"
+            for function_path, files in dependencies.items():
+                stage(function_path, files - {"lambda_function.py"}, layer_dir)
+            if layer_dir.exists():
+                compile_tree(python, layer_dir, "/opt/python", sourceless)
+                layer_path = build_dir / "layer.zip"
+                layer_bytes = write_zip(layer_dir, layer_path, prefix="python/")
+
+        for function_path, files in dependencies.items():
+            staging = tmp / "stage" / function_path
+            stage(function_path, {"lambda_function.py"} if use_layer else files, staging)
+            compile_tree(python, staging, "/var/task", sourceless)
+            zip_path = output if output and len(functions) == 1 else build_dir / f"{function_path}.zip"
+            zip_bytes = write_zip(staging, zip_path)
+
+            legacy_path = tmp / f"{function_path}-legacy.zip"
+            legacy_bytes = legacy_zip(function_path, legacy_path)
+
+            run_dir = tmp / "run" / function_path
+            paths = [extract(zip_path, run_dir / "task")]
+            if layer_path and files - {"lambda_function.py"}:
+                paths.append(extract(layer_path, run_dir / "opt") / "python")
+            with zipfile.ZipFile(zip_path) as z, zipfile.ZipFile(legacy_path) as legacy:
+                reports.append(BundleReport(
+                    function=function_path,
+                    files=len(z.namelist()),
+                    zip_bytes=zip_bytes,
+                    layer_bytes=layer_bytes if len(paths) > 1 else 0,
+                    legacy_files=len(legacy.namelist()),
+                    legacy_bytes=legacy_bytes,
+                    import_ms=measure_import(python, paths, repeat, dynamic_modules(function_path)),
+                    legacy_import_ms=measure_import(python, [extract(legacy_path, run_dir / "legacy")], repeat, dynamic_modules(function_path)),
+                ))
+    return reports
+
+
+def print_reports(reports: List[BundleReport]):
+    print(f"{'function':<26}{'files':>7}{'zip_kb':>9}{'layer_kb':>10}{'legacy_files':>14}{'legacy_kb':>11}{'import_ms':>11}{'legacy_ms':>11}")
+    for r in reports:
+        print(
+            f"{r.function:<26}{r.files:>7}{r.zip_bytes / 1024:>9.1f}{r.layer_bytes / 1024:>10.1f}"
+            f"{r.legacy_files:>14}{r.legacy_bytes / 1024:>11.1f}{r.import_ms:>11.1f}{r.legacy_import_ms:>11.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--functions", default=",".join(FUNCTIONS), help="カンマ区切りの関数名")
+    parser.add_argument("--python", default=shutil.which(RUNTIME) or sys.executable, help=f"コンパイル・計測に使う Python. ランタイム（{RUNTIME}）と同じバージョンにすること")
+    parser.add_argument("--layer", action="store_true", help="同梱ライブラリを共有レイヤーに分ける")
+    parser.add_argument("--sourceless", action="store_true", help=".py を含めず .pyc のみにする")
+    parser.add_argument("--build-dir", type=Path, default=BUILD_DIR)
+    parser.add_argument("--output", type=Path, help="関数を 1つだけ指定した時の zip の出力先（create_zip.sh から使う）")
+    parser.add_argument("--repeat", type=int, default=5, help="import 時間の計測回数")
+    args = parser.parse_args()
+
+    version = subprocess.run([args.python, "-c", "import sys; print('python%d.%d' % sys.version_info[:2])"], capture_output=True, text=True, check=True).stdout.strip()
+    if version != RUNTIME:
+        print(f"*** {args.python} は {version} です. ランタイム {RUNTIME} では .pyc が使われずコンパイルし直されます ***")
+
+    reports = build(args.functions.split(","), args.python, args.layer, args.sourceless, args.build_dir, args.repeat, args.output)
+    print_reports(reports)
+
+
+if __name__ == "__main__":
+    main()
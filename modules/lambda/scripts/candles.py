@@ -0,0 +1,381 @@
+"""ローカルのローソク足データを扱うモジュール
+
+・OANDA から bid/ask のローソク足をダウンロードし CSV で保存する
+・複数通貨ペアの CSV を時刻で揃えた配列（CandleBook）として読み込む
+・CandleBook を共有メモリに載せ、複数プロセスからコピーせずに読み取り専用で参照する
+
+    python candles.py download --granularity M5 --from 2024-08-01T00:00:00Z --to 2024-09-01T00:00:00Z
+"""
+import argparse
+import csv
+import math
+import os
+import random
+from array import array
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Sequence
+
+DATA_DIR = Path(__file__).resolve().parent / "data" / "candles"
+
+# CandleBook に保持する値の種類. 行のインデックスとして使う
+BID_CLOSE = 0  # bid 終値
+ASK_CLOSE = 1  # ask 終値
+BID_LOW = 2  # bid 安値（Long のストップ判定用）
+ASK_HIGH = 3  # ask 高値（Short のストップ判定用）
+FIELDS = ("bid_c", "ask_c", "bid_l", "ask_h")
+
+CSV_HEADER = (
+    "time",
+    "bid_o",
+    "bid_h",
+    "bid_l",
+    "bid_c",
+    "ask_o",
+    "ask_h",
+    "ask_l",
+    "ask_c",
+)
+
+NAN = float("nan")
+
+# 合成データ用の USD 建てレートの目安
+USD_RATES = {
+    "USD": 1.0,
+    "JPY": 1 / 147.0,
+    "EUR": 1.09,
+    "GBP": 1.28,
+    "AUD": 0.67,
+    "NZD": 0.61,
+    "CAD": 0.73,
+    "CHF": 1.13,
+    "CNH": 0.14,
+    "CZK": 0.043,
+    "DKK": 0.146,
+    "NOK": 0.094,
+    "SEK": 0.096,
+    "HUF": 0.0028,
+    "PLN": 0.25,
+    "HKD": 0.128,
+    "SGD": 0.76,
+    "ZAR": 0.055,
+    "MXN": 0.052,
+    "THB": 0.028,
+    "TRY": 0.03,
+}
+# スプレッドが広い通貨. それ以外は MAJOR_SPREAD を使う
+EXOTIC_CURRENCIES = {"CNH", "CZK", "HUF", "PLN", "ZAR", "MXN", "THB", "TRY"}
+MAJOR_SPREAD = 0.00012  # 中値に対するスプレッドの比率
+EXOTIC_SPREAD = 0.0008
+
+
+def candle_path(instrument: str, granularity: str, data_dir: Path = DATA_DIR):
+    return Path(data_dir) / f"{instrument}_{granularity}.csv"
+
+
+def download(
+    client,
+    instrument: str,
+    granularity: str,
+    from_time: str,
+    to_time: str,
+    data_dir: Path = DATA_DIR,
+    count: int = 5000,
+):
+    """bid/ask のローソク足を期間分ダウンロードし CSV へ保存する関数
+    1リクエスト最大 count 本のため from をずらしながら取得する
+
+    Args:
+        client (oandapyV20.API): API クライアント
+        instrument (str): 通貨ペア. ex) USD_JPY
+        granularity (str): 足の種類. ex) M1, M5, H1
+        from_time (str): 取得開始時刻 (RFC3339)
+        to_time (str): 取得終了時刻 (RFC3339)
+        data_dir (Path, optional): 保存先ディレクトリ
+        count (int, optional): 1リクエストで取得する本数
+
+    Returns:
+        int: 保存した本数
+    """
+    from oandapyV20.endpoints import instruments
+
+    path = candle_path(instrument, granularity, data_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    written = 0
+    cursor = from_time
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        while True:
+            params = {
+                "price": "BA",
+                "granularity": granularity,
+                "from": cursor,
+                "count": count,
+                "includeFirst": cursor == from_time,
+            }
+            r = instruments.InstrumentsCandles(instrument=instrument, params=params)
+            candles = client.request(r).get("candles", [])
+            rows = [
+                c
+                for c in candles
+                if c.get("complete", True) and c["time"] < to_time
+            ]
+            for c in rows:
+                bid, ask = c["bid"], c["ask"]
+                writer.writerow(
+                    (
+                        c["time"],
+                        bid["o"],
+                        bid["h"],
+                        bid["l"],
+                        bid["c"],
+                        ask["o"],
+                        ask["h"],
+                        ask["l"],
+                        ask["c"],
+                    )
+                )
+            written += len(rows)
+            if len(candles) < count or len(rows) < len(candles):
+                break
+            cursor = candles[-1]["time"]
+    print(f"{instrument} {granularity}: {written} 本を {path} へ保存しました")
+    return written
+
+
+class CandleBook:
+    """複数通貨ペアのローソク足を時刻で揃えて保持するクラス
+    値は instrument ごと・FIELDS ごとに n_times 個並んだ 1 本の float 配列として保持する
+        index = (instrument_index * len(FIELDS) + field) * n_times + t
+    データのない時刻は直前の値で埋め、最初の値が出るまでは NaN とする
+    """
+
+    class Prices(NamedTuple):
+        bid: float  # 売値
+        ask: float  # 買値
+        mid: float  # 中値
+
+    instruments: List[str]
+    times: List[str]
+    values: Sequence[float]
+
+    def __init__(self, instruments, times, values) -> None:
+        self.instruments = list(instruments)
+        self.times = list(times)
+        self.values = values
+        self.index = {name: i for i, name in enumerate(self.instruments)}
+
+    @property
+    def n_times(self) -> int:
+        return len(self.times)
+
+    @classmethod
+    def load(
+        cls,
+        instruments: Sequence[str],
+        granularity: str,
+        data_dir: Path = DATA_DIR,
+    ):
+        """CSV から CandleBook を生成する関数. CSV のない通貨ペアは除外する"""
+        series: Dict[str, Dict[str, tuple]] = {}
+        for instrument in instruments:
+            path = candle_path(instrument, granularity, data_dir)
+            if not path.exists():
+                continue
+            with open(path, newline="") as f:
+                series[instrument] = {
+                    row["time"]: (
+                        float(row["bid_c"]),
+                        float(row["ask_c"]),
+                        float(row["bid_l"]),
+                        float(row["ask_h"]),
+                    )
+                    for row in csv.DictReader(f)
+                }
+        if not series:
+            raise Exception(f"{data_dir} に {granularity} のローソク足がありません")
+
+        times = sorted(set().union(*(s.keys() for s in series.values())))
+        names = list(series.keys())
+        n_times = len(times)
+        values = array("d", [NAN]) * (len(names) * len(FIELDS) * n_times)
+        for i, name in enumerate(names):
+            rows = series[name]
+            last = (NAN,) * len(FIELDS)
+            for t, time in enumerate(times):
+                last = rows.get(time, last)
+                for field in range(len(FIELDS)):
+                    values[(i * len(FIELDS) + field) * n_times + t] = last[field]
+        return cls(names, times, values)
+
+    def value(self, instrument: str, field: int, t: int) -> float:
+        i = self.index[instrument]
+        return self.values[(i * len(FIELDS) + field) * self.n_times + t]
+
+    def price_map(self, t: int) -> dict:
+        """時刻 t の bid/ask/mid を Price.price_map と同じ形で返す関数"""
+        n_times = self.n_times
+        width = len(FIELDS) * n_times
+        price_map = {}
+        for i, name in enumerate(self.instruments):
+            bid = self.values[i * width + BID_CLOSE * n_times + t]
+            ask = self.values[i * width + ASK_CLOSE * n_times + t]
+            if math.isnan(bid) or math.isnan(ask):
+                continue
+            price_map[name] = self.Prices(bid, ask, (bid + ask) / 2)
+        return price_map
+
+    def slice(self, start: int, stop: int):
+        """時刻 [start, stop) の範囲を切り出した CandleBook を返す関数"""
+        n_times = self.n_times
+        values = array("d")
+        for i in range(len(self.instruments)):
+            for field in range(len(FIELDS)):
+                offset = (i * len(FIELDS) + field) * n_times
+                values.extend(self.values[offset + start:offset + stop])
+        return CandleBook(self.instruments, self.times[start:stop], values)
+
+
+def synthetic_book(
+    instruments: Sequence[str],
+    n_times: int,
+    seed: int = 0,
+    volatility: float = 0.0003,
+    start: str = "2024-08-05",
+    minutes: int = 5,
+) -> CandleBook:
+    """USD_RATES を起点にランダムウォークする合成のローソク足を生成する関数
+    各通貨の USD 建てレートを動かしクロスレートを計算するため、通貨ペア間で整合した価格になる
+    同じ seed であれば常に同じデータを返す
+
+    Args:
+        instruments (Sequence[str]): 通貨ペア. ex) ["USD_JPY", "EUR_USD"]
+        n_times (int): 足の本数
+        seed (int, optional): 乱数のシード
+        volatility (float, optional): 1本あたりの変動率の標準偏差
+        start (str, optional): 最初の足の日付 (UTC)
+        minutes (int, optional): 足の間隔（分）
+
+    Returns:
+        CandleBook: 合成のローソク足
+    """
+    from datetime import datetime, timedelta, timezone
+
+    rng = random.Random(seed)
+    currencies = sorted({c for name in instruments for c in name.split("_")})
+    rates = {c: USD_RATES.get(c, 1.0) for c in currencies}
+    origin = datetime.fromisoformat(start).replace(tzinfo=timezone.utc)
+    times = [
+        (origin + timedelta(minutes=minutes * t)).strftime("%Y-%m-%dT%H:%M:%S.000000000Z")
+        for t in range(n_times)
+    ]
+    values = array("d", [NAN]) * (len(instruments) * len(FIELDS) * n_times)
+    for t in range(n_times):
+        for c in currencies:
+            if c != "USD":
+                rates[c] *= 1 + rng.gauss(0, volatility)
+        for i, name in enumerate(instruments):
+            base, quote = name.split("_")
+            mid = rates[base] / rates[quote]
+            ratio = (
+                EXOTIC_SPREAD
+                if base in EXOTIC_CURRENCIES or quote in EXOTIC_CURRENCIES
+                else MAJOR_SPREAD
+            )
+            half = mid * ratio / 2
+            swing = mid * volatility * rng.random()
+            row = (mid - half, mid + half, mid - half - swing, mid + half + swing)
+            for field in range(len(FIELDS)):
+                values[(i * len(FIELDS) + field) * n_times + t] = row[field]
+    return CandleBook(instruments, times, values)
+
+
+class SharedCandleBook:
+    """CandleBook の配列を共有メモリに載せるためのクラス
+    親プロセスで create し、ワーカーでは attach で同じメモリを読み取り専用で参照する
+    """
+
+    class Handle(NamedTuple):
+        name: str  # 共有メモリ名
+        instruments: tuple  # 通貨ペア
+        times: tuple  # 時刻
+
+    def __init__(self, shm: shared_memory.SharedMemory, book: CandleBook):
+        self.shm = shm
+        self.book = book
+
+    @classmethod
+    def create(cls, book: CandleBook):
+        size = max(len(book.values) * book.values.itemsize, 1)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        view = shm.buf.cast("d")
+        view[: len(book.values)] = book.values
+        view.release()
+        return cls(shm, book)
+
+    @property
+    def handle(self) -> Handle:
+        return self.Handle(
+            self.shm.name, tuple(self.book.instruments), tuple(self.book.times)
+        )
+
+    @staticmethod
+    def attach(handle: Handle):
+        """ワーカー側で共有メモリを開き、読み取り専用の CandleBook を返す関数"""
+        shm = shared_memory.SharedMemory(name=handle.name)
+        n_values = len(handle.instruments) * len(FIELDS) * len(handle.times)
+        values = shm.buf.cast("d")[:n_values].toreadonly()
+        book = CandleBook(handle.instruments, handle.times, values)
+        book.shm = shm  # GC で共有メモリが閉じられないよう保持する
+        return book
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def main():
+    from lambda_loader import load_handler
+
+    # load_handler はオフライン用のダミーのトークンを補完するため、先に実際のトークンを読んでおく
+    token = os.environ.get("OANDA_RESTAPI_TOKEN")
+    esperanto = load_handler("esperanto_controller")
+    import oandapyV20  # load_handler が同梱の oandapyV20 を sys.path に追加した後に import する
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    sub = parser.add_subparsers(dest="command", required=True)
+    dl = sub.add_parser("download", help="ローソク足をダウンロードする")
+    dl.add_argument("--instruments", nargs="*", default=list(esperanto.Price.main_currency_pairs))
+    dl.add_argument("--granularity", default="M5")
+    dl.add_argument("--from", dest="from_time", required=True)
+    dl.add_argument("--to", dest="to_time", required=True)
+    dl.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    dl.add_argument("--environment", default="practice")
+    args = parser.parse_args()
+    if not token:
+        parser.error("download には環境変数 OANDA_RESTAPI_TOKEN が必要です")
+
+    client = oandapyV20.API(
+        access_token=token,
+        environment=args.environment,
+    )
+    for instrument in args.instruments:
+        download(
+            client,
+            instrument,
+            args.granularity,
+            args.from_time,
+            args.to_time,
+            data_dir=args.data_dir,
+        )
+
+
+if __name__ == "__main__":
+    main()
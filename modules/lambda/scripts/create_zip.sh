@@ -1,5 +1,11 @@
 #!/bin/bash
 echo "$(dirname "$0")/../functions/$1"
+# BUNDLE=1 の時は import グラフで絞り込み .pyc をコンパイル済みの zip を build_bundle.py で生成する
+if [ "${BUNDLE:-0}" = "1" ]; then
+  python3 "$(dirname "$0")/build_bundle.py" --functions "$1" --repeat 1 \
+    --output "$(dirname "$0")/../functions/$1/lambda_function.zip"
+  exit $?
+fi
 cd "$(dirname "$0")/../functions/$1/resources"
 rm ../lambda_function.zip
 zip -r ../lambda_function.zip .
\ No newline at end of file
@@ -0,0 +1,313 @@
+"""esperanto 戦略のパラメータスイープ
+
+(baseline, stop_loss_pips, risk_percentage, universe) の組み合わせをプロセスプールで並列に検証し、
+ひとつのランキング表にまとめる
+ローソク足の配列は共有メモリに一度だけ載せ、各ワーカーはコピーせず読み取り専用で参照する
+
+    python esperanto_sweep.py --granularity M5 --baseline 0.00001 0.00005 --stop-loss 10 30 \\
+        --risk 0.001 0.002 --universe ALL G10
+"""
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import math
+import os
+from multiprocessing import Pool
+from pathlib import Path
+from typing import List, NamedTuple, Tuple
+
+from candles import (
+    ASK_CLOSE,
+    ASK_HIGH,
+    BID_CLOSE,
+    BID_LOW,
+    DATA_DIR,
+    CandleBook,
+    SharedCandleBook,
+)
+from lambda_loader import load_handler
+
+# 検証する通貨ユニバース. カンマ区切りで任意の通貨を指定することもできる
+UNIVERSES = {
+    "ALL": None,  # Esperanto.vehicle_currencies をそのまま使う
+    "G10": ("USD", "JPY", "EUR", "GBP", "AUD", "NZD", "CAD", "CHF", "NOK", "SEK"),
+    "MAJORS": ("USD", "JPY", "EUR", "GBP", "AUD", "NZD"),
+}
+
+
+class SweepParams(NamedTuple):
+    baseline: float  # esperanto_ratio の閾値
+    stop_loss_pips: float  # ストップロスまでの pips
+    risk_percentage: float  # 証拠金に対するリスクの割合
+    universe: str  # 通貨ユニバース名
+
+
+class SweepResult(NamedTuple):
+    params: SweepParams
+    trades: int = 0  # 取引回数
+    total_pl: float = 0.0  # 損益合計（円）
+    win_rate: float = 0.0  # 勝率
+    max_drawdown: float = 0.0  # 最大ドローダウン（円）
+    stop_outs: int = 0  # ストップロスで決済された回数
+
+
+# ワーカープロセスごとの状態. initializer で設定する
+_worker: dict = {}
+
+
+def resolve_universe(name: str, vehicle_currencies) -> Tuple[str, ...]:
+    if name in UNIVERSES:
+        return tuple(UNIVERSES[name] or vehicle_currencies)
+    return tuple(c.strip() for c in name.split(",") if c.strip())
+
+
+def pip_size(price: float) -> float:
+    """calculate_units と同じ基準で 1pip の値幅を返す関数"""
+    return 0.01 if price > 1 else 0.0001
+
+
+def to_jpy(price, currency: str) -> float:
+    """通貨 1単位の円換算レートを返す関数. 直接のペアがなければ USD を経由する"""
+    if currency == "JPY":
+        return 1.0
+    try:
+        return price.get_price_from_pricemap(f"{currency}_JPY")
+    except KeyError:
+        return price.get_price_from_pricemap(
+            f"{currency}_USD"
+        ) * price.get_price_from_pricemap("USD_JPY")
+
+
+def _init_worker(handle, holding: int, step: int):
+    """ワーカーの初期化. 共有メモリの CandleBook を開き、ハンドラを読み込む"""
+    _worker["book"] = SharedCandleBook.attach(handle)
+    _worker["handler"] = load_handler("esperanto_controller")
+    _worker["holding"] = holding
+    _worker["step"] = step
+
+
+def scan_signals(
+    book: CandleBook,
+    handler,
+    baseline: float,
+    universe,
+    start: int = 0,
+    stop: int = None,
+    step: int = 1,
+) -> List[Tuple[int, list, list]]:
+    """時刻 [start, stop) を step 間隔で esperanto スキャンし、(t, long_positions, short_positions) を返す関数"""
+    stop = book.n_times - 1 if stop is None else min(stop, book.n_times - 1)
+    signals = []
+    sink = io.StringIO()
+    for t in range(start, stop, step):
+        price = handler.Price()
+        price.price_map = book.price_map(t)
+        esperanto = handler.Esperanto(price=price, baseline=baseline)
+        esperanto.vehicle_currencies = list(universe)
+        # スキャン中の大量の print は捨てる
+        with contextlib.redirect_stdout(sink):
+            esperanto.scan()
+            esperanto.change_pair()
+        sink.seek(0)
+        sink.truncate()
+        if esperanto.long_positions or esperanto.short_positions:
+            signals.append(
+                (t, list(esperanto.long_positions), list(esperanto.short_positions))
+            )
+    return signals
+
+
+def simulate(
+    book: CandleBook,
+    handler,
+    signals,
+    stop_loss_pips: float,
+    risk_percentage: float,
+    holding: int,
+) -> Tuple[List[Tuple[int, float]], int]:
+    """シグナルに従い発注し、holding 本後またはストップロスで決済した損益を返す関数
+
+    Returns:
+        tuple: ([(決済時刻 t, 損益（円）)], ストップロスで決済された回数)
+    """
+    trades = []
+    stop_outs = 0
+    for t, long_positions, short_positions in signals:
+        exit_t = min(t + holding, book.n_times - 1)
+        price = handler.Price()
+        for side, pairs in ((1, long_positions), (-1, short_positions)):
+            for pair in pairs:
+                bid = book.value(pair, BID_CLOSE, t)
+                ask = book.value(pair, ASK_CLOSE, t)
+                mid = (bid + ask) / 2
+                units = handler.calculate_units(
+                    entry_price=mid,
+                    margin=handler.MARGIN_BASELINE,
+                    risk_percentage=risk_percentage,
+                    stop_loss_pips=stop_loss_pips,
+                )
+                entry = ask if side == 1 else bid
+                stop = entry - side * stop_loss_pips * pip_size(mid)
+                exit_price = None
+                closed_t = exit_t
+                for u in range(t + 1, exit_t + 1):
+                    if side == 1 and book.value(pair, BID_LOW, u) <= stop:
+                        exit_price, closed_t = stop, u
+                        break
+                    if side == -1 and book.value(pair, ASK_HIGH, u) >= stop:
+                        exit_price, closed_t = stop, u
+                        break
+                if exit_price is None:
+                    exit_price = book.value(
+                        pair, BID_CLOSE if side == 1 else ASK_CLOSE, exit_t
+                    )
+                else:
+                    stop_outs += 1
+                price.price_map = book.price_map(closed_t)
+                quote = pair.split("_")[1]
+                pl = side * units * (exit_price - entry) * to_jpy(price, quote)
+                if not math.isnan(pl):
+                    trades.append((closed_t, pl))
+    return trades, stop_outs
+
+
+def summarize(params: SweepParams, trades, stop_outs: int) -> SweepResult:
+    """決済ごとの損益から SweepResult を集計する関数"""
+    pls = [pl for _, pl in sorted(trades)]
+    equity = peak = drawdown = 0.0
+    for pl in pls:
+        equity += pl
+        peak = max(peak, equity)
+        drawdown = max(drawdown, peak - equity)
+    return SweepResult(
+        params,
+        trades=len(pls),
+        total_pl=sum(pls),
+        win_rate=(sum(1 for pl in pls if pl > 0) / len(pls)) if pls else 0.0,
+        max_drawdown=drawdown,
+        stop_outs=stop_outs,
+    )
+
+
+def _run_group(task) -> List[SweepResult]:
+    """(baseline, universe) ごとにスキャンを 1回だけ行い、各 stop_loss/risk の組み合わせを評価する"""
+    baseline, universe_name, universe, risk_stop_grid = task
+    book = _worker["book"]
+    handler = _worker["handler"]
+    signals = scan_signals(
+        book, handler, baseline, universe, step=_worker["step"]
+    )
+    results = []
+    for stop_loss_pips, risk_percentage in risk_stop_grid:
+        trades, stop_outs = simulate(
+            book,
+            handler,
+            signals,
+            stop_loss_pips,
+            risk_percentage,
+            _worker["holding"],
+        )
+        params = SweepParams(
+            baseline, stop_loss_pips, risk_percentage, universe_name
+        )
+        results.append(summarize(params, trades, stop_outs))
+    return results
+
+
+def run_sweep(
+    book: CandleBook,
+    baselines,
+    stop_losses,
+    risks,
+    universes,
+    holding: int = 12,
+    step: int = 1,
+    processes: int = None,
+) -> List[SweepResult]:
+    """グリッドをプロセスプールで検証し、損益合計の降順に並べた結果を返す関数"""
+    handler = load_handler("esperanto_controller")
+    risk_stop_grid = list(itertools.product(stop_losses, risks))
+    tasks = [
+        (
+            baseline,
+            universe_name,
+            resolve_universe(universe_name, handler.Esperanto.vehicle_currencies),
+            risk_stop_grid,
+        )
+        for baseline, universe_name in itertools.product(baselines, universes)
+    ]
+    with SharedCandleBook.create(book) as shared:
+        with Pool(
+            processes=processes,
+            initializer=_init_worker,
+            initargs=(shared.handle, holding, step),
+        ) as pool:
+            results = [r for group in pool.imap_unordered(_run_group, tasks) for r in group]
+    return sorted(results, key=lambda r: r.total_pl, reverse=True)
+
+
+def print_ranking(results: List[SweepResult], top: int = None):
+    header = (
+        f"{'rank':>4} {'baseline':>10} {'sl_pips':>7} {'risk':>7} {'universe':>10} "
+        f"{'trades':>7} {'total_pl':>14} {'win%':>6} {'max_dd':>12} {'stops':>6}"
+    )
+    print(header)
+    print("-" * len(header))
+    for rank, r in enumerate(results[:top], start=1):
+        p = r.params
+        print(
+            f"{rank:>4} {p.baseline:>10g} {p.stop_loss_pips:>7g} {p.risk_percentage:>7g} "
+            f"{p.universe[:10]:>10} {r.trades:>7} {r.total_pl:>14,.0f} "
+            f"{r.win_rate * 100:>6.1f} {r.max_drawdown:>12,.0f} {r.stop_outs:>6}"
+        )
+
+
+def write_csv(results: List[SweepResult], path: Path):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            SweepParams._fields + SweepResult._fields[1:]
+        )
+        for r in results:
+            writer.writerow(tuple(r.params) + tuple(r)[1:])
+
+
+def main():
+    handler = load_handler("esperanto_controller")
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--granularity", default="M5")
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument("--baseline", type=float, nargs="+", default=[handler.ENTRY_BASELINE])
+    parser.add_argument("--stop-loss", type=float, nargs="+", default=[handler.STOP_LOSS_PIPS])
+    parser.add_argument("--risk", type=float, nargs="+", default=[handler.RISK_PERCENTAGE])
+    parser.add_argument("--universe", nargs="+", default=["ALL"])
+    parser.add_argument("--holding", type=int, default=12, help="決済までの足の本数")
+    parser.add_argument("--step", type=int, default=1, help="スキャンする足の間隔")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--top", type=int, default=None)
+    parser.add_argument("--csv", type=Path, default=None)
+    args = parser.parse_args()
+
+    book = CandleBook.load(
+        handler.Price.main_currency_pairs, args.granularity, args.data_dir
+    )
+    print(f"{len(book.instruments)} 通貨ペア x {book.n_times} 本を読み込みました")
+    results = run_sweep(
+        book,
+        args.baseline,
+        args.stop_loss,
+        args.risk,
+        args.universe,
+        holding=args.holding,
+        step=args.step,
+        processes=args.processes,
+    )
+    print_ranking(results, args.top)
+    if args.csv:
+        write_csv(results, args.csv)
+
+
+if __name__ == "__main__":
+    main()
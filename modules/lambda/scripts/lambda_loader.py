@@ -0,0 +1,70 @@
+"""ローカルツールから各 Lambda 関数の lambda_function.py を読み込むためのヘルパー
+
+各関数の lambda_function.py は同名のモジュールであり、import 時に環境変数を参照するため
+オフライン用の環境変数を補完したうえで関数ごとに別名のモジュールとして読み込む
+"""
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+FUNCTIONS_DIR = Path(__file__).resolve().parent.parent / "functions"
+
+# オフライン実行時に補完する環境変数（既に設定されている場合はそちらを優先する）
+OFFLINE_ENVIRONMENT = {
+    "OANDA_ACCOUNT_ID": "000-000-00000000-001",
+    "OANDA_RESTAPI_TOKEN": "offline-token",
+    "OANDA_API_URL": "http://127.0.0.1",
+    "ACCOUNT_MODE": "DEMO",
+    "MARKET_HOURS_CHECK": "0",  # 過去データ・ローカルサーバでは取引時間で打ち切らない
+    "SIGNAL_STORE_BACKEND": "memory",  # /tmp に状態を残さない
+}
+
+
+def resources_dir(function_path: str) -> Path:
+    """関数の resources ディレクトリを返す関数
+
+    Args:
+        function_path (str): functions 配下のディレクトリ名. ex) esperanto_controller
+
+    Returns:
+        Path: resources ディレクトリ
+    """
+    return FUNCTIONS_DIR / function_path / "resources"
+
+
+def use_vendored_packages(function_path: str = "oanda_controller") -> None:
+    """resources 配下に同梱された oandapyV20 等を import できるよう sys.path に追加する関数"""
+    resources = resources_dir(function_path)
+    if str(resources) not in sys.path:
+        sys.path.append(str(resources))
+
+
+def load_handler(function_path: str, module_name: str = None):
+    """lambda_function.py を関数ごとに別名のモジュールとして読み込む関数
+    resources 配下の同梱ライブラリ（oandapyV20 等）を import できるよう sys.path にも追加する
+
+    Args:
+        function_path (str): functions 配下のディレクトリ名. ex) esperanto_controller
+        module_name (str, optional): 登録するモジュール名. Defaults to "<function_path>_lambda_function".
+
+    Returns:
+        module: 読み込んだ lambda_function モジュール
+    """
+    for key, value in OFFLINE_ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+
+    resources = resources_dir(function_path)
+    use_vendored_packages(function_path)
+
+    name = module_name or f"{function_path}_lambda_function"
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.spec_from_file_location(
+        name, resources / "lambda_function.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,288 @@
+"""OANDA v20 REST / ストリーミング API のローカルスタンドインサーバ
+
+PaperTradingAPI（oanda_simulator.py）の状態をそのまま HTTP で提供し、
+requests のセッション再利用・gzip・iter_lines を含む実際のネットワーク経路を計測できるようにする
+・REST: summary / details / changes / instruments / pricing / orders / orders/{id} / pendingOrders / orders/{id}/cancel / openPositions / positions/{instrument}/close / openTrades / trades/{id}/close / trades/{id}/orders / instruments/{instrument}/candles / transactions/{id} / transactions/sinceid / transactions/idrange
+・ストリーミング: pricing/stream, transactions/stream を chunked で返す
+・レイテンシ・ジッター・エラー率・スループット上限を設定できる
+
+oandapyV20 からは environment="local" で接続する（OANDA_LOCAL_API_URL / OANDA_LOCAL_STREAM_URL で上書き可）
+
+    python oanda_local_server.py --port 8080 --latency-ms 30 --jitter-ms 10 --error-rate 0.01
+    OANDA_ENVIRONMENT=local python ../functions/oanda_controller/resources/lambda_function.py
+"""
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import NamedTuple
+from urllib.parse import parse_qsl, urlsplit
+
+from candles import DATA_DIR, CandleBook
+from oanda_simulator import PaperTradingAPI, ReplayPriceFeed
+
+from oandapyV20.endpoints import accounts, instruments, orders, positions, pricing, trades, transactions  # noqa: E402
+from oandapyV20.exceptions import V20Error  # noqa: E402
+
+HEARTBEAT_SECONDS = 5  # ストリームのハートビート間隔
+GZIP_MIN_BYTES = 512  # これ未満のレスポンスは圧縮しない
+
+
+class NetworkProfile(NamedTuple):
+    latency_ms: float = 0.0  # 固定の遅延
+    jitter_ms: float = 0.0  # 遅延のばらつき（±）
+    error_rate: float = 0.0  # 503 を返す割合
+    throughput_kbps: float = 0.0  # 送信速度の上限（KB/s）. 0 なら無制限
+
+
+# (メソッド, パス, エンドポイント生成関数)
+ROUTES = [
+    ("GET", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/summary$"), lambda m, q, d: accounts.AccountSummary(m["a"])),
+    ("GET", re.compile(r"^/v3/accounts/(?P<a>[^/]+)$"), lambda m, q, d: accounts.AccountDetails(m["a"])),
+    ("GET", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/changes$"), lambda m, q, d: accounts.AccountChanges(m["a"], params=q)),
+    ("GET", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/instruments$"), lambda m, q, d: accounts.AccountInstruments(m["a"], params=q)),
+    ("GET", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/pricing$"), lambda m, q, d: pricing.PricingInfo(m["a"], params=q)),
+    ("POST", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/orders$"), lambda m, q, d: orders.OrderCreate(m["a"], data=d)),
+    ("GET", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/pendingOrders$"), lambda m, q, d: orders.OrdersPending(m["a"])),
+    ("GET", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/orders/(?P<o>[^/]+)$"), lambda m, q, d: orders.OrderDetails(m["a"], m["o"])),
+    ("PUT", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/orders/(?P<o>[^/]+)/cancel$"), lambda m, q, d: orders.OrderCancel(m["a"], m["o"])),
+    ("GET", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/openPositions$"), lambda m, q, d: positions.OpenPositions(m["a"])),
+    ("PUT", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/positions/(?P<i>[^/]+)/close$"), lambda m, q, d: positions.PositionClose(m["a"], m["i"], data=d)),
+    ("GET", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/openTrades$"), lambda m, q, d: trades.OpenTrades(m["a"])),
+    ("PUT", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/trades/(?P<t>[^/]+)/close$"), lambda m, q, d: trades.TradeClose(m["a"], m["t"], data=d)),
+    ("PUT", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/trades/(?P<t>[^/]+)/orders$"), lambda m, q, d: trades.TradeCRCDO(m["a"], m["t"], data=d)),
+    ("GET", re.compile(r"^/v3/instruments/(?P<i>[^/]+)/candles$"), lambda m, q, d: instruments.InstrumentsCandles(m["i"], params=q)),
+    ("GET", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/transactions/(?P<t>\d+)$"), lambda m, q, d: transactions.TransactionDetails(m["a"], m["t"])),
+    ("GET", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/transactions/sinceid$"), lambda m, q, d: transactions.TransactionsSinceID(m["a"], params=q)),
+    ("GET", re.compile(r"^/v3/accounts/(?P<a>[^/]+)/transactions/idrange$"), lambda m, q, d: transactions.TransactionIDRange(m["a"], params=q)),
+]
+PRICING_STREAM = re.compile(r"^/v3/accounts/(?P<a>[^/]+)/pricing/stream$")
+TRANSACTIONS_STREAM = re.compile(r"^/v3/accounts/(?P<a>[^/]+)/transactions/stream$")
+
+
+class LocalOandaServer(ThreadingHTTPServer):
+    """PaperTradingAPI とネットワーク条件を保持する HTTP サーバ"""
+
+    daemon_threads = True
+
+    def __init__(self, address, simulator: PaperTradingAPI, profile: NetworkProfile, tick_seconds: float = 1.0, seed: int = 0):
+        super().__init__(address, LocalOandaHandler)
+        self.simulator = simulator
+        self.profile = profile
+        self.tick_seconds = tick_seconds  # ストリームの送信間隔
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.stats = {"requests": 0, "errors_injected": 0, "bytes_sent": 0, "bytes_received": 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, key: str, n: int = 1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    def start_clock(self, bar_seconds: float):
+        """bar_seconds ごとに価格フィードを 1本進めるスレッドを開始する"""
+
+        def run():
+            while True:
+                time.sleep(bar_seconds)
+                self.simulator.advance()
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+class LocalOandaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive でセッションを再利用できるようにする
+    disable_nagle_algorithm = True  # ヘッダと本文の分割送信で遅延 ACK 待ちにならないようにする
+    server: LocalOandaServer
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- ネットワーク条件 ---
+    def _delay(self):
+        profile = self.server.profile
+        with self.server.random_lock:
+            jitter = self.server.random.uniform(-profile.jitter_ms, profile.jitter_ms)
+            failed = self.server.random.random() < profile.error_rate
+        delay = max(profile.latency_ms + jitter, 0.0) / 1000
+        if delay:
+            time.sleep(delay)
+        return failed
+
+    def _write(self, payload: bytes):
+        """スループット上限に合わせて分割して送信する"""
+        limit = self.server.profile.throughput_kbps * 1024
+        if not limit:
+            self.wfile.write(payload)
+        else:
+            chunk = max(int(limit / 20), 1)  # 50ms 分ずつ送る
+            for offset in range(0, len(payload), chunk):
+                self.wfile.write(payload[offset:offset + chunk])
+                time.sleep(len(payload[offset:offset + chunk]) / limit)
+        self.server.count("bytes_sent", len(payload))
+
+    def _respond(self, status: int, body):
+        payload = json.dumps(body).encode() if not isinstance(body, bytes) else body
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if "gzip" in self.headers.get("Accept-Encoding", "") and len(payload) >= GZIP_MIN_BYTES:
+            payload = gzip.compress(payload, compresslevel=5)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self._write(payload)
+
+    # --- ルーティング ---
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def _dispatch(self, method: str):
+        self.server.count("requests")
+        url = urlsplit(self.path)
+        query = dict(parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        data = json.loads(self.rfile.read(length)) if length else None
+        self.server.count("bytes_received", len(self.requestline) + len(bytes(self.headers)) + length)
+
+        if self._delay():
+            self.server.count("errors_injected")
+            self._respond(503, {"errorMessage": "Service Unavailable (injected)"})
+            return
+
+        if method == "GET" and PRICING_STREAM.match(url.path):
+            self._pricing_stream(query)
+            return
+        if method == "GET" and TRANSACTIONS_STREAM.match(url.path):
+            self._transactions_stream()
+            return
+
+        for route_method, pattern, factory in ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                endpoint = factory(match.groupdict(), query, data)
+                try:
+                    self._respond(endpoint.expected_status, self.server.simulator.request(endpoint))
+                except V20Error as e:
+                    body = e.msg if isinstance(e.msg, str) else json.dumps(e.msg)
+                    try:
+                        self._respond(e.code, json.loads(body))
+                    except ValueError:
+                        self._respond(e.code, {"errorMessage": body})
+                return
+        self._respond(404, {"errorMessage": f"{method} {url.path} はサポートされていません"})
+
+    # --- ストリーミング ---
+    def _send_chunk(self, record: dict):
+        line = json.dumps(record).encode() + b"\n"
+        self._write(b"%x\r\n%s\r\n" % (len(line), line))
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _heartbeat(self, last: float, record: dict) -> float:
+        now = time.monotonic()
+        if now - last >= HEARTBEAT_SECONDS:
+            self._send_chunk(record)
+            return now
+        return last
+
+    def _pricing_stream(self, query: dict):
+        simulator = self.server.simulator
+        instruments = query.get("instruments", "").split(",")
+        endpoint = pricing.PricingInfo(simulator.account_id, params={"instruments": ",".join(instruments)})
+        self._start_stream()
+        last_heartbeat = time.monotonic()
+        last_time = None
+        try:
+            while True:
+                prices = simulator.request(endpoint)["prices"]
+                if prices and prices[0]["time"] != last_time:
+                    last_time = prices[0]["time"]
+                    for price in prices:
+                        self._send_chunk(price)
+                last_heartbeat = self._heartbeat(last_heartbeat, {"type": "HEARTBEAT", "time": simulator.feed.time})
+                time.sleep(self.server.tick_seconds)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def _transactions_stream(self):
+        simulator = self.server.simulator
+        since = simulator.last_transaction_id
+        self._start_stream()
+        last_heartbeat = time.monotonic()
+        try:
+            while True:
+                with simulator._lock:
+                    new = [t for t in simulator.transactions if int(t["id"]) > since]
+                for transaction in new:
+                    self._send_chunk(transaction)
+                    since = int(transaction["id"])
+                last_heartbeat = self._heartbeat(
+                    last_heartbeat,
+                    {"type": "HEARTBEAT", "time": simulator.feed.time, "lastTransactionID": str(since)},
+                )
+                time.sleep(self.server.tick_seconds)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+
+def serve(host: str, port: int, simulator: PaperTradingAPI, profile: NetworkProfile, tick_seconds: float = 1.0, bar_seconds: float = 0.0, seed: int = 0) -> LocalOandaServer:
+    """サーバを別スレッドで起動して返す関数（ベンチマークから使う）"""
+    server = LocalOandaServer((host, port), simulator, profile, tick_seconds=tick_seconds, seed=seed)
+    if bar_seconds:
+        server.start_clock(bar_seconds)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    from lambda_loader import load_handler
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throughput-kbps", type=float, default=0.0)
+    parser.add_argument("--tick-seconds", type=float, default=1.0, help="ストリームの送信間隔")
+    parser.add_argument("--bar-seconds", type=float, default=0.0, help="価格フィードを 1本進める間隔. 0 なら進めない")
+    parser.add_argument("--granularity", default=None, help="指定すると data-dir の記録済みローソク足を再生する")
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    instruments = load_handler("esperanto_controller").Price.main_currency_pairs
+    if args.granularity:
+        feed = ReplayPriceFeed(CandleBook.load(instruments, args.granularity, args.data_dir))
+    else:
+        feed = ReplayPriceFeed.synthetic(instruments, n_times=10000, seed=args.seed)
+    profile = NetworkProfile(args.latency_ms, args.jitter_ms, args.error_rate, args.throughput_kbps)
+    server = LocalOandaServer(
+        (args.host, args.port), PaperTradingAPI(feed), profile, tick_seconds=args.tick_seconds, seed=args.seed
+    )
+    if args.bar_seconds:
+        server.start_clock(args.bar_seconds)
+    print(f"http://{args.host}:{args.port} で待ち受けます {profile}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(server.stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1106 @@
+"""OANDA v20 API のローカル paper-trading シミュレータ
+
+oandapyV20.API.request と同じ request(endpoint) インタフェースを持ち、
+DEMO 口座の代わりにプロセス内で注文を約定させる
+・成行注文は再生中の価格フィード（CandleBook）の bid/ask で約定する
+・トレード・ポジション・証拠金・スワップ（financing）を保持する
+・stopLossOnFill / takeProfitOnFill（TradeCRCDO で変更・トレーリングストップも可）はトレードに紐づく注文として保持し、
+  advance() で価格が達したら決済する. OrdersPending / OrderCancel で一覧・取消できる
+・約定した成行注文は OrderDetails（@クライアント注文 ID も可）で参照でき、同じクライアント注文 ID の注文は
+  CLIENT_ORDER_ID_ALREADY_EXISTS で拒否する
+・InstrumentsCandles は再生中の足（mid のみ）を返す. granularity は CandleBook の足のまま
+・ネットワークに一切アクセスしないため、各 lambda_handler をオフラインで高速に実行・計測できる
+
+    from oanda_simulator import PaperTradingAPI, ReplayPriceFeed
+    sim = PaperTradingAPI(ReplayPriceFeed.synthetic(instruments, n_times=1000))
+    with sim.attached(handler_module):
+        handler_module.lambda_handler(None, None)
+"""
+import contextlib
+import json
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Sequence
+
+from candles import ASK_CLOSE, ASK_HIGH, BID_CLOSE, BID_LOW, CandleBook, synthetic_book
+from lambda_loader import OFFLINE_ENVIRONMENT, use_vendored_packages
+
+use_vendored_packages()
+
+import oandapyV20  # noqa: E402
+from oandapyV20.exceptions import V20Error  # noqa: E402
+
+# 各通貨の政策金利の目安（年率 %）. スワップの計算に使う
+INTEREST_RATES = {
+    "USD": 5.25,
+    "JPY": 0.1,
+    "EUR": 3.75,
+    "GBP": 5.0,
+    "AUD": 4.35,
+    "NZD": 5.5,
+    "CAD": 4.5,
+    "CHF": 1.25,
+    "CNH": 3.35,
+    "CZK": 4.5,
+    "DKK": 3.35,
+    "NOK": 4.5,
+    "SEK": 3.5,
+    "HUF": 6.75,
+    "PLN": 5.75,
+    "HKD": 5.75,
+    "SGD": 3.5,
+    "ZAR": 8.25,
+    "MXN": 10.75,
+    "THB": 2.5,
+    "TRY": 50.0,
+}
+FINANCING_MARKUP = 0.5  # ブローカーのスワップ手数料（年率 %）
+ROLLOVER_HOUR_UTC = 21  # NY 17:00 のロールオーバー（UTC）
+
+PATH_INSTRUMENT = re.compile(r"/positions/([A-Z0-9]+_[A-Z0-9]+)/")
+PATH_TRADE = re.compile(r"/trades/([^/]+)/")
+PATH_ORDER = re.compile(r"/orders/([^/]+)/")
+PATH_TRANSACTION = re.compile(r"/transactions/(\d+)/")
+PATH_CANDLES = re.compile(r"/instruments/([A-Z0-9]+_[A-Z0-9]+)/candles")
+# 注文の種類 -> トレードに保持する紐づく注文の ID の項目
+DEPENDENT_ORDER_KEYS = {
+    "STOP_LOSS": "stopLossOrderID",
+    "TAKE_PROFIT": "takeProfitOrderID",
+    "TRAILING_STOP_LOSS": "trailingStopLossOrderID",
+}
+# TradeCRCDO の項目 -> 注文の種類
+TRADE_ORDER_FIELDS = {"takeProfit": "TAKE_PROFIT", "stopLoss": "STOP_LOSS", "trailingStopLoss": "TRAILING_STOP_LOSS"}
+
+
+class ReplayPriceFeed:
+    """CandleBook の足を順に再生する価格フィード"""
+
+    book: CandleBook
+    cursor: int
+
+    def __init__(self, book: CandleBook, start: int = 0, loop: bool = True) -> None:
+        self.book = book
+        self.cursor = start
+        self.loop = loop
+
+    @classmethod
+    def synthetic(cls, instruments: Sequence[str], n_times: int = 1000, seed: int = 0):
+        """合成のローソク足を再生するフィードを生成する関数"""
+        return cls(synthetic_book(list(instruments), n_times, seed=seed))
+
+    @property
+    def time(self) -> str:
+        return self.book.times[self.cursor]
+
+    def quote(self, instrument: str):
+        """現在の (bid, ask) を返す関数. 再生対象にない通貨ペアは KeyError"""
+        bid = self.book.value(instrument, BID_CLOSE, self.cursor)
+        ask = self.book.value(instrument, ASK_CLOSE, self.cursor)
+        if bid != bid or ask != ask:  # NaN
+            raise KeyError(instrument)
+        return bid, ask
+
+    def advance(self, n: int = 1) -> bool:
+        """n 本進める関数. 末尾に達した場合 loop なら先頭へ戻り、そうでなければ False を返す"""
+        cursor = self.cursor + n
+        if cursor >= self.book.n_times:
+            if not self.loop:
+                self.cursor = self.book.n_times - 1
+                return False
+            cursor %= self.book.n_times
+        self.cursor = cursor
+        return True
+
+
+class PaperTradingAPI:
+    """oandapyV20.API の代わりに使う paper-trading シミュレータ
+
+    Raises:
+        V20Error: 実際の API と同様に 4xx のエラー
+    """
+
+    environment = "simulator"
+
+    def __init__(
+        self,
+        feed: ReplayPriceFeed,
+        account_id: str = OFFLINE_ENVIRONMENT["OANDA_ACCOUNT_ID"],
+        balance: float = 3000000.0,
+        currency: str = "JPY",
+        margin_rate: float = 0.04,
+        hedging: bool = True,
+        track_bytes: bool = False,
+    ) -> None:
+        self.feed = feed
+        self.account_id = account_id
+        self.currency = currency
+        self.margin_rate = margin_rate
+        self.hedging = hedging  # 両建て口座（OANDA Japan）か
+        self.track_bytes = track_bytes
+        self.balance = balance
+        self.pl = 0.0  # 実現損益合計
+        self.financing = 0.0  # スワップ合計
+        self.trades: Dict[str, dict] = {}  # 保有中のトレード
+        self.orders: Dict[str, dict] = {}  # 未約定の注文（トレードに紐づくストップロス・テイクプロフィット）
+        self.filled_orders: Dict[str, dict] = {}  # 約定した成行注文（OrderDetails で参照する）
+        self.transactions: List[dict] = []
+        self.last_transaction_id = 0
+        self.calls = Counter()  # エンドポイントごとの呼び出し回数
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._lock = threading.RLock()
+        self._rollover_day = self._trading_day(feed.time)
+        self._handlers = {
+            "OrderCreate": self._order_create,
+            "PositionClose": self._position_close,
+            "AccountSummary": self._account_summary,
+            "AccountDetails": self._account_details,
+            "AccountChanges": self._account_changes,
+            "AccountInstruments": self._account_instruments,
+            "PricingInfo": self._pricing_info,
+            "OpenPositions": self._open_positions,
+            "OpenTrades": self._open_trades,
+            "TradeClose": self._trade_close,
+            "OrdersPending": self._orders_pending,
+            "OrderCancel": self._order_cancel,
+            "OrderDetails": self._order_details,
+            "TransactionDetails": self._transaction_details,
+            "TradeCRCDO": self._trade_crcdo,
+            "InstrumentsCandles": self._instruments_candles,
+            "TransactionsSinceID": self._transactions_since_id,
+            "TransactionIDRange": self._transaction_id_range,
+        }
+
+    # --- oandapyV20.API 互換 ---
+    def request(self, endpoint):
+        """エンドポイントを実行しレスポンスを返す関数. 実際の API と同じく endpoint.response を更新する"""
+        name = type(endpoint).__name__
+        handler = self._handlers.get(name)
+        if handler is None:
+            raise V20Error(404, f"{name} はシミュレータでサポートされていません")
+        with self._lock:
+            self.calls[name] += 1
+            if self.track_bytes:
+                body = getattr(endpoint, "data", None)
+                self.bytes_sent += len(json.dumps(body)) if body else 0
+            response = handler(endpoint)
+            if self.track_bytes:
+                self.bytes_received += len(json.dumps(response))
+        endpoint.response = response
+        endpoint.status_code = endpoint.expected_status
+        return response
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @contextlib.contextmanager
+    def attached(self, *modules):
+        """各ハンドラモジュールの client と oandapyV20.API をシミュレータへ差し替えるコンテキストマネージャ"""
+        saved = []
+        for module in modules:
+            if hasattr(module, "client"):
+                saved.append((module, "client", module.client))
+                module.client = self
+        saved.append((oandapyV20, "API", oandapyV20.API))
+        oandapyV20.API = lambda *args, **kwargs: self
+        try:
+            yield self
+        finally:
+            for target, attr, value in reversed(saved):
+                setattr(target, attr, value)
+
+    # --- 時間の進行 ---
+    @staticmethod
+    def _trading_day(time: str):
+        moment = datetime.fromisoformat(time[:19])
+        return (moment - timedelta(hours=ROLLOVER_HOUR_UTC)).date()
+
+    def advance(self, n: int = 1) -> bool:
+        """価格フィードを n 本進め、ロールオーバーを跨いだ場合はスワップを計上する関数"""
+        with self._lock:
+            moved = self.feed.advance(n)
+            day = self._trading_day(self.feed.time)
+            if day > self._rollover_day:
+                self._apply_financing((day - self._rollover_day).days)
+            self._rollover_day = day
+            self._trigger_orders()
+            return moved
+
+    def reset_counters(self):
+        self.calls.clear()
+        self.bytes_sent = self.bytes_received = 0
+
+    # --- 価格と換算 ---
+    def _mid(self, instrument: str) -> float:
+        bid, ask = self.feed.quote(instrument)
+        return (bid + ask) / 2
+
+    def _conversion(self, currency: str) -> float:
+        """currency 1単位の口座通貨換算レートを返す関数. 直接のペアがなければ USD を経由する"""
+        if currency == self.currency:
+            return 1.0
+        for pair, invert in (
+            (f"{currency}_{self.currency}", False),
+            (f"{self.currency}_{currency}", True),
+        ):
+            try:
+                mid = self._mid(pair)
+                return 1 / mid if invert else mid
+            except KeyError:
+                continue
+        if currency == "USD":
+            raise KeyError(f"USD_{self.currency}")
+        return self._conversion_via_usd(currency)
+
+    def _conversion_via_usd(self, currency: str) -> float:
+        try:
+            usd = self._mid(f"{currency}_USD")
+        except KeyError:
+            usd = 1 / self._mid(f"USD_{currency}")
+        return usd * self._conversion("USD")
+
+    # --- 取引 ---
+    def _next_id(self) -> str:
+        self.last_transaction_id += 1
+        return str(self.last_transaction_id)
+
+    def _record(self, transaction: dict) -> dict:
+        transaction.setdefault("accountID", self.account_id)
+        transaction.setdefault("time", self.feed.time)
+        self.transactions.append(transaction)
+        return transaction
+
+    def _reject(self, code: int, transaction_key: str, transaction: dict, error_code: str, message: str):
+        body = {
+            transaction_key: self._record(transaction),
+            "relatedTransactionIDs": [transaction["id"]],
+            "lastTransactionID": str(self.last_transaction_id),
+            "errorCode": error_code,
+            "errorMessage": message,
+        }
+        raise V20Error(code, json.dumps(body))
+
+    def _realized(self, instrument: str, units: float, open_price: float, close_price: float) -> float:
+        quote = instrument.split("_")[1]
+        return units * (close_price - open_price) * self._conversion(quote)
+
+    def _execute(
+        self,
+        instrument: str,
+        units: int,
+        reduce_side: str = None,
+        open_allowed: bool = True,
+        order: dict = None,
+        reason: str = "MARKET_ORDER",
+        trade_id: str = None,
+        order_id: str = None,
+    ):
+        """成行注文を約定させ (orderCreateTransaction, orderFillTransaction) を返す関数
+
+        Args:
+            instrument (str): 通貨ペア
+            units (int): 正の値は買い、負の値は売り
+            reduce_side (str, optional): 決済するトレードの向き. "long" | "short" | None（反対売買を優先しない）
+            open_allowed (bool, optional): 決済後の残りで新規トレードを建てるか
+            order (dict, optional): 注文リクエストの内容
+            reason (str, optional): MARKET_ORDER の reason
+            trade_id (str, optional): 決済するトレードを 1つに限る場合のトレード ID（TradeClose）
+            order_id (str, optional): 既存の注文（ストップロス等）の約定の場合の注文 ID. MARKET_ORDER は作らない
+        """
+        order = order or {}
+        create = None
+        if order_id is None:
+            create = self._record(
+                {
+                    "id": self._next_id(),
+                    "type": "MARKET_ORDER",
+                    "instrument": instrument,
+                    "units": str(units),
+                    "timeInForce": order.get("timeInForce", "FOK"),
+                    "positionFill": order.get("positionFill", "DEFAULT"),
+                    "reason": reason,
+                    **({"clientExtensions": order["clientExtensions"]} if "clientExtensions" in order else {}),
+                    **({"tradeClientExtensions": order["tradeClientExtensions"]} if "tradeClientExtensions" in order else {}),
+                }
+            )
+            order_id = create["id"]
+        bid, ask = self.feed.quote(instrument)
+        price = ask if units > 0 else bid
+        remaining = units
+        trades_closed, trade_reduced, pl = [], None, 0.0
+        closed_trades = []
+
+        # 反対方向のトレードを古い順に決済する
+        if reduce_side is not None:
+            for trade in sorted(self.trades.values(), key=lambda t: int(t["id"])):
+                if remaining == 0:
+                    break
+                current = int(trade["currentUnits"])
+                if trade["instrument"] != instrument or (current > 0) != (reduce_side == "long"):
+                    continue
+                if trade_id is not None and trade["id"] != trade_id:
+                    continue
+                if current * remaining >= 0:
+                    continue
+                closed = -current if abs(current) <= abs(remaining) else remaining
+                realized = self._realized(instrument, -closed, float(trade["price"]), price)
+                pl += realized
+                trade["realizedPL"] = f"{float(trade['realizedPL']) + realized:.4f}"
+                entry = {"tradeID": trade["id"], "units": str(closed), "realizedPL": f"{realized:.4f}", "financing": "0.0000"}
+                if abs(closed) == abs(current):
+                    trades_closed.append(entry)
+                    del self.trades[trade["id"]]
+                    closed_trades.append(trade)
+                else:
+                    trade["currentUnits"] = str(current + closed)
+                    trade_reduced = entry
+                remaining -= closed
+
+        fill_id = self._next_id()
+        trade_opened = None
+        if remaining != 0 and open_allowed:
+            trade = {
+                "id": fill_id,
+                "instrument": instrument,
+                "price": f"{price:.5f}",
+                "openTime": self.feed.time,
+                "initialUnits": str(remaining),
+                "currentUnits": str(remaining),
+                "state": "OPEN",
+                "realizedPL": "0.0000",
+                "financing": "0.0000",
+            }
+            if "tradeClientExtensions" in order:
+                trade["clientExtensions"] = order["tradeClientExtensions"]
+            self.trades[fill_id] = trade
+            trade_opened = {"tradeID": fill_id, "units": str(remaining)}
+
+        self.balance += pl
+        self.pl += pl
+        fill = {
+            "id": fill_id,
+            "type": "ORDER_FILL",
+            "orderID": order_id,
+            "instrument": instrument,
+            "units": str(units - (remaining if not open_allowed else 0)),
+            "price": f"{price:.5f}",
+            "pl": f"{pl:.4f}",
+            "financing": "0.0000",
+            "accountBalance": f"{self.balance:.4f}",
+            "reason": reason,
+        }
+        if "clientExtensions" in order:
+            fill["clientOrderID"] = order["clientExtensions"].get("id")
+        if trade_opened:
+            fill["tradeOpened"] = trade_opened
+        if trades_closed:
+            fill["tradesClosed"] = trades_closed
+        if trade_reduced:
+            fill["tradeReduced"] = trade_reduced
+        self._record(fill)
+        for trade in closed_trades:
+            self._cancel_dependent_orders(trade)
+
+        if self._margin_available() < 0:
+            # 証拠金不足: 約定を取り消して拒否する
+            self._rollback(order_id, fill, pl)
+            self._reject(
+                400,
+                "orderRejectTransaction",
+                {
+                    "id": self._next_id(),
+                    "type": "MARKET_ORDER_REJECT",
+                    "instrument": instrument,
+                    "units": str(units),
+                    "rejectReason": "INSUFFICIENT_MARGIN",
+                    **({"clientExtensions": order["clientExtensions"]} if "clientExtensions" in order else {}),
+                },
+                "INSUFFICIENT_MARGIN",
+                "Insufficient margin to perform request",
+            )
+        return create, fill
+
+    def _rollback(self, create_id: str, fill: dict, pl: float):
+        # 新規のトレードのみ取り消す（証拠金不足は新規建てでのみ起こるため）
+        self.trades.pop(fill["id"], None)
+        self.balance -= pl
+        self.pl -= pl
+        self.transactions = [t for t in self.transactions if t["id"] not in (create_id, fill["id"])]
+
+    def _apply_financing(self, days: int):
+        """保有中のトレードにスワップを計上する関数"""
+        total = 0.0
+        for trade in self.trades.values():
+            base, quote = trade["instrument"].split("_")
+            units = int(trade["currentUnits"])
+            diff = INTEREST_RATES.get(base, 0.0) - INTEREST_RATES.get(quote, 0.0)
+            rate = (diff if units > 0 else -diff) - FINANCING_MARKUP
+            amount = abs(units) * self._mid(trade["instrument"]) * rate / 100 / 365 * days
+            amount *= self._conversion(quote)
+            trade["financing"] = f"{float(trade['financing']) + amount:.4f}"
+            total += amount
+        if not self.trades:
+            return
+        self.balance += total
+        self.financing += total
+        self._record(
+            {
+                "id": self._next_id(),
+                "type": "DAILY_FINANCING",
+                "financing": f"{total:.4f}",
+                "accountBalance": f"{self.balance:.4f}",
+            }
+        )
+
+    # --- 口座の状態 ---
+    def _unrealized(self, trade: dict) -> float:
+        bid, ask = self.feed.quote(trade["instrument"])
+        units = int(trade["currentUnits"])
+        close_price = bid if units > 0 else ask
+        return self._realized(trade["instrument"], units, float(trade["price"]), close_price)
+
+    def _position_value(self) -> float:
+        value = 0.0
+        for trade in self.trades.values():
+            quote = trade["instrument"].split("_")[1]
+            value += abs(int(trade["currentUnits"])) * self._mid(trade["instrument"]) * self._conversion(quote)
+        return value
+
+    def _margin_available(self) -> float:
+        nav = self.balance + sum(self._unrealized(t) for t in self.trades.values())
+        return nav - self._position_value() * self.margin_rate
+
+    def _positions(self) -> List[dict]:
+        positions: Dict[str, dict] = {}
+        for trade in sorted(self.trades.values(), key=lambda t: int(t["id"])):
+            instrument = trade["instrument"]
+            units = int(trade["currentUnits"])
+            position = positions.setdefault(
+                instrument,
+                {
+                    "instrument": instrument,
+                    "long": {"units": 0, "cost": 0.0, "tradeIDs": [], "unrealizedPL": 0.0, "financing": 0.0},
+                    "short": {"units": 0, "cost": 0.0, "tradeIDs": [], "unrealizedPL": 0.0, "financing": 0.0},
+                },
+            )
+            side = position["long" if units > 0 else "short"]
+            side["units"] += units
+            side["cost"] += units * float(trade["price"])
+            side["tradeIDs"].append(trade["id"])
+            side["unrealizedPL"] += self._unrealized(trade)
+            side["financing"] += float(trade["financing"])
+
+        result = []
+        for position in positions.values():
+            for key in ("long", "short"):
+                side = position[key]
+                formatted = {
+                    "units": str(side["units"]),
+                    "pl": "0.0000",
+                    "resettablePL": "0.0000",
+                    "unrealizedPL": f"{side['unrealizedPL']:.4f}",
+                    "financing": f"{side['financing']:.4f}",
+                }
+                if side["units"]:
+                    formatted["averagePrice"] = f"{side['cost'] / side['units']:.5f}"
+                    formatted["tradeIDs"] = side["tradeIDs"]
+                position[key] = formatted
+            position["pl"] = "0.0000"
+            position["unrealizedPL"] = f"{float(position['long']['unrealizedPL']) + float(position['short']['unrealizedPL']):.4f}"
+            position["financing"] = f"{float(position['long']['financing']) + float(position['short']['financing']):.4f}"
+            result.append(position)
+        return result
+
+    # --- エンドポイント ---
+    def _order_create(self, endpoint) -> dict:
+        order = endpoint.data["order"]
+        if order.get("type", "MARKET") != "MARKET":
+            raise V20Error(400, f"{order.get('type')} 注文はシミュレータでサポートされていません")
+        instrument = order["instrument"]
+        units = int(float(order["units"]))
+        position_fill = order.get("positionFill", "DEFAULT")
+        try:
+            self.feed.quote(instrument)
+        except KeyError:
+            raise V20Error(400, json.dumps({"errorMessage": f"Invalid value specified for 'instrument': {instrument}"}))
+        if position_fill == "DEFAULT":
+            position_fill = "OPEN_ONLY" if self.hedging else "REDUCE_FIRST"
+        client_id = order.get("clientExtensions", {}).get("id")
+        if client_id is not None and self._find_client_order(client_id) is not None:
+            self._reject(
+                400,
+                "orderRejectTransaction",
+                {
+                    "id": self._next_id(),
+                    "type": "MARKET_ORDER_REJECT",
+                    "instrument": instrument,
+                    "units": str(units),
+                    "rejectReason": "CLIENT_ORDER_ID_ALREADY_EXISTS",
+                    "clientExtensions": order["clientExtensions"],
+                },
+                "CLIENT_ORDER_ID_ALREADY_EXISTS",
+                "The client Order ID specified is already assigned to another Order",
+            )
+        self._check_on_fill(order, units)
+        opposite = "short" if units > 0 else "long"
+        create, fill = self._execute(
+            instrument,
+            units,
+            reduce_side=None if position_fill == "OPEN_ONLY" else opposite,
+            open_allowed=position_fill != "REDUCE_ONLY",
+            order=order,
+        )
+        self.filled_orders[create["id"]] = {
+            "id": create["id"],
+            "createTime": self.feed.time,
+            "type": "MARKET",
+            "instrument": instrument,
+            "units": str(units),
+            "timeInForce": create["timeInForce"],
+            "positionFill": create["positionFill"],
+            "state": "FILLED",
+            "fillingTransactionID": fill["id"],
+            "filledTime": self.feed.time,
+            **({"tradeOpenedID": fill["tradeOpened"]["tradeID"]} if "tradeOpened" in fill else {}),
+            **({"clientExtensions": order["clientExtensions"]} if "clientExtensions" in order else {}),
+            **({"tradeClientExtensions": order["tradeClientExtensions"]} if "tradeClientExtensions" in order else {}),
+        }
+        related = [create["id"], fill["id"]]
+        if "tradeOpened" in fill:
+            trade = self.trades[fill["tradeOpened"]["tradeID"]]
+            for key, order_type in (
+                ("stopLossOnFill", "STOP_LOSS"),
+                ("takeProfitOnFill", "TAKE_PROFIT"),
+                ("trailingStopLossOnFill", "TRAILING_STOP_LOSS"),
+            ):
+                if key in order:
+                    related.append(self._create_dependent_order(trade, order_type, order[key])["id"])
+        return {
+            "orderCreateTransaction": create,
+            "orderFillTransaction": fill,
+            "relatedTransactionIDs": related,
+            "lastTransactionID": str(self.last_transaction_id),
+        }
+
+    def _check_on_fill(self, order: dict, units: int):
+        """ストップロス・テイクプロフィットが約定見込みの価格に対して損失・利益の側にあるか確かめる関数"""
+        bid, ask = self.feed.quote(order["instrument"])
+        price, sign = (ask, 1) if units > 0 else (bid, -1)
+        for key, reason, loss_side in (
+            ("stopLossOnFill", "STOP_LOSS_ON_FILL_LOSS", True),
+            ("takeProfitOnFill", "TAKE_PROFIT_ON_FILL_LOSS", False),
+        ):
+            if key not in order:
+                continue
+            on_loss_side = sign * (float(order[key]["price"]) - price) < 0
+            if on_loss_side != loss_side:
+                self._reject(
+                    400,
+                    "orderRejectTransaction",
+                    {
+                        "id": self._next_id(),
+                        "type": "MARKET_ORDER_REJECT",
+                        "instrument": order["instrument"],
+                        "units": str(units),
+                        "rejectReason": reason,
+                        **({"clientExtensions": order["clientExtensions"]} if "clientExtensions" in order else {}),
+                    },
+                    reason,
+                    f"The {key} price would close the Trade immediately",
+                )
+
+    def _create_dependent_order(self, trade: dict, order_type: str, details: dict, reason: str = "ON_FILL") -> dict:
+        """トレードに紐づくストップロス・テイクプロフィット・トレーリングストップの注文を作る関数"""
+        # トレーリングストップは価格ではなく距離で指定する
+        level = {"distance": details["distance"]} if order_type == "TRAILING_STOP_LOSS" else {"price": details["price"]}
+        transaction = self._record(
+            {
+                "id": self._next_id(),
+                "type": f"{order_type}_ORDER",
+                "tradeID": trade["id"],
+                **level,
+                "timeInForce": details.get("timeInForce", "GTC"),
+                "reason": reason,
+                **({"clientExtensions": details["clientExtensions"]} if "clientExtensions" in details else {}),
+            }
+        )
+        order = {
+            "id": transaction["id"],
+            "type": order_type,
+            "tradeID": trade["id"],
+            **level,
+            "timeInForce": transaction["timeInForce"],
+            "createTime": self.feed.time,
+            "state": "PENDING",
+            **({"clientExtensions": details["clientExtensions"]} if "clientExtensions" in details else {}),
+        }
+        if order_type == "TRAILING_STOP_LOSS":
+            bid, ask = self.feed.quote(trade["instrument"])
+            long = int(trade["currentUnits"]) > 0
+            order["trailingStopValue"] = f"{bid - float(level['distance']) if long else ask + float(level['distance']):.5f}"
+        self.orders[transaction["id"]] = order
+        trade[DEPENDENT_ORDER_KEYS[order_type]] = transaction["id"]
+        return transaction
+
+    def _cancel_order(self, order_id: str, reason: str) -> dict:
+        self.orders.pop(order_id)
+        return self._record({"id": self._next_id(), "type": "ORDER_CANCEL", "orderID": order_id, "reason": reason})
+
+    def _cancel_dependent_orders(self, trade: dict):
+        for key in DEPENDENT_ORDER_KEYS.values():
+            order_id = trade.pop(key, None)
+            if order_id in self.orders:
+                self._cancel_order(order_id, "LINKED_TRADE_CLOSED")
+
+    def _trigger_orders(self):
+        """価格がストップロス・テイクプロフィットに達したトレードを決済する関数（約定は現在の bid/ask）"""
+        for order in sorted(self.orders.values(), key=lambda o: int(o["id"])):
+            trade = self.trades.get(order["tradeID"])
+            if trade is None or order["id"] not in self.orders:
+                continue
+            units = int(trade["currentUnits"])
+            bid, ask = self.feed.quote(trade["instrument"])
+            current, sign = (bid, 1) if units > 0 else (ask, -1)
+            if order["type"] == "TRAILING_STOP_LOSS":
+                # 価格が有利な方向へ動いた分だけストップを追従させる
+                trailed = current - sign * float(order["distance"])
+                stop = float(order["trailingStopValue"])
+                stop = max(stop, trailed) if sign > 0 else min(stop, trailed)
+                order["trailingStopValue"] = f"{stop:.5f}"
+            else:
+                stop = float(order["price"])
+            distance = sign * (current - stop)
+            if (order["type"] != "TAKE_PROFIT" and distance > 0) or (order["type"] == "TAKE_PROFIT" and distance < 0):
+                continue
+            del self.orders[order["id"]]
+            trade.pop(DEPENDENT_ORDER_KEYS[order["type"]], None)
+            self._execute(
+                trade["instrument"],
+                -units,
+                reduce_side="long" if units > 0 else "short",
+                open_allowed=False,
+                reason=f"{order['type']}_ORDER",
+                trade_id=trade["id"],
+                order_id=order["id"],
+            )
+
+    def _trade_crcdo(self, endpoint) -> dict:
+        """トレードに紐づくテイクプロフィット・ストップロス・トレーリングストップを作成・置換・取消する関数"""
+        trade_id = PATH_TRADE.search(f"{endpoint}/").group(1)
+        trade = self.trades.get(trade_id)
+        if trade is None:
+            raise V20Error(404, json.dumps({"errorCode": "NO_SUCH_TRADE", "errorMessage": f"The Trade specified does not exist: {trade_id}"}))
+        response = {"relatedTransactionIDs": []}
+        for field, order_type in TRADE_ORDER_FIELDS.items():
+            if field not in (endpoint.data or {}):
+                continue
+            replaced = trade.pop(DEPENDENT_ORDER_KEYS[order_type], None)
+            if replaced in self.orders:
+                cancel = self._cancel_order(replaced, "CLIENT_REQUEST_REPLACED")
+                response[f"{field}OrderCancelTransaction"] = cancel
+                response["relatedTransactionIDs"].append(cancel["id"])
+            details = endpoint.data[field]
+            if details is None:  # null は取消のみ
+                continue
+            transaction = self._create_dependent_order(trade, order_type, details, reason="REPLACEMENT" if replaced else "CLIENT_ORDER")
+            response[f"{field}OrderTransaction"] = transaction
+            response["relatedTransactionIDs"].append(transaction["id"])
+        response["lastTransactionID"] = str(self.last_transaction_id)
+        return response
+
+    def _instruments_candles(self, endpoint) -> dict:
+        """現在の足までの直近 count 本を mid の OHLC で返す関数. 始値は前の足の終値とする"""
+        instrument = PATH_CANDLES.search(str(endpoint)).group(1)
+        params = endpoint.params or {}
+        if instrument not in self.feed.book.index:
+            raise V20Error(400, json.dumps({"errorMessage": f"Invalid value specified for 'instrument': {instrument}"}))
+        book, cursor = self.feed.book, self.feed.cursor
+        start = max(0, cursor + 1 - int(params.get("count", 500)))
+        candles = []
+        previous = None
+        for t in range(max(0, start - 1), cursor + 1):
+            bid, ask = book.value(instrument, BID_CLOSE, t), book.value(instrument, ASK_CLOSE, t)
+            if bid != bid or ask != ask:  # NaN
+                continue
+            half_spread = (ask - bid) / 2
+            close = bid + half_spread
+            high = book.value(instrument, ASK_HIGH, t) - half_spread
+            low = book.value(instrument, BID_LOW, t) + half_spread
+            open_ = close if previous is None else previous
+            previous = close
+            if t < start:
+                continue
+            candles.append(
+                {
+                    "complete": t < cursor,
+                    "volume": 1,
+                    "time": book.times[t],
+                    "mid": {
+                        "o": f"{open_:.5f}",
+                        "h": f"{max(high, open_, close):.5f}",
+                        "l": f"{min(low, open_, close):.5f}",
+                        "c": f"{close:.5f}",
+                    },
+                }
+            )
+        return {"instrument": instrument, "granularity": params.get("granularity", "S5"), "candles": candles}
+
+    def _position_close(self, endpoint) -> dict:
+        instrument = PATH_INSTRUMENT.search(f"{endpoint}/").group(1)
+        data = endpoint.data or {}
+        response = {"relatedTransactionIDs": []}
+        for key, side in (("longUnits", "long"), ("shortUnits", "short")):
+            requested = data.get(key)
+            if requested is None or requested == "NONE":
+                continue
+            held = sum(
+                int(t["currentUnits"])
+                for t in self.trades.values()
+                if t["instrument"] == instrument and (int(t["currentUnits"]) > 0) == (side == "long")
+            )
+            if held == 0:
+                self._reject(
+                    400,
+                    f"{side}OrderRejectTransaction",
+                    {"id": self._next_id(), "type": "MARKET_ORDER_REJECT", "instrument": instrument, "rejectReason": "CLOSEOUT_POSITION_DOESNT_EXIST"},
+                    "CLOSEOUT_POSITION_DOESNT_EXIST",
+                    "The Position requested to be closed out does not exist",
+                )
+            units = abs(held) if requested == "ALL" else min(int(requested), abs(held))
+            units = -units if side == "long" else units
+            create, fill = self._execute(
+                instrument,
+                units,
+                reduce_side=side,
+                open_allowed=False,
+                reason="MARKET_ORDER_POSITION_CLOSEOUT",
+            )
+            response[f"{side}OrderCreateTransaction"] = create
+            response[f"{side}OrderFillTransaction"] = fill
+            response["relatedTransactionIDs"] += [create["id"], fill["id"]]
+        response["lastTransactionID"] = str(self.last_transaction_id)
+        return response
+
+    def _trade_close(self, endpoint) -> dict:
+        trade_id = PATH_TRADE.search(f"{endpoint}/").group(1)
+        trade = self.trades.get(trade_id)
+        if trade is None:
+            raise V20Error(404, json.dumps({"errorCode": "NO_SUCH_TRADE", "errorMessage": f"The Trade specified does not exist: {trade_id}"}))
+        current = int(trade["currentUnits"])
+        requested = (endpoint.data or {}).get("units", "ALL")
+        units = abs(current) if requested == "ALL" else min(int(requested), abs(current))
+        create, fill = self._execute(
+            trade["instrument"],
+            -units if current > 0 else units,
+            reduce_side="long" if current > 0 else "short",
+            open_allowed=False,
+            reason="TRADE_CLOSE",
+            trade_id=trade_id,
+        )
+        return {
+            "orderCreateTransaction": create,
+            "orderFillTransaction": fill,
+            "relatedTransactionIDs": [create["id"], fill["id"]],
+            "lastTransactionID": str(self.last_transaction_id),
+        }
+
+    def _account_state(self) -> dict:
+        """価格で変動する口座の値（AccountChanges の state と共通）"""
+        unrealized = sum(self._unrealized(t) for t in self.trades.values())
+        position_value = self._position_value()
+        margin_used = position_value * self.margin_rate
+        nav = self.balance + unrealized
+        return {
+            "unrealizedPL": f"{unrealized:.4f}",
+            "NAV": f"{nav:.4f}",
+            "marginUsed": f"{margin_used:.4f}",
+            "marginAvailable": f"{nav - margin_used:.4f}",
+            "positionValue": f"{position_value:.4f}",
+        }
+
+    def _trade_view(self, trade: dict) -> dict:
+        view = {k: v for k, v in trade.items() if k not in DEPENDENT_ORDER_KEYS.values()}
+        view["unrealizedPL"] = f"{self._unrealized(trade):.4f}"
+        for key in DEPENDENT_ORDER_KEYS.values():
+            if trade.get(key) in self.orders:
+                view[key.removesuffix("ID")] = dict(self.orders[trade[key]])
+        return view
+
+    def _account_details(self, endpoint) -> dict:
+        response = self._account_summary(endpoint)
+        response["account"].update(
+            orders=[dict(o) for o in sorted(self.orders.values(), key=lambda o: int(o["id"]))],
+            trades=[self._trade_view(t) for t in sorted(self.trades.values(), key=lambda t: int(t["id"]))],
+            positions=self._positions(),
+        )
+        return response
+
+    def _account_changes(self, endpoint) -> dict:
+        """sinceTransactionID 以降の取引から changes を組み立て、現在の state と合わせて返す関数"""
+        since = int((endpoint.params or {}).get("sinceTransactionID", 0))
+        transactions = [t for t in self.transactions if int(t["id"]) > since]
+        opened, reduced, closed, instruments = [], [], [], set()
+        orders_created, orders_cancelled, orders_filled = [], [], []
+        for transaction in transactions:
+            if transaction["type"] in ("STOP_LOSS_ORDER", "TAKE_PROFIT_ORDER", "TRAILING_STOP_LOSS_ORDER"):
+                orders_created.append(
+                    self.orders.get(transaction["id"])
+                    or {"id": transaction["id"], "type": transaction["type"][: -len("_ORDER")], "tradeID": transaction["tradeID"], "state": "CANCELLED"}
+                )
+            elif transaction["type"] == "ORDER_CANCEL":
+                orders_cancelled.append({"id": transaction["orderID"], "state": "CANCELLED"})
+            if transaction["type"] != "ORDER_FILL":
+                continue
+            if transaction["reason"] in ("STOP_LOSS_ORDER", "TAKE_PROFIT_ORDER", "TRAILING_STOP_LOSS_ORDER"):
+                orders_filled.append({"id": transaction["orderID"], "state": "FILLED"})
+            instruments.add(transaction["instrument"])
+            if "tradeOpened" in transaction:
+                trade = self.trades.get(transaction["tradeOpened"]["tradeID"])
+                if trade is not None:
+                    opened.append(self._trade_view(trade))
+            if "tradeReduced" in transaction:
+                trade = self.trades.get(transaction["tradeReduced"]["tradeID"])
+                if trade is not None:
+                    reduced.append(self._trade_view(trade))
+            for entry in transaction.get("tradesClosed", []):
+                closed.append({"id": entry["tradeID"], "instrument": transaction["instrument"], "state": "CLOSED", "currentUnits": "0"})
+        positions = {p["instrument"]: p for p in self._positions()}
+        empty = {"units": "0", "pl": "0.0000", "resettablePL": "0.0000", "unrealizedPL": "0.0000", "financing": "0.0000"}
+        changed_positions = [
+            positions.get(i, {"instrument": i, "long": dict(empty), "short": dict(empty), "pl": "0.0000", "unrealizedPL": "0.0000", "financing": "0.0000"})
+            for i in sorted(instruments)
+        ]
+        state = self._account_state()
+        state["trades"] = [{"id": t["id"], "unrealizedPL": f"{self._unrealized(t):.4f}"} for t in self.trades.values()]
+        state["positions"] = [
+            {
+                "instrument": p["instrument"],
+                "netUnrealizedPL": p["unrealizedPL"],
+                "longUnrealizedPL": p["long"]["unrealizedPL"],
+                "shortUnrealizedPL": p["short"]["unrealizedPL"],
+            }
+            for p in positions.values()
+        ]
+        state["orders"] = []
+        return {
+            "changes": {
+                "ordersCreated": orders_created,
+                "ordersCancelled": orders_cancelled,
+                "ordersFilled": orders_filled,
+                "ordersTriggered": [],
+                "tradesOpened": opened,
+                "tradesReduced": reduced,
+                "tradesClosed": closed,
+                "positions": changed_positions,
+                "transactions": transactions,
+            },
+            "state": state,
+            "lastTransactionID": str(self.last_transaction_id),
+        }
+
+    def _account_summary(self, endpoint) -> dict:
+        state = self._account_state()
+        account = {
+            "id": self.account_id,
+            "alias": "Paper Trading",
+            "currency": self.currency,
+            "balance": f"{self.balance:.4f}",
+            "NAV": state["NAV"],
+            "unrealizedPL": state["unrealizedPL"],
+            "pl": f"{self.pl:.4f}",
+            "resettablePL": f"{self.pl:.4f}",
+            "financing": f"{self.financing:.4f}",
+            "marginRate": f"{self.margin_rate}",
+            "marginUsed": state["marginUsed"],
+            "marginAvailable": state["marginAvailable"],
+            "positionValue": state["positionValue"],
+            "openTradeCount": len(self.trades),
+            "openPositionCount": len(self._positions()),
+            "pendingOrderCount": len(self.orders),
+            "hedgingEnabled": self.hedging,
+            "lastTransactionID": str(self.last_transaction_id),
+        }
+        return {"account": account, "lastTransactionID": str(self.last_transaction_id)}
+
+    def _pricing_info(self, endpoint) -> dict:
+        params = endpoint.params or {}
+        prices = []
+        for instrument in params.get("instruments", "").split(","):
+            try:
+                bid, ask = self.feed.quote(instrument)
+            except KeyError:
+                raise V20Error(400, json.dumps({"errorMessage": f"Invalid value specified for 'instruments': {instrument}"}))
+            prices.append(
+                {
+                    "type": "PRICE",
+                    "instrument": instrument,
+                    "time": self.feed.time,
+                    "tradeable": True,
+                    "status": "tradeable",
+                    "bids": [{"price": f"{bid:.5f}", "liquidity": 10000000}],
+                    "asks": [{"price": f"{ask:.5f}", "liquidity": 10000000}],
+                    "closeoutBid": f"{bid:.5f}",
+                    "closeoutAsk": f"{ask:.5f}",
+                }
+            )
+        response = {"prices": prices, "time": self.feed.time}
+        if str(params.get("includeHomeConversions", "")).lower() == "true":
+            currencies = sorted({c for i in params.get("instruments", "").split(",") for c in i.split("_")})
+            response["homeConversions"] = []
+            for currency in currencies:
+                try:
+                    rate = f"{self._conversion(currency):.8f}"
+                except KeyError:
+                    continue
+                response["homeConversions"].append(
+                    {"currency": currency, "accountGain": rate, "accountLoss": rate, "positionValue": rate}
+                )
+        return response
+
+    def _account_instruments(self, endpoint) -> dict:
+        params = endpoint.params or {}
+        names = params["instruments"].split(",") if params.get("instruments") else self.feed.book.instruments
+        instruments = []
+        for name in names:
+            if name not in self.feed.book.index:
+                continue
+            pip_location = -2 if name.endswith("_JPY") else -4
+            instruments.append(
+                {
+                    "name": name,
+                    "type": "CURRENCY",
+                    "displayName": name.replace("_", "/"),
+                    "pipLocation": pip_location,
+                    "displayPrecision": -pip_location + 1,
+                    "tradeUnitsPrecision": 0,
+                    "minimumTradeSize": "1",
+                    "maximumOrderUnits": "100000000",
+                    "marginRate": f"{self.margin_rate:.2f}",
+                }
+            )
+        return {"instruments": instruments, "lastTransactionID": str(self.last_transaction_id)}
+
+    def _open_trades(self, endpoint) -> dict:
+        return {
+            "trades": [self._trade_view(t) for t in sorted(self.trades.values(), key=lambda t: -int(t["id"]))],
+            "lastTransactionID": str(self.last_transaction_id),
+        }
+
+    def _orders_pending(self, endpoint) -> dict:
+        return {
+            "orders": [dict(o) for o in sorted(self.orders.values(), key=lambda o: -int(o["id"]))],
+            "lastTransactionID": str(self.last_transaction_id),
+        }
+
+    def _order_cancel(self, endpoint) -> dict:
+        order_id = PATH_ORDER.search(f"{endpoint}/").group(1)
+        order = self.orders.get(order_id)
+        if order is None:
+            raise V20Error(
+                404,
+                json.dumps({"errorCode": "ORDER_DOESNT_EXIST", "errorMessage": f"The Order specified does not exist: {order_id}"}),
+            )
+        trade = self.trades.get(order.get("tradeID"))
+        if trade is not None:
+            trade.pop(DEPENDENT_ORDER_KEYS[order["type"]], None)
+        cancel = self._cancel_order(order_id, "CLIENT_REQUEST")
+        return {
+            "orderCancelTransaction": cancel,
+            "relatedTransactionIDs": [cancel["id"]],
+            "lastTransactionID": str(self.last_transaction_id),
+        }
+
+    def _find_client_order(self, client_id: str):
+        for order in (*self.orders.values(), *self.filled_orders.values()):
+            if order.get("clientExtensions", {}).get("id") == client_id:
+                return order
+        return None
+
+    def _order_details(self, endpoint) -> dict:
+        """注文 ID または @クライアント注文 ID で注文を返す関数"""
+        specifier = PATH_ORDER.search(f"{endpoint}/").group(1)
+        if specifier.startswith("@"):
+            order = self._find_client_order(specifier[1:])
+        else:
+            order = self.orders.get(specifier) or self.filled_orders.get(specifier)
+        if order is None:
+            raise V20Error(
+                404,
+                json.dumps({"errorCode": "ORDER_DOESNT_EXIST", "errorMessage": f"The Order specified does not exist: {specifier}"}),
+            )
+        return {"order": dict(order), "lastTransactionID": str(self.last_transaction_id)}
+
+    def _transaction_details(self, endpoint) -> dict:
+        transaction_id = PATH_TRANSACTION.search(f"{endpoint}/").group(1)
+        for transaction in reversed(self.transactions):
+            if transaction["id"] == transaction_id:
+                return {"transaction": transaction, "lastTransactionID": str(self.last_transaction_id)}
+        raise V20Error(
+            404,
+            json.dumps({"errorCode": "NO_SUCH_TRANSACTION", "errorMessage": f"The Transaction specified does not exist: {transaction_id}"}),
+        )
+
+    def _open_positions(self, endpoint) -> dict:
+        return {
+            "positions": self._positions(),
+            "lastTransactionID": str(self.last_transaction_id),
+        }
+
+    def _transactions_since_id(self, endpoint) -> dict:
+        since = int((endpoint.params or {}).get("id", 0))
+        transactions = [t for t in self.transactions if int(t["id"]) > since][:1000]
+        return {
+            "transactions": transactions,
+            "lastTransactionID": str(self.last_transaction_id),
+        }
+
+    def _transaction_id_range(self, endpoint) -> dict:
+        params = endpoint.params or {}
+        start, stop = int(params["from"]), int(params["to"])
+        return {
+            "transactions": [t for t in self.transactions if start <= int(t["id"]) <= stop],
+            "lastTransactionID": str(self.last_transaction_id),
+        }
+
+
+def main():
+    """各ハンドラをシミュレータ上で 1回ずつ実行し、API 呼び出し回数と口座の状態を表示する"""
+    import io
+    import time
+
+    from lambda_loader import load_handler
+
+    modules = {
+        name: load_handler(name)
+        for name in ("esperanto_controller", "accumulation_controller", "oanda_controller")
+    }
+    instruments = modules["esperanto_controller"].Price.main_currency_pairs
+    sim = PaperTradingAPI(ReplayPriceFeed.synthetic(instruments, n_times=500, seed=1))
+    webhook = {"body": {"__origin__": "__trading_view__", "ticker": "USDJPY", "orderAction": "buy", "orderContracts": "100", "comment": "", "time": "2024-08-05T00:00:00Z"}}
+    events = {
+        "esperanto_controller": None,
+        "accumulation_controller": None,
+        "oanda_controller": webhook,
+    }
+    for name, module in modules.items():
+        sim.reset_counters()
+        sink = io.StringIO()
+        started = time.perf_counter()
+        with sim.attached(module), contextlib.redirect_stdout(sink):
+            result = module.lambda_handler(events[name], None)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{name}: {result} {elapsed:.1f}ms calls={dict(sim.calls)}")
+        sim.advance()
+    print(json.dumps(sim._account_summary(None)["account"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
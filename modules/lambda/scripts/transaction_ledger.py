@@ -0,0 +1,230 @@
+"""OANDA の取引（Transaction）をローカルの SQLite に蓄積する台帳
+
+・差分は TransactionsSinceID で台帳の最大 ID 以降のみを取得する
+・初回や取得漏れが大きい場合は TransactionIDRange を ID の範囲ごとに並列で取得する
+・SQLite は WAL とし、ページ単位の executemany でまとめて書き込む
+・通貨ペア・種類・時刻の索引を張り、約定や損益の集計をローカルで行う
+
+    python transaction_ledger.py sync --environment practice
+    python transaction_ledger.py report
+    python transaction_ledger.py query "SELECT type, COUNT(*) FROM transactions GROUP BY type"
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, Iterable, List, NamedTuple, Tuple
+
+from lambda_loader import use_vendored_packages
+
+use_vendored_packages()
+
+import oandapyV20  # noqa: E402
+from oandapyV20.endpoints import transactions  # noqa: E402
+from client_pool import ClientPool  # noqa: E402
+
+LEDGER_DIR = Path(__file__).resolve().parent / "data" / "ledger"
+CHUNK_SIZE = 1000  # 1回の TransactionIDRange / TransactionsSinceID で取得する最大件数
+WORKERS = 8  # TransactionIDRange を並列に取得するスレッド数
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    time TEXT NOT NULL,
+    instrument TEXT,
+    units REAL,
+    price REAL,
+    pl REAL,
+    financing REAL,
+    account_balance REAL,
+    order_id TEXT,
+    client_order_id TEXT,
+    reason TEXT,
+    raw TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_instrument_time ON transactions (instrument, time);
+CREATE INDEX IF NOT EXISTS transactions_type_time ON transactions (type, time);
+CREATE INDEX IF NOT EXISTS transactions_time ON transactions (time);
+"""
+
+# よく使う集計. report で実行する
+REPORTS = {
+    "通貨ペアごとの約定・実現損益": """
+        SELECT instrument, COUNT(*) AS fills, SUM(ABS(units)) AS volume, ROUND(SUM(pl), 2) AS pl
+        FROM transactions WHERE type = 'ORDER_FILL'
+        GROUP BY instrument ORDER BY pl DESC
+    """,
+    "日ごとの実現損益・スワップ": """
+        SELECT substr(time, 1, 10) AS day, ROUND(SUM(pl), 2) AS pl, ROUND(SUM(financing), 2) AS financing
+        FROM transactions WHERE type IN ('ORDER_FILL', 'DAILY_FINANCING')
+        GROUP BY day ORDER BY day DESC LIMIT 31
+    """,
+    "種類ごとの件数": """
+        SELECT type, COUNT(*) AS count FROM transactions GROUP BY type ORDER BY count DESC
+    """,
+}
+
+
+class SyncResult(NamedTuple):
+    inserted: int
+    last_transaction_id: int
+    ranges: int  # 並列に取得した TransactionIDRange の数
+    seconds: float
+
+
+def ledger_path(account_id: str, ledger_dir: Path = LEDGER_DIR) -> Path:
+    return Path(ledger_dir) / f"{account_id}.sqlite3"
+
+
+def connect(path: Path) -> sqlite3.Connection:
+    """WAL モードで台帳を開き、テーブルと索引を作る関数"""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def to_float(value):
+    return float(value) if value is not None else None
+
+
+def to_row(transaction: dict) -> Tuple:
+    return (
+        int(transaction["id"]),
+        transaction["type"],
+        transaction.get("time", ""),
+        transaction.get("instrument"),
+        to_float(transaction.get("units")),
+        to_float(transaction.get("price")),
+        to_float(transaction.get("pl")),
+        to_float(transaction.get("financing")),
+        to_float(transaction.get("accountBalance")),
+        transaction.get("orderID"),
+        transaction.get("clientOrderID"),
+        transaction.get("reason"),
+        json.dumps(transaction, separators=(",", ":")),
+    )
+
+
+def insert(connection: sqlite3.Connection, items: Iterable[dict]) -> int:
+    """取引をまとめて書き込み、追加した件数を返す関数（既にある ID は無視する）"""
+    rows = [to_row(t) for t in items]
+    if not rows:
+        return 0
+    with connection:
+        before = connection.total_changes
+        connection.executemany(
+            "INSERT OR IGNORE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        return connection.total_changes - before
+
+
+def last_id(connection: sqlite3.Connection) -> int:
+    return connection.execute("SELECT COALESCE(MAX(id), 0) FROM transactions").fetchone()[0]
+
+
+def id_ranges(start: int, stop: int, chunk: int = CHUNK_SIZE) -> List[Tuple[int, int]]:
+    """[start, stop] を chunk 件ずつの (from, to) に分ける関数"""
+    return [(i, min(i + chunk - 1, stop)) for i in range(start, stop + 1, chunk)]
+
+
+def sync(
+    connection: sqlite3.Connection,
+    client_factory: Callable[[], "oandapyV20.API"],
+    account_id: str,
+    workers: int = WORKERS,
+    chunk: int = CHUNK_SIZE,
+) -> SyncResult:
+    """台帳を最新にする関数
+
+    まず TransactionsSinceID で台帳の最大 ID 以降の 1ページ目と lastTransactionID を取得し、
+    残りがあれば TransactionIDRange を chunk 件ごとに workers スレッドで並列に取得する.
+    書き込みは呼び出し元のスレッドで ID の順に行う. 次の sync は台帳の最大 ID から再開するため、
+    取得に失敗した範囲より後の範囲は書き込まずに例外を送出する（台帳の途中に欠けを作らない）
+
+    Args:
+        connection (sqlite3.Connection): connect() で開いた台帳
+        client_factory (Callable): API クライアントを生成する関数. スレッドごとに 1つ作る
+        account_id (str): 口座 ID
+        workers (int, optional): 並列数
+        chunk (int, optional): 1リクエストの最大件数
+    """
+    started = time.perf_counter()
+    client = client_factory()
+    since = last_id(connection)
+    response = client.request(transactions.TransactionsSinceID(account_id, params={"id": since}))
+    page = response.get("transactions", [])
+    inserted = insert(connection, page)
+    last = int(response["lastTransactionID"])
+    fetched = max([since] + [int(t["id"]) for t in page])
+
+    ranges = id_ranges(fetched + 1, last, chunk) if fetched < last else []
+    if ranges:
+        def fetch(client, id_range):
+            params = {"from": id_range[0], "to": id_range[1]}
+            return client.request(transactions.TransactionIDRange(account_id, params=params)).get("transactions", [])
+
+        with ClientPool(client_factory, workers, "ledger") as pool:
+            for future in [pool.submit(fetch, r) for r in ranges]:
+                inserted += insert(connection, future.result())
+    return SyncResult(inserted, last, len(ranges), time.perf_counter() - started)
+
+
+def report(connection: sqlite3.Connection):
+    for title, sql in REPORTS.items():
+        run_query(connection, sql, title)
+
+
+def run_query(connection: sqlite3.Connection, sql: str, title: str = None):
+    """クエリを実行し、結果と所要時間を表示する関数"""
+    started = time.perf_counter()
+    cursor = connection.execute(sql)
+    rows = cursor.fetchall()
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"# {title or sql.strip()} ({len(rows)} 行, {elapsed:.2f}ms)")
+    print("\t".join(c[0] for c in cursor.description))
+    for row in rows:
+        print("\t".join("" if v is None else str(v) for v in row))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--account-id", default=os.environ.get("OANDA_ACCOUNT_ID"))
+    parser.add_argument("--ledger", type=Path, default=None, help="台帳のパス. 省略時は data/ledger/<口座ID>.sqlite3")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sync_parser = sub.add_parser("sync", help="新しい取引を取得して台帳へ追加する")
+    sync_parser.add_argument("--environment", default=os.environ.get("OANDA_ENVIRONMENT", "practice"))
+    sync_parser.add_argument("--workers", type=int, default=WORKERS)
+    sync_parser.add_argument("--chunk", type=int, default=CHUNK_SIZE)
+    sub.add_parser("report", help="よく使う集計を表示する")
+    query_parser = sub.add_parser("query", help="任意の SQL を実行する")
+    query_parser.add_argument("sql")
+    args = parser.parse_args()
+
+    if not args.account_id:
+        parser.error("--account-id または環境変数 OANDA_ACCOUNT_ID が必要です")
+    connection = connect(args.ledger or ledger_path(args.account_id))
+
+    if args.command == "sync":
+        def client_factory():
+            return oandapyV20.API(access_token=os.environ["OANDA_RESTAPI_TOKEN"], environment=args.environment)
+
+        result = sync(connection, client_factory, args.account_id, workers=args.workers, chunk=args.chunk)
+        print(
+            f"{result.inserted} 件を追加しました（lastTransactionID={result.last_transaction_id}, "
+            f"TransactionIDRange {result.ranges} 回, {result.seconds:.2f}s）"
+        )
+    elif args.command == "report":
+        report(connection)
+    else:
+        run_query(connection, args.sql)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""定時実行戦略（esperanto / accumulation）のウォークフォワード検証
+
+ウィンドウ N でパラメータを最適化し、ウィンドウ N+1 でその結果を検証し、1チャンクずつ前へずらす
+    |---- train (train_chunks チャンク) ----|-- test (1 チャンク) --|
+         |---- train ----|-- test --|  ...
+
+・特徴量（esperanto のシグナル等）はチャンク単位で計算しディスクにキャッシュするため、
+  重なり合うウィンドウで同じ区間を再計算しない
+・チャンクの特徴量計算、ウィンドウごとの最適化/検証はそれぞれプロセスプールで並列に実行する
+・入力はローカルのローソク足のみで、ネットワークには一切アクセスしない.
+  同じデータ・同じ設定であれば out-of-sample のエクイティカーブは常に同じになる
+
+    python walk_forward.py esperanto --granularity M5 --chunk-size 288 --train-chunks 5
+    python walk_forward.py accumulation --granularity H1 --chunk-size 120 --train-chunks 4
+"""
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import pickle
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+from candles import ASK_CLOSE, BID_CLOSE, DATA_DIR, CandleBook, SharedCandleBook
+from esperanto_sweep import (
+    SweepParams,
+    resolve_universe,
+    scan_signals,
+    simulate,
+)
+from lambda_loader import load_handler
+
+CACHE_DIR = Path(__file__).resolve().parent / "data" / "cache" / "walk_forward"
+
+
+class Window(NamedTuple):
+    index: int  # ウィンドウ番号
+    train_chunks: Tuple[int, ...]  # 最適化に使うチャンク
+    test_chunk: int  # 検証に使うチャンク
+
+
+class WindowResult(NamedTuple):
+    window: Window
+    params: tuple  # 最適化で選ばれたパラメータ
+    in_sample_pl: float  # train 区間の損益
+    out_of_sample: List[Tuple[int, float]]  # test 区間の (決済時刻 t, 損益)
+
+
+class FeatureCache:
+    """チャンクごとの特徴量をディスクへ保存するキャッシュ
+    キーはデータ（通貨ペア・時刻範囲）と特徴量パラメータから決まるため、
+    同じデータで再実行した場合も計算済みのチャンクは読み込むだけになる
+    """
+
+    def __init__(self, cache_dir: Path = CACHE_DIR) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(strategy: str, book: CandleBook, start: int, stop: int, params) -> str:
+        source = json.dumps(
+            [
+                strategy,
+                book.instruments,
+                book.times[start],
+                book.times[stop - 1],
+                stop - start,
+                params,
+            ]
+        )
+        return hashlib.sha1(source.encode()).hexdigest()
+
+    def get(self, key: str):
+        path = self.cache_dir / f"{key}.pickle"
+        if not path.exists():
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def put(self, key: str, value) -> None:
+        # 並列に書き込まれても壊れたファイルを読まないよう rename で置き換える
+        path = self.cache_dir / f"{key}.pickle"
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(value, f)
+        os.replace(tmp, path)
+
+
+class EsperantoWalkForward:
+    """esperanto 戦略のウォークフォワード定義
+    特徴量: (baseline, universe) ごとのシグナル. パラメータ: stop_loss_pips, risk_percentage
+    """
+
+    name = "esperanto"
+
+    def __init__(self, baselines, stop_losses, risks, universes, holding=12, step=1) -> None:
+        self.handler = load_handler("esperanto_controller")
+        self.feature_grid = [
+            (baseline, universe)
+            for baseline, universe in itertools.product(baselines, universes)
+        ]
+        self.grid = list(itertools.product(self.feature_grid, stop_losses, risks))
+        self.holding = holding
+        self.step = step
+
+    def features(self, book: CandleBook, start: int, stop: int, feature_params):
+        baseline, universe = feature_params
+        currencies = resolve_universe(universe, self.handler.Esperanto.vehicle_currencies)
+        return scan_signals(
+            book, self.handler, baseline, currencies, start, stop, self.step
+        )
+
+    def evaluate(self, book: CandleBook, features: Dict, params) -> List[Tuple[int, float]]:
+        feature_params, stop_loss_pips, risk_percentage = params
+        trades, _ = simulate(
+            book,
+            self.handler,
+            features[feature_params],
+            stop_loss_pips,
+            risk_percentage,
+            self.holding,
+        )
+        return trades
+
+    def describe(self, params) -> str:
+        (baseline, universe), stop_loss_pips, risk_percentage = params
+        return str(SweepParams(baseline, stop_loss_pips, risk_percentage, universe))
+
+
+class AccumulationWalkForward:
+    """accumulation 戦略のウォークフォワード定義
+    1日1回 USD_JPY Long / USD_MXN Short を積み立て、test 区間の終わりで評価する
+    特徴量: 時間（UTC）ごとのその日最初の足. パラメータ: 積立を行う時間（UTC）
+    """
+
+    name = "accumulation"
+
+    def __init__(self, hours) -> None:
+        self.handler = load_handler("accumulation_controller")
+        self.feature_grid = [None]
+        self.grid = [(None, hour) for hour in hours]
+
+    def features(self, book: CandleBook, start: int, stop: int, feature_params):
+        entries: Dict[int, List[int]] = {}
+        seen = set()
+        for t in range(start, stop):
+            day, hour = book.times[t][:10], int(book.times[t][11:13])
+            if (day, hour) not in seen:
+                seen.add((day, hour))
+                entries.setdefault(hour, []).append(t)
+        return entries
+
+    def evaluate(self, book: CandleBook, features: Dict, params) -> List[Tuple[int, float]]:
+        _, hour = params
+        entries = sorted(features[None].get(hour, []))
+        if not entries:
+            return []
+        # 区間の最後の足で評価する
+        last = max(t for ts in features[None].values() for t in ts)
+        daily_amount = self.handler.calc_daily_amount()
+        trades = []
+        sink = io.StringIO()
+        for t in entries:
+            price_map = book.price_map(t)
+            if "USD_JPY" not in price_map or "USD_MXN" not in price_map:
+                continue
+            with contextlib.redirect_stdout(sink):
+                accumulation = self.handler.Accumulation(daily_amount, price_map)
+            units = accumulation.dairy_usd_amount
+            # USD_JPY Long: 円建て損益
+            pl = units * (
+                book.value("USD_JPY", BID_CLOSE, last)
+                - book.value("USD_JPY", ASK_CLOSE, t)
+            )
+            # USD_MXN Short: ペソ建て損益を円へ換算
+            mxn_jpy = book.value("USD_JPY", BID_CLOSE, last) / book.value(
+                "USD_MXN", ASK_CLOSE, last
+            )
+            pl += (
+                units
+                * (
+                    book.value("USD_MXN", BID_CLOSE, t)
+                    - book.value("USD_MXN", ASK_CLOSE, last)
+                )
+                * mxn_jpy
+            )
+            trades.append((last, pl))
+        return trades
+
+    def describe(self, params) -> str:
+        return f"hour={params[1]:02d}UTC"
+
+
+# ワーカープロセスごとの状態. initializer で設定する
+_worker: dict = {}
+
+
+def _init_worker(handle, strategy_name, strategy_kwargs, cache_dir):
+    _worker["book"] = SharedCandleBook.attach(handle)
+    _worker["strategy"] = STRATEGIES[strategy_name](**strategy_kwargs)
+    _worker["cache"] = FeatureCache(cache_dir)
+
+
+def _chunk_range(chunk: int, chunk_size: int) -> Tuple[int, int]:
+    return chunk * chunk_size, (chunk + 1) * chunk_size
+
+
+def _compute_feature(task):
+    """チャンクの特徴量を計算しキャッシュへ保存する（計算済みなら何もしない）"""
+    chunk, chunk_size, feature_params = task
+    book, strategy, cache = _worker["book"], _worker["strategy"], _worker["cache"]
+    start, stop = _chunk_range(chunk, chunk_size)
+    key = cache.key(strategy.name, book, start, stop, feature_params)
+    if cache.get(key) is None:
+        cache.put(key, strategy.features(book, start, stop, feature_params))
+    return key
+
+
+def _load_features(chunks, chunk_size) -> Dict:
+    """複数チャンクの特徴量をキャッシュから読み込み、特徴量パラメータごとに結合する"""
+    book, strategy, cache = _worker["book"], _worker["strategy"], _worker["cache"]
+    merged = {}
+    for feature_params in strategy.feature_grid:
+        parts = []
+        for chunk in chunks:
+            start, stop = _chunk_range(chunk, chunk_size)
+            parts.append(cache.get(cache.key(strategy.name, book, start, stop, feature_params)))
+        if isinstance(parts[0], dict):
+            combined = {}
+            for part in parts:
+                for k, v in part.items():
+                    combined.setdefault(k, []).extend(v)
+            merged[feature_params] = combined
+        else:
+            merged[feature_params] = [item for part in parts for item in part]
+    return merged
+
+
+def _run_window(task) -> WindowResult:
+    """train 区間で最適なパラメータを選び、test 区間で評価する"""
+    window, chunk_size = task
+    book, strategy = _worker["book"], _worker["strategy"]
+    train = _load_features(window.train_chunks, chunk_size)
+    scores = []
+    for params in strategy.grid:
+        pl = sum(pl for _, pl in strategy.evaluate(book, train, params))
+        scores.append((pl, params))
+    # max は最初の最大値を返すため、同点の場合もグリッドの順序で決まる
+    best_pl, best_params = max(scores, key=lambda s: s[0])
+    test = _load_features((window.test_chunk,), chunk_size)
+    out_of_sample = strategy.evaluate(book, test, best_params)
+    return WindowResult(window, best_params, best_pl, sorted(out_of_sample))
+
+
+def make_windows(n_times: int, chunk_size: int, train_chunks: int) -> List[Window]:
+    n_chunks = n_times // chunk_size
+    return [
+        Window(i, tuple(range(i, i + train_chunks)), i + train_chunks)
+        for i in range(n_chunks - train_chunks)
+    ]
+
+
+def run_walk_forward(
+    book: CandleBook,
+    strategy_name: str,
+    strategy_kwargs: dict,
+    chunk_size: int,
+    train_chunks: int,
+    processes: int = None,
+    cache_dir: Path = CACHE_DIR,
+) -> List[WindowResult]:
+    windows = make_windows(book.n_times, chunk_size, train_chunks)
+    if not windows:
+        raise Exception("ウィンドウを作るだけのローソク足がありません")
+    n_chunks = windows[-1].test_chunk + 1
+    strategy = STRATEGIES[strategy_name](**strategy_kwargs)
+    feature_tasks = [
+        (chunk, chunk_size, feature_params)
+        for chunk in range(n_chunks)
+        for feature_params in strategy.feature_grid
+    ]
+    with SharedCandleBook.create(book) as shared:
+        with Pool(
+            processes=processes,
+            initializer=_init_worker,
+            initargs=(shared.handle, strategy_name, strategy_kwargs, cache_dir),
+        ) as pool:
+            # 1. チャンク単位で特徴量を計算（キャッシュ済みは読み飛ばす）
+            pool.map(_compute_feature, feature_tasks)
+            # 2. ウィンドウごとに最適化・検証
+            results = pool.map(_run_window, [(w, chunk_size) for w in windows])
+    return sorted(results, key=lambda r: r.window.index)
+
+
+def equity_curve(book: CandleBook, results: List[WindowResult]) -> List[Tuple[str, float, float]]:
+    """out-of-sample の損益を時刻順に積み上げたエクイティカーブを返す関数"""
+    trades = sorted(trade for r in results for trade in r.out_of_sample)
+    curve = []
+    equity = 0.0
+    for t, pl in trades:
+        equity += pl
+        curve.append((book.times[t], pl, equity))
+    return curve
+
+
+STRATEGIES = {
+    EsperantoWalkForward.name: EsperantoWalkForward,
+    AccumulationWalkForward.name: AccumulationWalkForward,
+}
+
+
+def main():
+    esperanto = load_handler("esperanto_controller")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("strategy", choices=sorted(STRATEGIES))
+    parser.add_argument("--granularity", default="M5")
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument("--cache-dir", type=Path, default=CACHE_DIR)
+    parser.add_argument("--chunk-size", type=int, default=288, help="1チャンクの足の本数 (= test 区間)")
+    parser.add_argument("--train-chunks", type=int, default=5)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--equity-csv", type=Path, default=None)
+    # esperanto
+    parser.add_argument("--baseline", type=float, nargs="+", default=[esperanto.ENTRY_BASELINE])
+    parser.add_argument("--stop-loss", type=float, nargs="+", default=[esperanto.STOP_LOSS_PIPS])
+    parser.add_argument("--risk", type=float, nargs="+", default=[esperanto.RISK_PERCENTAGE])
+    parser.add_argument("--universe", nargs="+", default=["ALL"])
+    parser.add_argument("--holding", type=int, default=12)
+    parser.add_argument("--step", type=int, default=1)
+    # accumulation
+    parser.add_argument("--hours", type=int, nargs="+", default=list(range(24)))
+    args = parser.parse_args()
+
+    if args.strategy == EsperantoWalkForward.name:
+        strategy_kwargs = dict(
+            baselines=args.baseline,
+            stop_losses=args.stop_loss,
+            risks=args.risk,
+            universes=args.universe,
+            holding=args.holding,
+            step=args.step,
+        )
+        instruments = esperanto.Price.main_currency_pairs
+    else:
+        strategy_kwargs = dict(hours=args.hours)
+        instruments = ("USD_JPY", "USD_MXN")
+
+    book = CandleBook.load(instruments, args.granularity, args.data_dir)
+    results = run_walk_forward(
+        book,
+        args.strategy,
+        strategy_kwargs,
+        args.chunk_size,
+        args.train_chunks,
+        processes=args.processes,
+        cache_dir=args.cache_dir,
+    )
+    strategy = STRATEGIES[args.strategy](**strategy_kwargs)
+    for r in results:
+        oos = sum(pl for _, pl in r.out_of_sample)
+        print(
+            f"window {r.window.index:>3} test={book.times[_chunk_range(r.window.test_chunk, args.chunk_size)[0]]} "
+            f"{strategy.describe(r.params)} in_sample={r.in_sample_pl:,.0f} out_of_sample={oos:,.0f}"
+        )
+    curve = equity_curve(book, results)
+    print(f"out-of-sample 損益合計: {curve[-1][2] if curve else 0:,.0f}")
+    if args.equity_csv:
+        with open(args.equity_csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("time", "pl", "equity"))
+            writer.writerows(curve)
+
+
+if __name__ == "__main__":
+    main()